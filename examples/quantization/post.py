@@ -79,6 +79,9 @@ def main_worker(args):
 
     # Post quantization calibration
     calibrate(ptq_model, context)
+    # Alternatively, you may use the calibration engine of the quantizer, which prefetches the batches in the
+    # background and supports early stopping and resumable calibration, e.g.
+    #   quantizer.calibrate(ptq_model, context.train_loader, max_batches=100, checkpoint_path='calib.pth')
 
     with torch.no_grad():
         ptq_model.eval()
@@ -0,0 +1,237 @@
+import copy
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.quantization as torch_q
+
+from tinynn.graph.quantization.calibration import (
+    Calibrator,
+    Prefetcher,
+    load_observer_state_dict,
+    merge_observer_states,
+    observer_state_dict,
+    rebin_histogram,
+    sync_observer_states,
+)
+from tinynn.graph.quantization.observer import HistogramObserverKL
+from tinynn.graph.quantization.quantizer import PostQuantizer
+from tinynn.graph.tracer import model_tracer
+
+CURRENT_PATH = os.path.abspath(os.path.dirname(__file__))
+
+
+def observed_model():
+    return nn.Sequential(
+        nn.Conv2d(3, 4, 3),
+        torch_q.MinMaxObserver(),
+        nn.ReLU(),
+        HistogramObserverKL(),
+        torch_q.PerChannelMinMaxObserver(ch_axis=1),
+    )
+
+
+class CalibrationModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = nn.Conv2d(3, 4, 3)
+        self.relu = nn.ReLU()
+
+    def forward(self, x):
+        return self.relu(self.conv(x))
+
+
+def batches(num_batches, batch_size=2, size=8, seed=0):
+    torch.manual_seed(seed)
+    return [(torch.randn(batch_size, 3, size, size), torch.zeros(batch_size)) for _ in range(num_batches)]
+
+
+def assert_state_equal(test, a, b):
+    test.assertEqual(a.keys(), b.keys())
+    for name in a:
+        test.assertEqual(a[name].keys(), b[name].keys())
+        for k in a[name]:
+            test.assertTrue(torch.equal(a[name][k], b[name][k]), f'{name}.{k} mismatches')
+
+
+class CalibrationTester(unittest.TestCase):
+    def test_prefetcher(self):
+        data = list(range(10))
+        self.assertEqual(list(Prefetcher(data)), data)
+        self.assertEqual(list(Prefetcher(data, skip=3)), data[3:])
+
+        prefetcher = Prefetcher(data, num_prefetch=1)
+        for i in prefetcher:
+            if i == 2:
+                break
+        prefetcher.close()
+        self.assertIsNone(prefetcher.thread)
+
+    def test_prefetcher_error(self):
+        def gen():
+            yield 1
+            raise ValueError('broken batch')
+
+        with self.assertRaises(ValueError):
+            list(Prefetcher(gen()))
+
+    def test_calibrate(self):
+        data = batches(8)
+
+        expected_model = observed_model()
+        model = observed_model()
+        model.load_state_dict(copy.deepcopy(expected_model.state_dict()))
+
+        with torch.no_grad():
+            for image, _ in data:
+                expected_model(image)
+
+        self.assertEqual(Calibrator().calibrate(model, data), len(data))
+        assert_state_equal(self, observer_state_dict(model), observer_state_dict(expected_model))
+
+        model = observed_model()
+        self.assertEqual(Calibrator(max_batches=3).calibrate(model, data), 3)
+
+    def test_early_stop(self):
+        torch.manual_seed(0)
+        data = [torch.randn(2, 3, 8, 8)] * 20
+
+        model = observed_model()
+        num_batches = Calibrator(tolerance=1e-3, patience=3).calibrate(model, data)
+        self.assertEqual(num_batches, 4)
+
+    def test_resume(self):
+        data = batches(10)
+
+        expected_model = observed_model()
+        init_state = copy.deepcopy(expected_model.state_dict())
+        Calibrator().calibrate(expected_model, data)
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'calib.pth')
+
+            # Interrupted after 6 batches, with the last checkpoint at the 4th batch
+            def interrupted():
+                for i, batch in enumerate(data):
+                    if i == 6:
+                        raise RuntimeError('interrupted')
+                    yield batch
+
+            model = observed_model()
+            model.load_state_dict(init_state)
+            with self.assertRaises(RuntimeError):
+                Calibrator(checkpoint_path=path, checkpoint_interval=4).calibrate(model, interrupted())
+
+            self.assertEqual(torch.load(path)['num_batches'], 4)
+
+            model = observed_model()
+            model.load_state_dict(init_state)
+            self.assertEqual(Calibrator(checkpoint_path=path).calibrate(model, data), len(data))
+            self.assertEqual(torch.load(path)['num_batches'], len(data))
+
+        assert_state_equal(self, observer_state_dict(model), observer_state_dict(expected_model))
+
+    def test_post_quantizer_calibrate(self):
+        with model_tracer():
+            model = CalibrationModel()
+            model.eval()
+            quantizer = PostQuantizer(model, torch.randn(1, 3, 8, 8), work_dir=os.path.join(CURRENT_PATH, 'out'))
+            ptq_model = quantizer.quantize()
+
+        data = batches(5)
+        self.assertEqual(quantizer.calibrate(ptq_model, data, max_batches=4), 4)
+
+        with torch.no_grad():
+            ptq_model = quantizer.convert(ptq_model)
+
+
+def sync_worker(rank, world_size, init_file, output_dir, init_state, data):
+    dist.init_process_group('gloo', init_method=f'file://{init_file}', rank=rank, world_size=world_size)
+
+    model = observed_model()
+    model.load_state_dict(copy.deepcopy(init_state))
+    Calibrator().calibrate(model, data[rank::world_size])
+    torch.save(observer_state_dict(model), os.path.join(output_dir, f'shard_{rank}.pth'))
+
+    sync_observer_states(model)
+    torch.save(observer_state_dict(model), os.path.join(output_dir, f'merged_{rank}.pth'))
+
+    dist.destroy_process_group()
+
+
+class ObserverStateMergeTester(unittest.TestCase):
+    def test_rebin_histogram(self):
+        histogram = torch.tensor([1.0, 2.0, 3.0, 4.0])
+        self.assertTrue(torch.allclose(rebin_histogram(histogram, 0.0, 4.0, 0.0, 4.0, 4), histogram))
+        self.assertTrue(torch.allclose(rebin_histogram(histogram, 0.0, 4.0, 0.0, 8.0, 4), torch.tensor([3.0, 7, 0, 0])))
+        self.assertTrue(
+            torch.allclose(
+                rebin_histogram(histogram, 0.0, 4.0, 0.0, 4.0, 8), torch.tensor([0.5, 0.5, 1, 1, 1.5, 1.5, 2, 2])
+            )
+        )
+        self.assertTrue(
+            torch.allclose(rebin_histogram(histogram, 1.0, 1.0, 0.0, 4.0, 4), torch.tensor([0.0, 10, 0, 0]))
+        )
+
+    def test_merge_observer_states(self):
+        data = batches(8, 16, 32)
+
+        init_state = copy.deepcopy(observed_model().state_dict())
+        expected_model = observed_model()
+        expected_model.load_state_dict(copy.deepcopy(init_state))
+        Calibrator().calibrate(expected_model, data)
+        expected = observer_state_dict(expected_model)
+
+        states = []
+        for i in range(3):
+            model = observed_model()
+            model.load_state_dict(copy.deepcopy(init_state))
+            Calibrator().calibrate(model, data[i::3])
+            states.append(observer_state_dict(model))
+
+        # An idle worker
+        states.append(observer_state_dict(observed_model()))
+
+        model = observed_model()
+        model.load_state_dict(copy.deepcopy(init_state))
+        merged = merge_observer_states(model, states)
+        load_observer_state_dict(model, merged)
+
+        for name in ('1', '4'):
+            for k in ('min_val', 'max_val'):
+                self.assertTrue(torch.equal(merged[name][k], expected[name][k]))
+
+        histogram = merged['3']['histogram']
+        self.assertEqual(merged['3']['min_val'], min(s['3']['min_val'] for s in states[:3]))
+        self.assertEqual(merged['3']['max_val'], max(s['3']['max_val'] for s in states[:3]))
+        self.assertTrue(torch.allclose(histogram.sum(), expected['3']['histogram'].sum()))
+
+        scale, _ = model[3].calculate_qparams()
+        expected_scale, _ = expected_model[3].calculate_qparams()
+        self.assertLess(abs(scale.item() - expected_scale.item()) / expected_scale.item(), 0.05)
+
+    @unittest.skipIf(not hasattr(dist, 'all_gather_object'), 'all_gather_object is not available')
+    def test_sync_observer_states(self):
+        data = batches(6)
+        init_state = observed_model().state_dict()
+        world_size = 2
+
+        with tempfile.TemporaryDirectory() as d:
+            init_file = os.path.join(d, 'init')
+            mp.spawn(sync_worker, args=(world_size, init_file, d, init_state, data), nprocs=world_size)
+
+            shards = [torch.load(os.path.join(d, f'shard_{i}.pth')) for i in range(world_size)]
+            merged = [torch.load(os.path.join(d, f'merged_{i}.pth')) for i in range(world_size)]
+
+        model = observed_model()
+        expected = merge_observer_states(model, shards)
+        for states in merged:
+            assert_state_equal(self, states, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import os
 import unittest
 from distutils.version import LooseVersion
 
@@ -9,7 +10,9 @@ import torch.nn.functional as F
 
 from common_utils import IS_CI
 
-from tinynn.converter import TFLiteConverter
+from tinynn.converter import TFLiteConverter, TFLiteMultiSignatureConverter
+from tinynn.converter.schemas.tflite import schema_generated as tflite
+from tinynn.converter.utils.tflite import parse_model
 
 
 def assert_close(actual, expected, *args, **kwargs):
@@ -65,6 +68,16 @@ def tfl_run_model(path, inputs, outputs):
         return torch.from_numpy(arr)
 
 
+def get_main_graph_op_codes(path):
+    tfl_model = parse_model(path)
+    main_graph = tfl_model.Subgraphs(0)
+    op_codes = []
+    for i in range(main_graph.OperatorsLength()):
+        op_code = tfl_model.OperatorCodes(main_graph.Operators(i).OpcodeIndex())
+        op_codes.append(max(op_code.DeprecatedBuiltinCode(), op_code.BuiltinCode()))
+    return tfl_model.SubgraphsLength(), op_codes
+
+
 def get_model_path():
     size = getattr(get_model_path, 'size', 0)
     model_path = f'out/converter_op_{size}.tflite'
@@ -2020,6 +2033,34 @@ class ConverterOPTester(unittest.TestCase):
         tfl_output = tfl_run_model(model_path, dummy_input, dummy_output)
         assert_close(dummy_output, tfl_output)
 
+    def test_multi_head_self_attention(self):
+        dummy_input = torch.randn(2, 10, 32, dtype=torch.float32)
+
+        class Model(nn.Module):
+            def __init__(self) -> None:
+                super().__init__()
+                self.q = nn.Linear(32, 32)
+                self.k = nn.Linear(32, 32)
+                self.v = nn.Linear(32, 32)
+
+            def forward(self, x):
+                q = self.q(x).view(2, 10, 4, 8).permute(0, 2, 1, 3)
+                k = self.k(x).view(2, 10, 4, 8).permute(0, 2, 1, 3)
+                v = self.v(x).view(2, 10, 4, 8).permute(0, 2, 1, 3)
+                attn = torch.softmax(torch.matmul(q, k.transpose(-1, -2)), -1)
+                return torch.matmul(attn, v).permute(0, 2, 1, 3).reshape(2, 10, 32)
+
+        model = Model()
+        model.eval()
+
+        model_path = get_model_path()
+        converter = TFLiteConverter(model, dummy_input, model_path, nchw_transpose=False)
+        converter.convert()
+
+        dummy_output = model(dummy_input)
+        tfl_output = tfl_run_model(model_path, dummy_input, dummy_output)
+        assert_close(dummy_output, tfl_output)
+
     def test_2d_linear(self):
         dummy_input = torch.randn(9, 17, dtype=torch.float32)
 
@@ -2878,6 +2919,44 @@ class ConverterOPTester(unittest.TestCase):
         tfl_output = tfl_run_model(model_path, dummy_input, dummy_output)
         assert_close(dummy_output, tfl_output)
 
+    def test_gru_multi_layer_with_state_tensor_unroll_while_loop(self):
+        class Model(nn.Module):
+            def __init__(self) -> None:
+                super().__init__()
+                self.gru = nn.GRU(10, 20, 2)
+
+            def forward(self, x, hx):
+                gru, hx = self.gru(x, hx)
+                return gru, hx
+
+        model = Model()
+        model.eval()
+
+        main_graph_op_codes = []
+        for seq_len in (9, 5):
+            dummy_input = [
+                torch.randn(seq_len, 1, 10, dtype=torch.float32),
+                torch.randn(2, 1, 20, dtype=torch.float32),
+            ]
+
+            model_path = get_model_path()
+            converter = TFLiteConverter(
+                model, dummy_input, model_path, nchw_transpose=False, unroll_rnn=True, rnn_while_loop=True
+            )
+            converter.convert()
+
+            dummy_output = model(*dummy_input)
+            tfl_output = tfl_run_model(model_path, dummy_input, dummy_output)
+            assert_close(dummy_output, tfl_output)
+
+            # 2 layers, each with a cond and a body subgraph
+            num_subgraphs, op_codes = get_main_graph_op_codes(model_path)
+            self.assertEqual(num_subgraphs, 5)
+            self.assertEqual(op_codes.count(tflite.BuiltinOperator.WHILE), 2)
+            main_graph_op_codes.append(op_codes)
+
+        self.assertEqual(main_graph_op_codes[0], main_graph_op_codes[1])
+
     def test_bigru(self):
         dummy_input = torch.randn(9, 1, 10, dtype=torch.float32)
 
@@ -3682,6 +3761,78 @@ class ConverterOPTester(unittest.TestCase):
         tfl_output = tfl_run_model(model_path, dummy_input, dummy_output)
         assert_close(dummy_output, tfl_output)
 
+    def test_lstm_unroll_while_loop(self):
+        class Model(nn.Module):
+            def __init__(self) -> None:
+                super().__init__()
+                self.lstm = nn.LSTM(10, 20)
+
+            def forward(self, x):
+                return self.lstm(x)[0]
+
+        model = Model()
+        model.eval()
+
+        main_graph_op_codes = []
+        for seq_len in (9, 5):
+            dummy_input = torch.randn(seq_len, 1, 10, dtype=torch.float32)
+
+            model_path = get_model_path()
+            converter = TFLiteConverter(
+                model, dummy_input, model_path, nchw_transpose=False, unroll_rnn=True, rnn_while_loop=True
+            )
+            converter.convert()
+
+            dummy_output = model(dummy_input)
+            tfl_output = tfl_run_model(model_path, dummy_input, dummy_output)
+            assert_close(dummy_output, tfl_output)
+
+            num_subgraphs, op_codes = get_main_graph_op_codes(model_path)
+            self.assertEqual(num_subgraphs, 3)
+            self.assertEqual(op_codes.count(tflite.BuiltinOperator.WHILE), 1)
+            main_graph_op_codes.append(op_codes)
+
+        self.assertEqual(main_graph_op_codes[0], main_graph_op_codes[1])
+
+    def test_bilstm_multi_layer_with_state_tensor_unroll_while_loop(self):
+        class Model(nn.Module):
+            def __init__(self) -> None:
+                super().__init__()
+                self.lstm = nn.LSTM(10, 20, 2, batch_first=True, bidirectional=True)
+
+            def forward(self, x, hx, cx):
+                lstm, (hx, cx) = self.lstm(x, (hx, cx))
+                return lstm, hx, cx
+
+        model = Model()
+        model.eval()
+
+        main_graph_op_codes = []
+        for seq_len in (9, 5):
+            dummy_input = [
+                torch.randn(1, seq_len, 10, dtype=torch.float32),
+                torch.randn(4, 1, 20, dtype=torch.float32),
+                torch.randn(4, 1, 20, dtype=torch.float32),
+            ]
+
+            model_path = get_model_path()
+            converter = TFLiteConverter(
+                model, dummy_input, model_path, nchw_transpose=False, unroll_rnn=True, rnn_while_loop=True
+            )
+            converter.convert()
+
+            dummy_output = model(*dummy_input)
+            tfl_output = tfl_run_model(model_path, dummy_input, dummy_output)
+            assert_close(dummy_output, tfl_output, check_stride=False)
+
+            # 2 layers x 2 directions, each with a cond and a body subgraph
+            num_subgraphs, op_codes = get_main_graph_op_codes(model_path)
+            self.assertEqual(num_subgraphs, 9)
+            self.assertEqual(op_codes.count(tflite.BuiltinOperator.WHILE), 4)
+            main_graph_op_codes.append(op_codes)
+
+        self.assertEqual(main_graph_op_codes[0], main_graph_op_codes[1])
+
     def test_bilstm_unroll_separated(self):
         dummy_input = torch.randn(9, 1, 10, dtype=torch.float32)
 
@@ -5310,6 +5461,118 @@ class ConverterOPTester(unittest.TestCase):
         tfl_output = tfl_run_model(model_path, dummy_input, dummy_output)
         assert_close(dummy_output, tfl_output, atol=256.0, rtol=256.0)
 
+    def test_multi_signature(self):
+        inputs = {
+            'small': torch.randn(1, 3, 16, 16, dtype=torch.float32),
+            'large': torch.randn(2, 3, 32, 32, dtype=torch.float32),
+        }
+
+        class Model(nn.Module):
+            def __init__(self) -> None:
+                super().__init__()
+                self.conv = nn.Conv2d(3, 8, 3)
+                self.fc = nn.Linear(8, 1000)
+
+            def forward(self, x):
+                return self.fc(self.conv(x).mean((2, 3)))
+
+        model = Model()
+        model.eval()
+
+        model_path = get_model_path()
+        converter = TFLiteMultiSignatureConverter(
+            {k: (model, v) for k, v in inputs.items()}, model_path, nchw_transpose=False
+        )
+        converter.convert()
+
+        interpreter = tf.lite.Interpreter(model_path=model_path)
+        signatures = interpreter.get_signature_list()
+        self.assertEqual(list(signatures.keys()), list(inputs.keys()))
+
+        for key, dummy_input in inputs.items():
+            runner = interpreter.get_signature_runner(key)
+            input_name = signatures[key]['inputs'][0]
+            output_name = signatures[key]['outputs'][0]
+            tfl_output = runner(**{input_name: dummy_input.numpy()})[output_name]
+
+            dummy_output = model(dummy_input)
+            assert_close(dummy_output, torch.from_numpy(tfl_output))
+
+        # The weights are shared across the signatures
+        single_path = get_model_path()
+        converter = TFLiteConverter(model, inputs['small'], single_path, nchw_transpose=False)
+        converter.convert()
+
+        weight_size = sum(p.numel() * p.element_size() for p in model.parameters())
+        self.assertLess(os.path.getsize(model_path), os.path.getsize(single_path) + weight_size // 2)
+
+    def test_dynamic_axes(self):
+        dummy_input = torch.randn(2, 3, 16, 16, dtype=torch.float32)
+
+        class Model(nn.Module):
+            def __init__(self) -> None:
+                super().__init__()
+                self.conv = nn.Conv2d(3, 8, 3, padding=1)
+                self.pool = nn.AdaptiveAvgPool2d(4)
+                self.fc = nn.Linear(128, 10)
+
+            def forward(self, x):
+                x = self.pool(F.relu(self.conv(x)))
+                x = x.view(x.size(0), -1)
+                return self.fc(x), x[:, :5]
+
+        model = Model()
+        model.eval()
+
+        model_path = get_model_path()
+        converter = TFLiteConverter(model, dummy_input, model_path, dynamic_axes={0: [0]})
+        converter.convert()
+
+        interpreter = tf.lite.Interpreter(model_path=model_path)
+        input_details = interpreter.get_input_details()
+        output_details = interpreter.get_output_details()
+        self.assertEqual(input_details[0]['shape_signature'].tolist(), [-1, 16, 16, 3])
+        self.assertEqual([o['shape_signature'].tolist() for o in output_details], [[-1, 10], [-1, 5]])
+
+        for batch_size in (1, 5):
+            dummy_input = torch.randn(batch_size, 3, 16, 16, dtype=torch.float32)
+            interpreter.resize_tensor_input(input_details[0]['index'], [batch_size, 16, 16, 3], strict=True)
+            interpreter.allocate_tensors()
+            interpreter.set_tensor(input_details[0]['index'], dummy_input.permute(0, 2, 3, 1).numpy())
+            interpreter.invoke()
+
+            dummy_output = model(dummy_input)
+            tfl_output = [torch.from_numpy(interpreter.get_tensor(o['index'])) for o in output_details]
+            assert_close(dummy_output, tfl_output)
+
+    def test_dynamic_axes_rnn_while_loop(self):
+        dummy_input = torch.randn(9, 2, 10, dtype=torch.float32)
+
+        class Model(nn.Module):
+            def __init__(self) -> None:
+                super().__init__()
+                self.lstm = nn.LSTM(10, 20)
+
+            def forward(self, x):
+                return self.lstm(x)[0]
+
+        model = Model()
+        model.eval()
+
+        for axis in (0, 1):
+            model_path = get_model_path()
+            converter = TFLiteConverter(
+                model,
+                dummy_input,
+                model_path,
+                nchw_transpose=False,
+                unroll_rnn=True,
+                rnn_while_loop=True,
+                dynamic_axes={0: [axis]},
+            )
+            with self.assertRaisesRegex(AssertionError, 'While with dynamic inputs is not supported'):
+                converter.convert()
+
 
 class ConverterQuantizedOPTester(unittest.TestCase):
     backend: str
@@ -1,5 +1,7 @@
+import math
 import unittest
 
+import tensorflow as tf
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -7,6 +9,8 @@ import torch.nn.functional as F
 from common_utils import IS_CI
 
 from tinynn.converter import TFLiteConverter
+from tinynn.converter.operators.base import ExtendedOperator
+from tinynn.converter.operators.target import TargetProfile
 from tinynn.converter.schemas.tflite import schema_generated as tflite
 from tinynn.converter.utils.tflite import parse_model
 
@@ -2254,6 +2258,178 @@ class ConverterOptimizerTester(unittest.TestCase):
         self.assertEqual(tfl_model.Subgraphs(0).Operators(4).InputsLength(), 2)
         self.assertEqual(tfl_model.Subgraphs(0).Operators(5).InputsLength(), 4)
 
+    def test_target_profile_decompose_rsqrt(self):
+        class TestModel(nn.Module):
+            def forward(self, x):
+                y = torch.rsqrt(x)
+                return y
+
+        model = TestModel()
+        model.eval()
+
+        dummy_input = torch.rand(1, 3, 224, 224) + 1
+        model_path = get_model_path()
+
+        converter = TFLiteConverter(model, dummy_input, model_path, nchw_transpose=False, target_profile='xnnpack')
+        converter.convert()
+
+        tfl_model = parse_model(model_path)
+        self.assertEqual(tfl_model.OperatorCodesLength(), 2)
+        self.assertEqual(tfl_model.OperatorCodes(0).DeprecatedBuiltinCode(), tflite.BuiltinOperator.SQRT)
+        self.assertEqual(tfl_model.OperatorCodes(1).DeprecatedBuiltinCode(), tflite.BuiltinOperator.DIV)
+        self.assertEqual(tfl_model.SubgraphsLength(), 1)
+        self.assertEqual(tfl_model.Subgraphs(0).InputsLength(), 1)
+        self.assertEqual(tfl_model.Subgraphs(0).OutputsLength(), 1)
+        self.assertEqual(tfl_model.Subgraphs(0).OperatorsLength(), 2)
+        self.assertEqual(converter.delegate_partitions, 1)
+
+    def test_target_profile_group_conv(self):
+        class TestModel(nn.Module):
+            def __init__(self) -> None:
+                super().__init__()
+                self.conv = nn.Conv2d(4, 8, 3, groups=2)
+
+            def forward(self, x):
+                y = self.conv(x)
+                return y
+
+        model = TestModel()
+        model.eval()
+
+        dummy_input = torch.randn(1, 4, 224, 224)
+        model_path = get_model_path()
+
+        converter = TFLiteConverter(model, dummy_input, model_path, nchw_transpose=False, target_profile='gpu')
+        converter.convert()
+
+        tfl_model = parse_model(model_path)
+        self.assertEqual(tfl_model.SubgraphsLength(), 1)
+        self.assertEqual(tfl_model.Subgraphs(0).OperatorsLength(), 6)
+        self.assertEqual(converter.delegate_partitions, 1)
+
+    def test_target_profile_partitions(self):
+        class TestModel(nn.Module):
+            def forward(self, x):
+                x = torch.relu(x)
+                x = torch.cumsum(x, 1)
+                x = torch.relu(x)
+                return x
+
+        model = TestModel()
+        model.eval()
+
+        dummy_input = torch.randn(1, 3, 224, 224)
+        model_path = get_model_path()
+
+        converter = TFLiteConverter(model, dummy_input, model_path, nchw_transpose=False, target_profile='gpu')
+        converter.convert()
+
+        tfl_model = parse_model(model_path)
+        self.assertEqual(tfl_model.SubgraphsLength(), 1)
+        self.assertEqual(tfl_model.Subgraphs(0).OperatorsLength(), 3)
+        self.assertEqual(converter.delegate_partitions, 2)
+
+    def test_target_profile_after_quantization(self):
+        class TestModel(nn.Module):
+            def __init__(self) -> None:
+                super().__init__()
+                self.conv = nn.Conv2d(3, 8, 3)
+
+            def forward(self, x):
+                y = self.conv(x)
+                return y
+
+        model = TestModel()
+        model.eval()
+
+        dummy_input = torch.randn(1, 3, 224, 224)
+        model_path = get_model_path()
+
+        # The DEQUANTIZE ops added by the half quantizer are not supported by the profile, so they should be counted
+        profile = TargetProfile(
+            'test',
+            (ExtendedOperator.CONV_2D, ExtendedOperator.TRANSPOSE),
+            ('float32',),
+        )
+        converter = TFLiteConverter(
+            model, dummy_input, model_path, nchw_transpose=False, float16_quantization=True, target_profile=profile
+        )
+        converter.convert()
+
+        tfl_model = parse_model(model_path)
+        op_codes = [
+            tfl_model.OperatorCodes(tfl_model.Subgraphs(0).Operators(i).OpcodeIndex()).DeprecatedBuiltinCode()
+            for i in range(tfl_model.Subgraphs(0).OperatorsLength())
+        ]
+        self.assertIn(tflite.BuiltinOperator.DEQUANTIZE, op_codes)
+        self.assertEqual(converter.delegate_partitions, 2)
+
+    def test_vit_self_attention(self):
+        # The same as `ViTSelfAttention` + `ViTSelfOutput` in transformers, which is used in
+        # examples/quantization/specific/vit
+        class TestModel(nn.Module):
+            def __init__(self, hidden_size=64, num_attention_heads=4) -> None:
+                super().__init__()
+                self.num_attention_heads = num_attention_heads
+                self.attention_head_size = hidden_size // num_attention_heads
+                self.all_head_size = hidden_size
+                self.query = nn.Linear(hidden_size, self.all_head_size)
+                self.key = nn.Linear(hidden_size, self.all_head_size)
+                self.value = nn.Linear(hidden_size, self.all_head_size)
+                self.dense = nn.Linear(hidden_size, hidden_size)
+
+            def transpose_for_scores(self, x):
+                new_x_shape = x.size()[:-1] + (self.num_attention_heads, self.attention_head_size)
+                x = x.view(new_x_shape)
+                return x.permute(0, 2, 1, 3)
+
+            def forward(self, hidden_states):
+                query_layer = self.transpose_for_scores(self.query(hidden_states))
+                key_layer = self.transpose_for_scores(self.key(hidden_states))
+                value_layer = self.transpose_for_scores(self.value(hidden_states))
+
+                attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
+                attention_scores = attention_scores / math.sqrt(self.attention_head_size)
+                attention_probs = nn.functional.softmax(attention_scores, dim=-1)
+
+                context_layer = torch.matmul(attention_probs, value_layer)
+                context_layer = context_layer.permute(0, 2, 1, 3).contiguous()
+                new_context_layer_shape = context_layer.size()[:-2] + (self.all_head_size,)
+                context_layer = context_layer.view(new_context_layer_shape)
+                return self.dense(context_layer)
+
+        model = TestModel()
+        model.eval()
+
+        dummy_input = torch.randn(1, 10, 64)
+        model_path = get_model_path()
+
+        converter = TFLiteConverter(model, dummy_input, model_path, nchw_transpose=False)
+        converter.convert()
+
+        tfl_model = parse_model(model_path)
+        self.assertEqual(tfl_model.SubgraphsLength(), 1)
+        self.assertEqual(tfl_model.Subgraphs(0).OperatorsLength(), 11)
+
+        op_codes = [
+            tfl_model.OperatorCodes(tfl_model.Subgraphs(0).Operators(i).OpcodeIndex()).DeprecatedBuiltinCode()
+            for i in range(tfl_model.Subgraphs(0).OperatorsLength())
+        ]
+        self.assertEqual(op_codes.count(tflite.BuiltinOperator.FULLY_CONNECTED), 2)
+        self.assertEqual(op_codes.count(tflite.BuiltinOperator.TRANSPOSE), 2)
+        self.assertEqual(op_codes.count(tflite.BuiltinOperator.RESHAPE), 2)
+        self.assertEqual(op_codes.count(tflite.BuiltinOperator.SPLIT), 1)
+        self.assertEqual(op_codes.count(tflite.BuiltinOperator.BATCH_MATMUL), 2)
+
+        interpreter = tf.lite.Interpreter(model_path=model_path)
+        interpreter.allocate_tensors()
+        interpreter.set_tensor(interpreter.get_input_details()[0]['index'], dummy_input.numpy())
+        interpreter.invoke()
+        tfl_output = torch.from_numpy(interpreter.get_tensor(interpreter.get_output_details()[0]['index']))
+
+        dummy_output = model(dummy_input)
+        torch.testing.assert_close(dummy_output, tfl_output, rtol=1e-4, atol=1e-4)
+
 
 class ConverterOptimizerQuantizedTester(unittest.TestCase):
     backend: str
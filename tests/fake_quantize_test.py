@@ -0,0 +1,308 @@
+import copy
+import os
+import sys
+import unittest
+from distutils.version import LooseVersion
+
+import torch
+import torch.nn as nn
+import torch.quantization as torch_q
+
+from tinynn.graph.quantization.fake_quantize import (
+    FakeQuantize,
+    FakeQuantizeTFLite,
+    FixedQParamsFakeQuantize,
+    prepare_branchless_fake_quantize,
+    restore_observer_hooks,
+)
+from tinynn.graph.quantization.quantizer import QATQuantizer
+from tinynn.graph.tracer import model_tracer
+
+CURRENT_PATH = os.path.abspath(os.path.dirname(__file__))
+
+
+def is_compile_supported():
+    # Versions of PyTorch before 2.4 fail to compile the QAT modules with batch norms
+    if LooseVersion(torch.__version__) < '2.4.0' or not hasattr(torch, 'compile'):
+        return False
+
+    try:
+        from torch._dynamo.eval_frame import check_if_dynamo_supported
+
+        check_if_dynamo_supported()
+    except Exception:
+        return False
+
+    return sys.platform != 'win32'
+
+
+def activation_fake_quantize():
+    return FakeQuantizeTFLite(
+        observer=torch_q.MovingAverageMinMaxObserver, quant_min=0, quant_max=255, reduce_range=False
+    )
+
+
+def weight_fake_quantize():
+    return FakeQuantizeTFLite(
+        observer=torch_q.MovingAveragePerChannelMinMaxObserver,
+        quant_min=-127,
+        quant_max=127,
+        dtype=torch.qint8,
+        qscheme=torch.per_channel_symmetric,
+        ch_axis=0,
+    )
+
+
+class FakeQuantizeTFLiteTester(unittest.TestCase):
+    def check_fused_forward(self, fq, inputs):
+        unfused_fq = copy.deepcopy(fq)
+
+        for x in inputs:
+            x = x.clone().requires_grad_()
+            unfused_x = x.detach().clone().requires_grad_()
+
+            y = fq(x)
+            unfused_y = unfused_fq._forward_unfused(unfused_x)
+            self.assertTrue(torch.equal(y, unfused_y))
+
+            grad = torch.randn_like(y)
+            y.backward(grad)
+            unfused_y.backward(grad)
+            self.assertTrue(torch.equal(x.grad, unfused_x.grad))
+
+            for k, v in fq.state_dict().items():
+                self.assertTrue(torch.equal(v, unfused_fq.state_dict()[k]), k)
+
+    def test_per_tensor(self):
+        torch.manual_seed(0)
+        inputs = [torch.randn(4, 8, 5, 5) * i for i in range(1, 4)]
+
+        fq = activation_fake_quantize()
+        self.check_fused_forward(fq, inputs)
+
+        # The halfway values are rounded away from zero
+        ties = (torch.arange(-20, 20, dtype=torch.float32) + 0.5) * fq.scale
+        self.check_fused_forward(fq, [ties])
+
+        fq.disable_observer()
+        self.check_fused_forward(fq, inputs)
+
+        fq.enable_observer()
+        fq.disable_fake_quant()
+        self.check_fused_forward(fq, inputs)
+
+    def test_per_channel(self):
+        torch.manual_seed(0)
+        inputs = [torch.randn(16, 8, 3, 3) * i for i in range(1, 4)]
+
+        fq = weight_fake_quantize()
+        self.check_fused_forward(fq, inputs)
+
+        fq.disable_observer()
+        self.check_fused_forward(fq, inputs)
+
+    def test_trace(self):
+        fq = activation_fake_quantize()
+        fq(torch.randn(4, 8))
+        fq.disable_observer()
+
+        x = torch.randn(4, 8)
+        traced = torch.jit.trace(fq, x)
+        self.assertTrue(torch.equal(traced(x), fq(x)))
+
+
+def fake_quantize_configs():
+    return [
+        dict(observer=torch_q.MovingAverageMinMaxObserver, quant_min=0, quant_max=255, reduce_range=False),
+        dict(
+            observer=torch_q.MovingAverageMinMaxObserver,
+            quant_min=0,
+            quant_max=255,
+            dtype=torch.quint8,
+            qscheme=torch.per_tensor_symmetric,
+            reduce_range=False,
+        ),
+        dict(
+            observer=torch_q.MinMaxObserver,
+            quant_min=-128,
+            quant_max=127,
+            dtype=torch.qint8,
+            qscheme=torch.per_tensor_symmetric,
+            reduce_range=False,
+        ),
+        dict(
+            observer=torch_q.MovingAveragePerChannelMinMaxObserver,
+            quant_min=-127,
+            quant_max=127,
+            dtype=torch.qint8,
+            qscheme=torch.per_channel_symmetric,
+            ch_axis=0,
+        ),
+        dict(
+            observer=torch_q.PerChannelMinMaxObserver,
+            quant_min=0,
+            quant_max=255,
+            dtype=torch.quint8,
+            qscheme=torch.per_channel_affine,
+            ch_axis=1,
+        ),
+    ]
+
+
+class CompileModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = nn.Conv2d(3, 8, 3)
+        self.bn = nn.BatchNorm2d(8)
+        self.relu = nn.ReLU()
+        self.deconv = nn.ConvTranspose2d(8, 4, 2, 2)
+        self.deconv_bn = nn.BatchNorm2d(4)
+        self.fc = nn.Linear(4, 6)
+        self.gru = nn.GRU(6, 5, batch_first=True)
+
+    def forward(self, x):
+        x = self.relu(self.bn(self.conv(x)))
+        x = torch.sigmoid(self.deconv_bn(self.deconv(x)))
+        x = self.fc(x.mean((2, 3))).unsqueeze(1).repeat(1, 3, 1)
+        return self.gru(x)[0] + 1
+
+
+class BranchlessFakeQuantizeTester(unittest.TestCase):
+    def check_forward(self, fq, torch_fq, inputs):
+        for x in inputs:
+            x = x.clone().requires_grad_()
+            torch_x = x.detach().clone().requires_grad_()
+
+            y = fq(x)
+            torch_y = torch_fq(torch_x)
+            self.assertTrue(torch.equal(y, torch_y))
+
+            grad = torch.randn_like(y)
+            y.backward(grad)
+            torch_y.backward(grad)
+            self.assertTrue(torch.equal(x.grad, torch_x.grad))
+
+            torch_state = torch_fq.state_dict()
+            for k, v in fq.state_dict().items():
+                self.assertTrue(torch.equal(v, torch_state[k]), k)
+
+    def test_forward(self):
+        torch.manual_seed(0)
+        inputs = [torch.randn(8, 4, 5, 5) * i for i in range(1, 4)]
+
+        for config in fake_quantize_configs():
+            fq = FakeQuantize(**config)
+            torch_fq = torch_q.FakeQuantize(**config)
+            self.check_forward(fq, torch_fq, inputs)
+
+            for m in (fq, torch_fq):
+                m.disable_observer()
+            self.check_forward(fq, torch_fq, inputs)
+
+            for m in (fq, torch_fq):
+                m.enable_observer()
+                m.disable_fake_quant()
+            self.check_forward(fq, torch_fq, inputs)
+
+            # Flags may be assigned directly, e.g. in `layerwise_error_analysis`
+            for m in (fq, torch_fq):
+                m.fake_quant_enabled = torch.tensor([1], dtype=torch.uint8)
+                m.observer_enabled = torch.tensor([0], dtype=torch.uint8)
+            self.check_forward(fq, torch_fq, inputs)
+
+            scale, zero_point = fq.calculate_qparams()
+            torch_scale, torch_zero_point = torch_fq.calculate_qparams()
+            self.assertTrue(torch.equal(scale, torch_scale))
+            self.assertTrue(torch.equal(zero_point, torch_zero_point))
+
+    @unittest.skipIf(LooseVersion(torch.__version__) < '2.0.0', 'Branchless fake quantization is not used')
+    def test_fixed_qparams(self):
+        torch.manual_seed(0)
+        inputs = [torch.randn(4, 8) * i for i in range(1, 4)]
+
+        torch_fq = torch_q.default_fixed_qparams_range_neg1to1_fake_quant()
+        fq = copy.deepcopy(torch_fq)
+        fq.__class__ = FixedQParamsFakeQuantize
+        self.check_forward(fq, torch_fq, inputs)
+
+        for m in (fq, torch_fq):
+            m.disable_fake_quant()
+        self.check_forward(fq, torch_fq, inputs)
+
+    @unittest.skipIf(LooseVersion(torch.__version__) < '2.0.0', 'Branchless fake quantization is not used')
+    def test_prepare_branchless_fake_quantize(self):
+        model = nn.Sequential(nn.Conv2d(3, 8, 3), nn.Sigmoid())
+        model.qconfig = torch_q.QConfig(
+            activation=FakeQuantize.with_args(**fake_quantize_configs()[0]),
+            weight=FakeQuantize.with_args(**fake_quantize_configs()[3]),
+        )
+        model.train()
+        model = torch_q.prepare_qat(model)
+        torch_model = copy.deepcopy(model)
+
+        prepare_branchless_fake_quantize(model)
+
+        fq = model[0].weight_fake_quant
+        self.assertEqual(fq.scale.shape, (8,))
+        self.assertEqual(fq.activation_post_process.min_val.shape, (8,))
+        self.assertTrue(torch.equal(fq.calculate_qparams()[0], torch.ones(8)))
+
+        self.assertIs(type(model[1].activation_post_process), FixedQParamsFakeQuantize)
+
+        torch.manual_seed(0)
+        for _ in range(3):
+            x = torch.randn(2, 3, 8, 8)
+            self.assertTrue(torch.equal(model(x), torch_model(x)))
+
+        restore_observer_hooks(model)
+        for m, torch_m in zip(model.modules(), torch_model.modules()):
+            self.assertEqual(list(m._forward_hooks.values()), list(torch_m._forward_hooks.values()))
+
+        model.eval()
+        q_model = torch_q.convert(model)
+        self.assertEqual(len(q_model[1]._forward_hooks), 0)
+
+    @unittest.skipIf(not is_compile_supported(), 'torch.compile is not supported')
+    def test_compile_qat_model(self):
+        from torch._dynamo.utils import counters
+
+        for rounding_mode in ('pytorch', 'tflite'):
+            with model_tracer():
+                model = CompileModel()
+                dummy_input = torch.randn(1, 3, 8, 8)
+                quantizer = QATQuantizer(
+                    model,
+                    dummy_input,
+                    work_dir=os.path.join(CURRENT_PATH, 'out'),
+                    config={'rounding_mode': rounding_mode},
+                )
+                qat_model = quantizer.quantize()
+
+            qat_model.train()
+            eager_model = copy.deepcopy(qat_model)
+
+            torch._dynamo.reset()
+            counters.clear()
+            compiled_model = torch.compile(qat_model)
+
+            torch.manual_seed(0)
+            for _ in range(3):
+                x = torch.randn(4, 3, 8, 8)
+                y = compiled_model(x)
+                y.sum().backward()
+
+                eager_y = eager_model(x)
+                eager_y.sum().backward()
+
+                self.assertTrue(torch.allclose(y, eager_y, atol=1e-3), rounding_mode)
+
+            self.assertEqual(len(counters['graph_break']), 0, dict(counters['graph_break']))
+            self.assertEqual(counters['stats']['unique_graphs'], 1)
+
+            with torch.no_grad():
+                qat_model.eval()
+                quantizer.convert(qat_model)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import copy
+import unittest
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.quantization as torch_q
+
+from tinynn.graph.quantization.observer import HistogramObserverKL, finalize_observers
+
+
+def compute_threshold_reference(distribution: np.ndarray, m_bin_number=2048) -> int:
+    """The loop-based implementation of `HistogramObserverKL._compute_threshold`, which evaluates the thresholds one
+    by one"""
+    m_bin_number = m_bin_number + 1
+    target_bin_numbers = 128
+    threshold = target_bin_numbers
+    min_kl_divergence = float('inf')
+
+    after_threshold_sum = np.sum(distribution[target_bin_numbers:])
+    cumsum_dist = np.zeros(distribution.size + 1, dtype=distribution.dtype)
+    np.cumsum(distribution, out=cumsum_dist[1:])
+    cumsum_nozeros = np.zeros(distribution.size + 1, dtype=distribution.dtype)
+    np.cumsum(distribution != 0, out=cumsum_nozeros[1:])
+    is_nonzero_distribution = distribution != 0
+    is_nonzero_distribution = np.append(is_nonzero_distribution, False)
+
+    for i in range(target_bin_numbers, m_bin_number):
+        quantize_dis = np.zeros(target_bin_numbers)
+        expanded_dis = np.zeros(i)
+        candidate_dis = copy.deepcopy(distribution)[:i]
+        candidate_dis[i - 1] = candidate_dis[i - 1] + after_threshold_sum
+        if i != m_bin_number - 1:
+            after_threshold_sum -= distribution[i]
+        else:
+            after_threshold_sum = np.zeros(1)
+
+        bin_interval = i / target_bin_numbers
+
+        # merge i bins to target bins
+        j_ = np.arange(target_bin_numbers)
+        start_ = j_ * bin_interval
+        end_ = start_ + bin_interval
+
+        left_upper_ = np.ceil(start_).astype('int32')
+        right_lower_ = np.floor(end_).astype('int32')
+
+        left_flag = left_upper_ > start_
+        right_flag = right_lower_ < end_
+
+        left_scale_ = left_upper_ - start_
+        right_scale_ = end_ - right_lower_
+
+        quantize_dis[left_flag] += left_scale_[left_flag] * distribution[left_upper_[left_flag] - 1]
+        quantize_dis[right_flag] += right_scale_[right_flag] * distribution[right_lower_[right_flag]]
+        quantize_dis += cumsum_dist[right_lower_] - cumsum_dist[left_upper_]
+
+        # expand target bins to i bins
+        count_ = np.zeros(target_bin_numbers)
+        count_[left_flag] += left_scale_[left_flag] * is_nonzero_distribution[left_upper_[left_flag] - 1]
+        count_[right_flag] += right_scale_[right_flag] * is_nonzero_distribution[right_lower_[right_flag]]
+        count_ += cumsum_nozeros[right_lower_] - cumsum_nozeros[left_upper_]
+
+        to_expand_value_ = np.zeros(target_bin_numbers)
+        count_flag = count_ != 0
+        to_expand_value_[count_flag] = quantize_dis[count_flag] / count_[count_flag]
+        left_expand_flag = np.logical_and(count_flag, left_flag, is_nonzero_distribution[left_upper_ - 1])
+        expanded_dis[left_upper_[left_expand_flag] - 1] += (
+            to_expand_value_[left_expand_flag] * left_scale_[left_expand_flag]
+        )
+        right_expand_flag = np.logical_and(count_flag, right_flag, is_nonzero_distribution[right_lower_])
+        expanded_dis[right_lower_[right_expand_flag]] += (
+            to_expand_value_[right_expand_flag] * right_scale_[right_expand_flag]
+        )
+
+        k = np.floor(bin_interval).astype('int32')
+        last_flag = k - (right_lower_ - left_upper_) == 0
+        for m in range(right_lower_[0] - 1):
+            expanded_dis[left_upper_ + m] += to_expand_value_ * is_nonzero_distribution[left_upper_ + m]
+        expanded_dis[left_upper_ + right_lower_[0] - 1] += (
+            to_expand_value_ * last_flag * is_nonzero_distribution[left_upper_ + right_lower_[0] - 1]
+        )
+
+        # Calculate the Kl divergence of expanded_dis and candidate_dis
+        expanded_dis = torch.from_numpy(expanded_dis)
+        candidate_dis = torch.from_numpy(candidate_dis)
+        curKL = F.kl_div(expanded_dis.log(), candidate_dis, reduction='sum')
+        if curKL < min_kl_divergence and curKL != 1.0:
+            min_kl_divergence = curKL
+            threshold = i
+
+    return threshold
+
+
+def normalized_histogram(x: torch.Tensor) -> np.ndarray:
+    observer = HistogramObserverKL()
+    observer(x)
+    bins = observer.histogram.clone()
+    bins[0] = bins[1]
+    bins_np = bins.numpy()
+    bins_np[bins_np < 0] = 0
+    return bins_np / np.sum(bins_np)
+
+
+class HistogramObserverKLTester(unittest.TestCase):
+    def test_compute_threshold(self):
+        torch.manual_seed(0)
+        inputs = [
+            torch.randn(100000),
+            torch.relu(torch.randn(100000)),
+            torch.randn(100000).pow(3),
+            torch.cat([torch.randn(100000), torch.randn(100) + 50]),
+            torch.rand(5000).log(),
+            torch.randint(0, 16, (10000,)).float(),
+        ]
+
+        observer = HistogramObserverKL()
+        for x in inputs:
+            distribution = normalized_histogram(x)
+            right_threshold = compute_threshold_reference(distribution, 2048)
+            self.assertEqual(observer._compute_threshold(distribution, 2048), right_threshold)
+
+            left_distribution = distribution[:right_threshold][::-1]
+            self.assertEqual(
+                observer._compute_threshold(left_distribution, left_distribution.size),
+                compute_threshold_reference(left_distribution, left_distribution.size),
+            )
+
+    def test_compute_threshold_small(self):
+        distribution = np.full(100, 0.01, dtype='float32')
+        self.assertEqual(HistogramObserverKL()._compute_threshold(distribution, distribution.size), 128)
+
+
+class FinalizeObserversTester(unittest.TestCase):
+    def test_finalize_observers(self):
+        torch.manual_seed(0)
+        model = nn.Sequential(HistogramObserverKL(), torch_q.HistogramObserver(), torch_q.MinMaxObserver())
+        model(torch.randn(10000))
+
+        expected = [type(m).calculate_qparams(m) for m in model]
+
+        finalized = finalize_observers(model, max_workers=2)
+        self.assertEqual(finalized, list(model)[:2])
+
+        for m, qparams in zip(model, expected):
+            scale, zero_point = m.calculate_qparams()
+            self.assertTrue(torch.equal(scale, qparams[0]))
+            self.assertTrue(torch.equal(zero_point, qparams[1]))
+
+        # The cached qparams are dropped once new data is observed
+        model(torch.randn(10000) * 10)
+        for m in model:
+            self.assertNotIn('calculate_qparams', m.__dict__)
+
+        finalize_observers(model, max_workers=1)
+        for m in model[:2]:
+            scale, zero_point = m.calculate_qparams()
+            expected_scale, expected_zero_point = type(m).calculate_qparams(m)
+            self.assertTrue(torch.equal(scale, expected_scale))
+            self.assertTrue(torch.equal(zero_point, expected_zero_point))
+
+
+if __name__ == '__main__':
+    unittest.main()
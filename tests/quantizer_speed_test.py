@@ -0,0 +1,136 @@
+import gc
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+import torch
+
+from tinynn.graph.quantization.fake_quantize import FakeQuantizeTFLite
+from tinynn.graph.quantization.observer import HistogramObserverKL, finalize_observers
+from tinynn.graph.quantization.quantizer import QATQuantizer
+from tinynn.graph.tracer import model_tracer, trace
+from tinynn.util.util import get_logger
+from common_utils import prepare_inputs
+from observer_test import compute_threshold_reference, normalized_histogram
+
+CURRENT_PATH = os.path.abspath(os.path.dirname(__file__))
+
+sys.path.insert(1, os.path.join(CURRENT_PATH, '..'))
+
+log = get_logger(__name__)
+
+
+def rewrite_speed_test(model_class):
+    model_name = model_class.__name__
+    with model_tracer():
+        m = model_class()
+        m.train()
+
+        inputs = prepare_inputs(m)
+        quantizer = QATQuantizer(m, inputs, work_dir=os.path.join(CURRENT_PATH, 'out'))
+
+        graph = trace(m, inputs)
+        log.info(f"[SPEED TEST][{model_name}][Nodes] {len(graph.forward_nodes)}")
+
+        st = time.time()
+        quantizer.rewrite_quantize_graph(graph)
+        log.info(f"[SPEED TEST][{model_name}][Rewrite Quantize Graph] {time.time() - st}")
+        log.info(f"[SPEED TEST][{model_name}][Nodes After Rewrite] {len(graph.forward_nodes)}")
+
+    del m
+    del graph
+    gc.collect()
+
+
+def kl_threshold_speed_test(x, name):
+    distribution = normalized_histogram(x)
+    observer = HistogramObserverKL()
+
+    for func_name, func in (
+        ('Loop', compute_threshold_reference),
+        ('Vectorized', lambda *args: observer._compute_threshold(*args)),
+    ):
+        st = time.time()
+        right_threshold = func(distribution, 2048)
+        left_distribution = distribution[:right_threshold][::-1]
+        func(left_distribution, left_distribution.size)
+        log.info(f"[SPEED TEST][{name}][KL Threshold ({func_name})] {time.time() - st}")
+
+
+def finalize_speed_test(num_observers, max_workers):
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(*(HistogramObserverKL() for _ in range(num_observers)))
+    model(torch.randn(100000))
+
+    st = time.time()
+    for m in model:
+        m.calculate_qparams()
+    log.info(f"[SPEED TEST][{num_observers} observers][Calculate QParams (Sequential)] {time.time() - st}")
+
+    st = time.time()
+    finalize_observers(model, max_workers)
+    log.info(f"[SPEED TEST][{num_observers} observers][Finalize Observers ({max_workers} workers)] {time.time() - st}")
+
+
+def qat_step_speed_test(model_class, steps=5, batch_size=8):
+    model_name = model_class.__name__
+    with model_tracer():
+        m = model_class()
+        inputs = torch.randn(1, 3, 224, 224)
+        quantizer = QATQuantizer(
+            m, inputs, work_dir=os.path.join(CURRENT_PATH, 'out'), config={'rounding_mode': 'tflite'}
+        )
+        qat_model = quantizer.quantize()
+
+    qat_model.train()
+    optimizer = torch.optim.SGD(qat_model.parameters(), lr=1e-3)
+    criterion = torch.nn.CrossEntropyLoss()
+    images = torch.randn(batch_size, 3, 224, 224)
+    labels = torch.randint(0, 10, (batch_size,))
+
+    def train_step():
+        optimizer.zero_grad()
+        loss = criterion(qat_model(images), labels)
+        loss.backward()
+        optimizer.step()
+
+    for name, forward in (('Unfused', FakeQuantizeTFLite._forward_unfused), ('Fused', FakeQuantizeTFLite.forward)):
+        with mock.patch.object(FakeQuantizeTFLite, 'forward', forward):
+            train_step()
+
+            st = time.time()
+            for _ in range(steps):
+                train_step()
+            elapsed = time.time() - st
+            log.info(f"[SPEED TEST][{model_name}][QAT Step ({name})] {elapsed / steps}")
+            log.info(f"[SPEED TEST][{model_name}][QAT Throughput ({name})] {steps * batch_size / elapsed} images/s")
+
+    del m
+    del qat_model
+    gc.collect()
+
+
+class QuantizerSpeedTester(unittest.TestCase):
+    def test_rewrite_efficientnet_v2_l(self):
+        from models.efficientnet_v2_l import efficientnet_v2_l
+
+        rewrite_speed_test(efficientnet_v2_l)
+
+    def test_kl_threshold(self):
+        torch.manual_seed(0)
+        kl_threshold_speed_test(torch.randn(100000), 'normal')
+        kl_threshold_speed_test(torch.relu(torch.randn(100000)), 'relu')
+
+    def test_finalize_observers(self):
+        finalize_speed_test(32, os.cpu_count())
+
+    def test_qat_step_mobilenet(self):
+        from examples.models.cifar10.mobilenet import Mobilenet
+
+        qat_step_speed_test(Mobilenet)
+
+
+if __name__ == '__main__':
+    unittest.main()
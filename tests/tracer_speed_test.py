@@ -0,0 +1,105 @@
+import gc
+import glob
+import importlib
+import inspect
+import os
+import time
+import unittest
+
+import torch
+
+from tinynn.graph.tracer import model_tracer, trace
+from tinynn.util.util import get_logger
+from common_utils import prepare_inputs, IS_CI
+
+CURRENT_PATH = os.path.abspath(os.path.dirname(__file__))
+MODELS_PATH = os.path.join(CURRENT_PATH, '..', 'models')
+
+log = get_logger(__name__)
+
+CI_BLACKLIST = (
+    'efficientnet_v2_xl',
+    'hrnet125',
+)
+
+
+def collect_model_classes():
+    model_classes = []
+    for path in sorted(glob.glob(os.path.join(MODELS_PATH, '*.py'))):
+        module_name = os.path.splitext(os.path.basename(path))[0]
+        if module_name == '__init__':
+            continue
+
+        try:
+            module = importlib.import_module(f'models.{module_name}')
+        except ImportError:
+            continue
+
+        for item in module.__dict__.values():
+            if inspect.isclass(item) and issubclass(item, torch.nn.Module) and item.__module__ == module.__name__:
+                model_classes.append(item)
+    return model_classes
+
+
+def speed_test(model_class):
+    model_name = model_class.__name__
+    with torch.no_grad():
+        with model_tracer():
+            st = time.time()
+            m = model_class()
+            m.eval()
+            log.info(f"[SPEED TEST][{model_name}][Model Init] {time.time() - st}")
+
+            inputs = prepare_inputs(m)
+
+            # Plain forward as the reference for the overhead of the tracing wrappers
+            st = time.time()
+            m(*inputs)
+            forward_time = time.time() - st
+            log.info(f"[SPEED TEST][{model_name}][Forward] {forward_time}")
+
+            st = time.time()
+            graph = trace(m, inputs)
+            trace_time = time.time() - st
+            log.info(f"[SPEED TEST][{model_name}][Trace] {trace_time}")
+            log.info(f"[SPEED TEST][{model_name}][Nodes] {len(graph.forward_nodes)}")
+            log.info(f"[SPEED TEST][{model_name}][Trace / Forward] {trace_time / forward_time:.2f}x")
+
+            # The first call includes the compilation of the graph
+            graph(*inputs)
+            st = time.time()
+            graph(*inputs)
+            call_time = time.time() - st
+            log.info(f"[SPEED TEST][{model_name}][Graph Call] {call_time}")
+            log.info(f"[SPEED TEST][{model_name}][Graph Call / Forward] {call_time / forward_time:.2f}x")
+
+    del m
+    del graph
+    gc.collect()
+
+
+class TracerSpeedTestMeta(type):
+    @classmethod
+    def __prepare__(mcls, name, bases):
+        d = dict()
+        for model_class in collect_model_classes():
+            d[f'test_{model_class.__name__}'] = mcls.build_model_test(model_class)
+        return d
+
+    @classmethod
+    def build_model_test(cls, model_class):
+        def f(self):
+            if IS_CI and model_class.__name__ in CI_BLACKLIST:
+                raise unittest.SkipTest('IN CI BLACKLIST')
+
+            speed_test(model_class)
+
+        return f
+
+
+class TracerSpeedTester(unittest.TestCase, metaclass=TracerSpeedTestMeta):
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
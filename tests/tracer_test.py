@@ -1,9 +1,17 @@
+import concurrent.futures
 import os
 import re
+import tempfile
 import unittest
 import gc
+from unittest import mock
 
+import torch
+import torchvision
+
+from tinynn.graph import tracer
 from tinynn.graph.tracer import trace, model_tracer
+from tinynn.util.util import import_from_path
 from common_utils import collect_custom_models, collect_torchvision_models, prepare_inputs, IS_CI
 
 
@@ -85,5 +93,378 @@ class TestModel(unittest.TestCase, metaclass=TestModelMeta):
     pass
 
 
+class TestOverrideCache(unittest.TestCase):
+    def test_override_cache(self):
+        config = os.path.join(tracer.current_dir, 'configs/torch_func_override_2_0.yml')
+
+        with mock.patch.dict(os.environ, {'TINYNN_CACHE_DIR': ''}):
+            self.assertIsNone(tracer.override_cache_path(config))
+            expected = tracer.fetch_funcs(config)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with mock.patch.dict(os.environ, {'TINYNN_CACHE_DIR': cache_dir}):
+                cache_path = tracer.override_cache_path(config)
+                self.assertFalse(os.path.exists(cache_path))
+                self.assertEqual(tracer.fetch_funcs(config), expected)
+                self.assertTrue(os.path.exists(cache_path))
+
+                # The config should not be parsed again when the cache is valid
+                with mock.patch.object(tracer.yaml, 'load', side_effect=AssertionError('config is parsed')):
+                    self.assertEqual(tracer.fetch_funcs(config), expected)
+
+                # Stale caches are ignored
+                with open(cache_path, 'wb') as f:
+                    tracer.pickle.dump(((tracer.OVERRIDE_CACHE_VERSION - 1,), []), f)
+                self.assertEqual(tracer.fetch_funcs(config), expected)
+
+
+class TestMetadataOnly(unittest.TestCase):
+    def test_metadata_only(self):
+        with model_tracer():
+            m = torchvision.models.resnet18()
+            m.eval()
+
+            inputs = (torch.randn(1, 3, 224, 224),)
+            graph = trace(m, inputs)
+            meta_graph = trace(m, inputs, metadata_only=True)
+
+        self.assertEqual(
+            [n.unique_name for n in graph.forward_nodes], [n.unique_name for n in meta_graph.forward_nodes]
+        )
+
+        for node, meta_node in zip(graph.forward_nodes, meta_graph.forward_nodes):
+            self.assertEqual(len(node.next_tensors), len(meta_node.next_tensors))
+            self.assertEqual(node.module.__class__, meta_node.module.__class__)
+            for t, meta_t in zip(node.next_tensors, meta_node.next_tensors):
+                self.assertTrue(meta_t.is_meta)
+                self.assertEqual(t.shape, meta_t.shape)
+                self.assertEqual(t.dtype, meta_t.dtype)
+                self.assertEqual(t.device, meta_graph.tensor_device_dict[id(meta_t)])
+                self.assertEqual(meta_graph.tensor_pre_node_dict[id(meta_t)], meta_node.unique_name)
+
+        # Edges are kept with the identity of the meta tensors
+        for node in meta_graph.forward_nodes:
+            for pn, pt in zip(node.prev_nodes, node.prev_tensors):
+                self.assertTrue(any(pt is nt for nt in pn.next_tensors))
+
+        self.assertTrue(
+            meta_graph.generate_code(
+                'out/resnet18_metadata_only.py', 'out/resnet18_metadata_only.pth', 'resnet18', check=True
+            )
+        )
+        os.unlink('out/resnet18_metadata_only.pth')
+
+        meta_graph.materialize_tensors()
+        self.assertFalse(meta_graph.metadata_only)
+        for node, meta_node in zip(graph.forward_nodes, meta_graph.forward_nodes):
+            for t, meta_t in zip(node.next_tensors, meta_node.next_tensors):
+                self.assertFalse(meta_t.is_meta)
+                self.assertEqual(t.shape, meta_t.shape)
+                self.assertEqual(meta_graph.tensor_pre_node_dict[id(meta_t)], meta_node.unique_name)
+
+
+class ConstantModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(3, 8, 3)
+        self.register_buffer('offset', torch.arange(8, dtype=torch.float32).view(1, 8, 1, 1))
+
+    def forward(self, x):
+        return self.conv(x) + self.offset
+
+
+class TestMetaTrace(unittest.TestCase):
+    def test_meta_trace(self):
+        with model_tracer():
+            for model_class in (torchvision.models.resnet18, ConstantModel):
+                model_name = model_class.__name__
+                m = model_class()
+                m.eval()
+
+                inputs = (torch.randn(1, 3, 224, 224),)
+                graph = trace(m, inputs)
+
+                # The inputs are moved to the device of the model
+                m.to(device='meta')
+                meta_graph = trace(m, inputs)
+
+                self.assertEqual(
+                    [n.unique_name for n in graph.forward_nodes], [n.unique_name for n in meta_graph.forward_nodes]
+                )
+                self.assertEqual(len(graph.constant_nodes), len(meta_graph.constant_nodes))
+                for node, meta_node in zip(graph.forward_nodes, meta_graph.forward_nodes):
+                    for t, meta_t in zip(node.next_tensors, meta_node.next_tensors):
+                        self.assertTrue(meta_t.is_meta)
+                        self.assertEqual(t.shape, meta_t.shape)
+
+                meta_graph.generate_code(f'out/{model_name}_meta.py', f'out/{model_name}_meta.pth', model_name)
+
+                new_model = import_from_path(
+                    f'tracer_check.{model_name}_meta', f'out/{model_name}_meta.py', model_name
+                )()
+                new_model.to(device='meta')
+                state_dict = torch.load(f'out/{model_name}_meta.pth')
+                self.assertEqual(
+                    {k: v.shape for k, v in state_dict.items()}, {k: v.shape for k, v in new_model.state_dict().items()}
+                )
+                output = new_model(inputs[0].to(device='meta'))
+                self.assertEqual(output.shape, graph.output_nodes[0].prev_tensors[0].shape)
+
+                os.unlink(f'out/{model_name}_meta.pth')
+
+
+class AttributeConstantModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.fc = torch.nn.Linear(64, 64)
+        # Plain attributes are traced as constants
+        self.table = torch.randn(1, 128, 64)
+        self.scale = torch.tensor([0.5, 2.0])
+
+    def forward(self, x):
+        x = self.fc(x) + self.table
+        self.table.add_(1.0)
+        return x * self.scale[0] + self.scale[1]
+
+
+class TestConstantNode(unittest.TestCase):
+    def test_constant_data(self):
+        with model_tracer():
+            m = AttributeConstantModel()
+            m.eval()
+
+            inputs = (torch.randn(1, 128, 64),)
+            table = m.table.clone()
+            graph = trace(m, inputs)
+
+        nodes = {tuple(n.module.shape): n.module for n in graph.constant_nodes}
+        self.assertEqual(len(nodes), 2)
+
+        # The large constant is stored as a snapshot of the tensor instead of being written inline
+        table_node = nodes[(1, 128, 64)]
+        self.assertTrue(table_node.is_persistent)
+        self.assertIsNone(table_node.data_str)
+        self.assertTrue(torch.equal(table_node.data, table))
+
+        # The small one is written inline
+        scale_node = nodes[(2,)]
+        self.assertFalse(scale_node.is_persistent)
+        self.assertEqual(scale_node.data_str, '[0.5, 2.0]')
+
+        graph.generate_code('out/attribute_constant.py', 'out/attribute_constant.pth', 'AttributeConstantModel')
+        state_dict = torch.load('out/attribute_constant.pth')
+        self.assertTrue(torch.equal(state_dict[table_node.unique_name], table))
+        os.unlink('out/attribute_constant.pth')
+
+
+class TestTraceCache(unittest.TestCase):
+    def test_save_load(self):
+        with model_tracer():
+            m = torchvision.models.googlenet(init_weights=False)
+            m.eval()
+
+            inputs = (torch.randn(1, 3, 224, 224),)
+            graph = trace(m, inputs)
+
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, 'googlenet.pkl')
+                graph.save(path)
+                new_graph = tracer.TraceGraph.load(path, m, inputs)
+
+            self.assertEqual(list(graph.nodes_map.keys()), list(new_graph.nodes_map.keys()))
+            for node in graph.forward_nodes:
+                new_node = new_graph.nodes_map[node.unique_name]
+                self.assertIs(type(node.module), type(new_node.module))
+                if isinstance(node.module, torch.nn.Module):
+                    self.assertIs(node.module, new_node.module)
+                self.assertEqual([n.unique_name for n in node.prev_nodes], [n.unique_name for n in new_node.prev_nodes])
+                for t, new_t in zip(node.next_tensors, new_node.next_tensors):
+                    self.assertTrue(new_t.is_meta)
+                    self.assertEqual(t.shape, new_t.shape)
+
+            graph.generate_code('out/googlenet_cache_a.py', None, 'googlenet')
+            new_graph.generate_code('out/googlenet_cache_b.py', None, 'googlenet')
+
+            with open('out/googlenet_cache_a.py', 'r') as f:
+                code = f.read()
+            with open('out/googlenet_cache_b.py', 'r') as f:
+                new_code = f.read()
+            self.assertEqual(code, new_code)
+
+            self.assertTrue(
+                new_graph.generate_code(
+                    'out/googlenet_cache_c.py', 'out/googlenet_cache_c.pth', 'googlenet', check=True
+                )
+            )
+            os.unlink('out/googlenet_cache_c.pth')
+
+    def test_trace_cache(self):
+        with model_tracer():
+            m = torchvision.models.resnet18()
+            m.eval()
+
+            inputs = (torch.randn(1, 3, 224, 224),)
+
+            with tempfile.TemporaryDirectory() as cache_dir:
+                with mock.patch.dict(os.environ, {'TINYNN_CACHE_DIR': cache_dir}):
+                    cache_path = tracer.trace_cache_path(m, inputs)
+                    self.assertFalse(os.path.exists(cache_path))
+
+                    graph = trace(m, inputs, use_cache=True)
+                    self.assertTrue(os.path.exists(cache_path))
+
+                    # The model should not be traced again when the cache is valid
+                    with mock.patch.object(tracer.TraceGraph, 'init', side_effect=AssertionError('model is traced')):
+                        new_graph = trace(m, inputs, use_cache=True)
+                    self.assertEqual(list(graph.nodes_map.keys()), list(new_graph.nodes_map.keys()))
+
+                    # Changes to the inputs or the options invalidate the cache
+                    self.assertNotEqual(cache_path, tracer.trace_cache_path(m, (torch.randn(1, 3, 112, 112),)))
+                    self.assertNotEqual(cache_path, tracer.trace_cache_path(m, inputs, eliminate_dead_graph=True))
+
+                    # Changes to the structure of the model invalidate the cache
+                    m.fc = torch.nn.Linear(512, 10)
+                    self.assertNotEqual(cache_path, tracer.trace_cache_path(m, inputs))
+
+
+class TestGraphCall(unittest.TestCase):
+    def test_graph_call(self):
+        for model_fn in (torchvision.models.resnet18, torchvision.models.shufflenet_v2_x1_0):
+            with model_tracer():
+                m = model_fn()
+                m.eval()
+
+                inputs = (torch.randn(1, 3, 224, 224),)
+                graph = trace(m, inputs)
+
+            with torch.no_grad():
+                expected = m(*inputs)
+                for _ in range(2):
+                    self.assertTrue(torch.allclose(graph(*inputs), expected))
+
+                new_inputs = (torch.randn(2, 3, 224, 224),)
+                self.assertTrue(torch.allclose(graph(*new_inputs), m(*new_inputs), atol=1e-6))
+
+            # Editing the graph drops the compiled program
+            self.assertIsNotNone(graph.compiled_program)
+            graph.recompute_forward_order()
+            self.assertIsNone(graph.compiled_program)
+
+
+class TestGraphEdit(unittest.TestCase):
+    def test_insert_remove(self):
+        with model_tracer():
+            m = torchvision.models.resnet18()
+            m.eval()
+
+            inputs = (torch.randn(1, 3, 224, 224),)
+            graph = trace(m, inputs)
+
+        def _new_module(name):
+            mod = torch.nn.Identity()
+            graph.module_unique_name_dict[id(mod)] = name
+            graph.module_original_name_dict[id(mod)] = name
+            return mod
+
+        names = [n.unique_name for n in graph.forward_nodes]
+        self.assertEqual(names[:3], ['conv1', 'bn1', 'relu'])
+
+        conv1, bn1 = graph.nodes_map['conv1'], graph.nodes_map['bn1']
+        graph.insert_after(conv1, _new_module('after_0'))
+        graph.insert_after(conv1, _new_module('after_1'))
+        graph.insert_before(bn1, _new_module('before_0'))
+        graph.insert_between(graph.nodes_map['after_0'], graph.nodes_map['before_0'], _new_module('between_0'))
+        graph.insert_after(graph.input_nodes[0], _new_module('head_0'))
+        graph.insert_before(graph.output_nodes[0], _new_module('tail_0'))
+        graph.remove_node(graph.nodes_map['after_1'])
+        graph.remove_node(bn1)
+
+        with self.assertRaises(AssertionError):
+            graph.remove_node(bn1)
+
+        expected = ['head_0', 'conv1', 'after_0', 'between_0', 'before_0'] + names[2:] + ['tail_0']
+        self.assertEqual([n.unique_name for n in graph.forward_nodes], expected)
+
+        graph.recompute_forward_order()
+        with torch.no_grad():
+            m.bn1 = torch.nn.Identity()
+            self.assertTrue(torch.allclose(graph(*inputs), m(*inputs)))
+
+
+class TestRepeatedBlocks(unittest.TestCase):
+    def test_find_repeated_blocks(self):
+        with model_tracer():
+            m = torchvision.models.resnet18()
+            m.eval()
+
+            inputs = (torch.randn(1, 3, 224, 224),)
+            graph = trace(m, inputs)
+
+        blocks = graph.find_repeated_blocks()
+        self.assertEqual([b.scopes for b in blocks], [['layer1[0]', 'layer1[1]']])
+
+        block = blocks[0]
+        self.assertEqual(len(block.nodes[0]), len(block.nodes[1]))
+        self.assertEqual([n.unique_name for n in block.inputs[0]], ['maxpool'])
+        self.assertEqual([n.unique_name for n in block.inputs[1]], [block.nodes[0][-1].unique_name])
+        self.assertEqual(block.outputs, [len(block.nodes[0]) - 1])
+
+    def test_dedup_blocks(self):
+        for model_fn in (torchvision.models.resnet50, torchvision.models.mobilenet_v2):
+            model_name = model_fn.__name__
+            with model_tracer():
+                m = model_fn()
+                m.eval()
+
+                inputs = (torch.randn(1, 3, 224, 224),)
+                graph = trace(m, inputs)
+
+            sizes = []
+            for dedup_blocks in (False, True):
+                script_path = f'out/{model_name}_dedup_{dedup_blocks}.py'
+                weight_path = f'out/{model_name}_dedup_{dedup_blocks}.pth'
+                self.assertTrue(
+                    graph.generate_code(script_path, weight_path, model_name, check=True, dedup_blocks=dedup_blocks)
+                )
+                with open(script_path, 'r') as f:
+                    sizes.append(len(f.read()))
+                os.unlink(weight_path)
+
+            self.assertLess(sizes[1], sizes[0])
+
+
+class TestConcurrentTrace(unittest.TestCase):
+    def test_concurrent_trace(self):
+        model_fns = (
+            torchvision.models.resnet18,
+            torchvision.models.mobilenet_v2,
+            torchvision.models.shufflenet_v2_x0_5,
+            torchvision.models.squeezenet1_0,
+        )
+
+        def _trace(model_fn, suffix):
+            model_name = model_fn.__name__
+            with model_tracer():
+                m = model_fn()
+                m.eval()
+
+                graph = trace(m, (torch.randn(1, 3, 224, 224),))
+                graph.generate_code(f'out/{model_name}_{suffix}.py', None, model_name)
+
+            with open(f'out/{model_name}_{suffix}.py', 'r') as f:
+                return [n.unique_name for n in graph.forward_nodes], f.read()
+
+        expected = [_trace(model_fn, 'sequential') for model_fn in model_fns]
+
+        with concurrent.futures.ThreadPoolExecutor(len(model_fns)) as executor:
+            results = list(executor.map(_trace, model_fns, ['concurrent'] * len(model_fns)))
+
+        self.assertEqual(results, expected)
+
+        # The patches are reverted after all the traces exit
+        self.assertEqual(sum(tracer.patch_ref_counts.values()), 0)
+        self.assertEqual(len(tracer.patch_managers), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1 +1 @@
-from .base import TFLiteConverter
+from .base import TFLiteConverter, TFLiteMultiSignatureConverter
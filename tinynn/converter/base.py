@@ -7,6 +7,9 @@ import torch
 import numpy as np
 
 from .operators import CommonGraph, ExtendedOperator, GraphOptimizer, HybridQuantizer, HalfQuantizer
+from .operators.dynamic_shape import DynamicShapePropagator
+from .operators.graph import convert_multi_signature
+from .operators.target import TargetProfile, get_target_profile
 from .operators.op_version import OPVersioner
 from .operators.tflite import Tensor
 from .operators.torch import OPERATOR_CONVERTER_DICT
@@ -54,10 +57,13 @@ class TFLiteConverter(object):
         hybrid_conv: bool = True,
         unroll_rnn: bool = False,
         separated_rnn_gate_calc: bool = False,
+        rnn_while_loop: bool = False,
         bypass_elementwise_passthrough_constraint: bool = False,
         hybrid_gen_single_op_models: bool = False,
         hybrid_config: typing.Optional[typing.Dict[str, bool]] = None,
         group_tensors: bool = False,
+        target_profile: typing.Optional[typing.Union[str, TargetProfile]] = None,
+        dynamic_axes: typing.Optional[typing.Dict[int, typing.Iterable[int]]] = None,
     ) -> None:
         """ The TFLiteConverter class
 
@@ -105,11 +111,20 @@ class TFLiteConverter(object):
             unroll_rnn (bool): Unrolling LSTM (translate LSTM to seperate ops). Defaults to False
             separated_rnn_gate_calc (bool): Separated calculation for every gate in RNN. Effective only when \
                 `unroll_rnn=True`. Defaults to False
+            rnn_while_loop (bool): Lower the timesteps of the RNN to a `WHILE` loop, so that the size of the model \
+                doesn't grow with the sequence length. Effective only when `unroll_rnn=True`. Defaults to False
             bypass_elementwise_passthrough_constraint (bool): Bypass constraints in elementwise passthrough passes. \
                 Defaults to False
             hybrid_gen_single_op_models: Generate both floating point and quantized version of the model for hybrid \
                 quantizable ops. Defaults to False
             group_tensors (bool): Group tensors to save space. Defaults to False
+            target_profile (typing.Optional[typing.Union[str, TargetProfile]]): The delegate to optimize the model \
+                for, which enables the rewrites needed by it and reports the predicted number of delegate partitions. \
+                Available choices: 'xnnpack', 'gpu', 'nnapi'. Defaults to None
+            dynamic_axes (typing.Optional[typing.Dict[int, typing.Iterable[int]]]): The dynamic axes of the inputs \
+                (e.g. `{0: [0]}` for the batch dimension of the first input), which will be marked as -1 in \
+                `shape_signature` so that the inputs can be resized at runtime. The keys are the indices of the \
+                inputs and the axes are in the layout of the PyTorch model. Defaults to None
         """
 
         self.model = model
@@ -160,10 +175,18 @@ class TFLiteConverter(object):
         self.hybrid_conv = hybrid_conv
         self.unroll_rnn = unroll_rnn
         self.separated_rnn_gate_calc = separated_rnn_gate_calc
+        self.rnn_while_loop = rnn_while_loop
         self.bypass_elementwise_passthrough_constraint = bypass_elementwise_passthrough_constraint
         self.hybrid_gen_single_op_models = hybrid_gen_single_op_models
         self.hybrid_config = hybrid_config
         self.group_tensors = group_tensors
+        self.dynamic_axes = dynamic_axes
+        self.delegate_partitions = None
+
+        if target_profile is not None:
+            self.target_profile = get_target_profile(target_profile)
+        else:
+            self.target_profile = None
 
         if quantize_target_type == 'uint8':
             self.q_type = np.uint8
@@ -405,6 +428,7 @@ class TFLiteConverter(object):
                 self.unroll_rnn,
                 self.separated_rnn_gate_calc,
                 self.conv_transpose_with_bias,
+                self.rnn_while_loop,
             )
             # Don't track the operator if all the input nodes are not tracked unless it has custom implementation
             # (e.g prim::* ops)
@@ -468,6 +492,18 @@ class TFLiteConverter(object):
     def convert(self):
         """Converts the model to the TFLite format
 
+        Raises:
+            Exception: If unsupported ops are found, an Exception will be raised
+        """
+        self.prepare_graph()
+
+        self.common_graph.convert(self.tflite_path)
+
+        log.info(f'Generated model saved to {self.tflite_path}')
+
+    def prepare_graph(self):
+        """Builds and optimizes the TinyNeuralNetwork Graph, which is ready to be written to the TFLite format
+
         Raises:
             Exception: If unsupported ops are found, an Exception will be raised
         """
@@ -497,6 +533,7 @@ class TFLiteConverter(object):
                 self.max_transpose_dims,
                 self.bypass_elementwise_passthrough_constraint,
                 self.group_tensors,
+                self.target_profile,
             )
             optimizer.optimize()
 
@@ -520,12 +557,16 @@ class TFLiteConverter(object):
                 quantizer.quantize()
                 optimizer.cleanup_dead_nodes()
 
-            versioner = OPVersioner(self.common_graph)
-            versioner.process()
+            if self.dynamic_axes is not None:
+                propagator = DynamicShapePropagator(self.common_graph, self.dynamic_axes)
+                propagator.propagate()
 
-            self.common_graph.convert(self.tflite_path)
+            # The delegate partitions are predicted on the final graph, i.e. after the quantizers
+            optimizer.delegate_partition_pass()
+            self.delegate_partitions = optimizer.delegate_partitions
 
-        log.info(f'Generated model saved to {self.tflite_path}')
+            versioner = OPVersioner(self.common_graph)
+            versioner.process()
 
     def visualize(self, hide_constants=True):
         """Visualize the TinyNeuralNetwork Graph
@@ -584,3 +625,50 @@ class TFLiteConverter(object):
                 arr = np.transpose(arr, (0, 2, 3, 1))
             arrs.append(arr)
         return arrs
+
+
+class TFLiteMultiSignatureConverter(object):
+    def __init__(
+        self,
+        entries: typing.Dict[
+            str,
+            typing.Tuple[
+                typing.Union[torch.jit.ScriptFunction, torch.jit.ScriptModule, torch.nn.Module],
+                typing.Union[torch.Tensor, typing.Iterable[torch.Tensor]],
+            ],
+        ],
+        tflite_path: str,
+        **kwargs,
+    ) -> None:
+        """ The TFLiteMultiSignatureConverter class, which converts multiple models (or the same model with different
+        inputs) to a single TFLite model with multiple signatures. The identical constant buffers (e.g. weights) are
+        shared across the signatures.
+
+        Args:
+            entries (typing.Dict[str, typing.Tuple[torch.nn.Module, typing.Iterable[torch.Tensor]]]): The models \
+                and the dummy inputs, with the signature keys as the keys
+            tflite_path (str): Path to use for exporting
+            kwargs: The other arguments that are passed to `TFLiteConverter`
+        """
+
+        assert len(entries) > 0, 'At least one entry is expected'
+
+        self.tflite_path = tflite_path
+        self.converters = collections.OrderedDict()
+        for key, (model, dummy_input) in entries.items():
+            self.converters[key] = TFLiteConverter(model, dummy_input, tflite_path, **kwargs)
+
+    def convert(self):
+        """Converts the models to a single model in the TFLite format
+
+        Raises:
+            Exception: If unsupported ops are found, an Exception will be raised
+        """
+
+        for key, converter in self.converters.items():
+            log.info(f'Converting the model for the signature {key}')
+            converter.prepare_graph()
+
+        convert_multi_signature({k: v.common_graph for k, v in self.converters.items()}, self.tflite_path)
+
+        log.info(f'Generated model saved to {self.tflite_path}')
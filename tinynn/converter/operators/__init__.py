@@ -1,5 +1,7 @@
 from .base import *
+from .dynamic_shape import *
 from .graph import *
 from .hybrid_quantizer import *
 from .half_quantizer import *
 from .optimize import *
+from .target import *
@@ -0,0 +1,404 @@
+import re
+import typing
+
+import numpy as np
+
+from . import tflite as tfl
+from .base import ExtendedOperator
+from .graph import CommonGraph
+
+from tinynn.util.util import get_logger
+
+log = get_logger(__name__, 'INFO')
+
+
+# Ops whose output shapes are fully determined by the constant inputs, so they cannot follow the dynamic dimensions
+SHAPE_BAKING_OPS = (
+    ExtendedOperator.BROADCAST_TO,
+    ExtendedOperator.FILL,
+    ExtendedOperator.TILE,
+)
+
+# Ops for which the generic rule in `DynamicShapePropagator.propagate_elementwise` is known to hold
+ELEMENTWISE_OPS = (
+    ExtendedOperator.ABS,
+    ExtendedOperator.ADD,
+    ExtendedOperator.ADD_N,
+    ExtendedOperator.AVERAGE_POOL_2D,
+    ExtendedOperator.CAST,
+    ExtendedOperator.CEIL,
+    ExtendedOperator.CONV_2D,
+    ExtendedOperator.CONV_3D,
+    ExtendedOperator.COS,
+    ExtendedOperator.DEPTHWISE_CONV_2D,
+    ExtendedOperator.DEQUANTIZE,
+    ExtendedOperator.DIV,
+    ExtendedOperator.ELU,
+    ExtendedOperator.EQUAL,
+    ExtendedOperator.EXP,
+    ExtendedOperator.FLOOR,
+    ExtendedOperator.FLOOR_DIV,
+    ExtendedOperator.FLOOR_MOD,
+    ExtendedOperator.GELU,
+    ExtendedOperator.GREATER,
+    ExtendedOperator.GREATER_EQUAL,
+    ExtendedOperator.HARD_SWISH,
+    ExtendedOperator.L2_NORMALIZATION,
+    ExtendedOperator.LEAKY_RELU,
+    ExtendedOperator.LESS,
+    ExtendedOperator.LESS_EQUAL,
+    ExtendedOperator.LOCAL_RESPONSE_NORMALIZATION,
+    ExtendedOperator.LOG,
+    ExtendedOperator.LOG_SOFTMAX,
+    ExtendedOperator.LOGICAL_AND,
+    ExtendedOperator.LOGICAL_NOT,
+    ExtendedOperator.LOGICAL_OR,
+    ExtendedOperator.LOGISTIC,
+    ExtendedOperator.MAX_POOL_2D,
+    ExtendedOperator.MAXIMUM,
+    ExtendedOperator.MINIMUM,
+    ExtendedOperator.MIRROR_PAD,
+    ExtendedOperator.MUL,
+    ExtendedOperator.NEG,
+    ExtendedOperator.NOT_EQUAL,
+    ExtendedOperator.PAD,
+    ExtendedOperator.PADV2,
+    ExtendedOperator.POW,
+    ExtendedOperator.PRELU,
+    ExtendedOperator.QUANTIZE,
+    ExtendedOperator.RELU,
+    ExtendedOperator.RELU6,
+    ExtendedOperator.RELU_0_TO_1,
+    ExtendedOperator.RELU_N1_TO_1,
+    ExtendedOperator.ROUND,
+    ExtendedOperator.RSQRT,
+    ExtendedOperator.SELECT,
+    ExtendedOperator.SELECT_V2,
+    ExtendedOperator.SIGN,
+    ExtendedOperator.SIN,
+    ExtendedOperator.SOFTMAX,
+    ExtendedOperator.SQRT,
+    ExtendedOperator.SQUARE,
+    ExtendedOperator.SQUARED_DIFFERENCE,
+    ExtendedOperator.SUB,
+    ExtendedOperator.TANH,
+)
+
+# Ops with subgraphs, whose loop variables have static shapes in the subgraphs
+CONTROL_FLOW_OPS = (ExtendedOperator.WHILE,)
+
+
+class DynamicShapePropagator(object):
+    graph: CommonGraph
+    dynamic_axes: typing.Dict[int, typing.List[int]]
+
+    def __init__(self, graph: CommonGraph, dynamic_axes: typing.Dict[int, typing.Iterable[int]]) -> None:
+        """Propagates the dynamic dimensions of the inputs through the graph, so that `shape_signature` can be emitted
+        and the constant shapes (e.g. the ones in `Reshape`) no longer bake the dimensions of the dummy inputs
+
+        Args:
+            graph (CommonGraph): The computation graph, which is expected to be optimized
+            dynamic_axes (typing.Dict[int, typing.Iterable[int]]): The dynamic axes of the inputs, with the indices of \
+                the inputs as the keys. The axes are in the layout of the PyTorch model
+        """
+
+        self.graph = graph
+        self.dynamic_axes = {k: list(v) for k, v in dynamic_axes.items()}
+        self.signatures = {}
+
+    def signature(self, tensor: tfl.Tensor) -> typing.List[int]:
+        """Returns the shape signature of a tensor, in which the dynamic dimensions are marked as -1"""
+
+        if isinstance(tensor, tfl.OptionalTensor) or tensor.buffer is not None:
+            return list(tensor.shape)
+        return self.signatures.get(tensor.name, list(tensor.shape))
+
+    def init_inputs(self):
+        nchw2nhwc_perm = [0, 2, 3, 1]
+
+        for i, name in enumerate(self.graph.inputs):
+            if i not in self.dynamic_axes:
+                continue
+
+            tensor = self.graph.tensor_map[name]
+            axes = [a + len(tensor.shape) if a < 0 else a for a in self.dynamic_axes[i]]
+            assert all((0 <= a < len(tensor.shape) for a in axes)), f'Invalid dynamic axes for input {i}: {axes}'
+
+            # The input tensors may be transposed to NHWC in the TFLite model
+            if self.graph.input_transpose[i]:
+                axes = [nchw2nhwc_perm.index(a) for a in axes]
+
+            self.signatures[name] = [-1 if j in axes else d for j, d in enumerate(tensor.shape)]
+
+    def propagate(self):
+        """Propagates the dynamic dimensions and updates the shape signatures of the tensors"""
+
+        invalid_keys = [k for k in self.dynamic_axes if k < 0 or k >= len(self.graph.inputs)]
+        assert len(invalid_keys) == 0, f'Invalid input indices for dynamic axes: {invalid_keys}'
+
+        self.init_inputs()
+
+        for idx in self.graph.topological_sort():
+            node = self.graph.graph.vs[idx]
+            op = node['op']
+            if op is None:
+                continue
+
+            input_sigs = [self.signature(t) for t in op.inputs]
+            if not any((-1 in s for s in input_sigs)):
+                continue
+
+            assert op.op.code not in CONTROL_FLOW_OPS, (
+                f'{op.type_name()} with dynamic inputs is not supported, because the shapes in its subgraphs are'
+                ' static. Please disable `rnn_while_loop` or remove the dynamic axes that reach the op'
+            )
+
+            op_name = re.sub(r'(?<!^)(?=[A-Z])', '_', op.type_name()).lower()
+            handler = getattr(self, f'propagate_{op_name}', None)
+            if handler is None:
+                if op.op.code not in ELEMENTWISE_OPS and op.op.code not in SHAPE_BAKING_OPS:
+                    log.warning(
+                        f'No dynamic shape rule for {op.type_name()}, falling back to the elementwise rule, which may'
+                        ' produce wrong shape signatures'
+                    )
+                handler = self.propagate_elementwise
+            output_sigs = handler(op, input_sigs)
+
+            for t, sig in zip(op.outputs, output_sigs):
+                if -1 in sig:
+                    self.signatures[t.name] = sig
+
+            if op.op.code in SHAPE_BAKING_OPS:
+                log.warning(f'{op.type_name()} with dynamic inputs may not follow the dynamic dimensions')
+
+        for name, sig in self.signatures.items():
+            self.graph.tensor_map[name].shape_signature = sig
+
+        for name in self.graph.outputs:
+            tensor = self.graph.tensor_map[name]
+            if tensor.shape_signature is None:
+                log.warning(f'The output tensor {name} has a static shape')
+
+    def update_constant(self, tensor: tfl.Tensor, arr: np.ndarray) -> bool:
+        """Updates the value of a constant tensor in place, which is skipped if the tensor is used by multiple ops
+
+        Args:
+            tensor (tfl.Tensor): The constant tensor
+            arr (np.ndarray): The new value
+
+        Returns:
+            bool: Whether the tensor is updated
+        """
+
+        node = self.graph.graph.vs.find(name=self.graph.tensor_node_map[tensor.name])
+        if node.outdegree() > 1:
+            log.warning(f'The constant tensor {tensor.name} is shared by multiple ops, so it cannot be updated')
+            return False
+
+        tensor.tensor = arr.astype(tensor.dtype)
+        tensor.buffer.data = tensor.tensor.tobytes()
+        return True
+
+    def propagate_elementwise(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        # The generic rule, which works for the elementwise (with broadcasting) and shape-preserving ops (e.g.
+        # convolution and pooling). The dimensions are aligned to the right and an output dimension is dynamic if it
+        # comes from a dynamic input dimension of the same size
+        output_sigs = []
+        for t in op.outputs:
+            sig = list(t.shape)
+            for in_t, in_sig in zip(op.inputs, input_sigs):
+                if isinstance(in_t, tfl.OptionalTensor):
+                    continue
+                offset = len(sig) - len(in_sig)
+                for j, d in enumerate(in_sig):
+                    if d == -1 and 0 <= j + offset < len(sig) and sig[j + offset] == in_t.shape[j]:
+                        sig[j + offset] = -1
+            output_sigs.append(sig)
+        return output_sigs
+
+    def propagate_transpose(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        perm = op.inputs[1].tensor.tolist()
+        return [[input_sigs[0][p] for p in perm]]
+
+    def propagate_fully_connected(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        sig = list(op.outputs[0].shape)
+        if op.keepNumDims:
+            sig[:-1] = input_sigs[0][:-1]
+        elif -1 in input_sigs[0][:-1]:
+            sig[0] = -1
+        return [sig]
+
+    def propagate_batch_matmul(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        a_sig, b_sig = input_sigs[:2]
+        out_shape = list(op.outputs[0].shape)
+
+        # The batch dimensions are broadcast
+        sig = out_shape[:-2]
+        for t, in_sig in zip(op.inputs[:2], input_sigs[:2]):
+            offset = len(sig) - (len(in_sig) - 2)
+            for j, d in enumerate(in_sig[:-2]):
+                if d == -1 and sig[j + offset] == t.shape[j]:
+                    sig[j + offset] = -1
+
+        sig.append(a_sig[-1] if op.adjX else a_sig[-2])
+        sig.append(b_sig[-2] if op.adjY else b_sig[-1])
+        return [sig]
+
+    def propagate_reshape(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        in_sig = input_sigs[0]
+        in_shape = list(op.inputs[0].shape)
+        out_shape = list(op.outputs[0].shape)
+
+        # Split the dimensions into groups with the same number of elements on both sides
+        groups = []
+        i, j = 0, 0
+        while i < len(in_shape) or j < len(out_shape):
+            start_i, start_j = i, j
+            p_in, p_out = 1, 1
+            if i < len(in_shape):
+                p_in *= in_shape[i]
+                i += 1
+            if j < len(out_shape):
+                p_out *= out_shape[j]
+                j += 1
+            while p_in != p_out:
+                if p_in < p_out and i < len(in_shape):
+                    p_in *= in_shape[i]
+                    i += 1
+                elif j < len(out_shape):
+                    p_out *= out_shape[j]
+                    j += 1
+                else:
+                    break
+            groups.append((range(start_i, i), range(start_j, j)))
+
+        sig = list(out_shape)
+        dynamic_dims = []
+        for in_dims, out_dims in groups:
+            if not any((in_sig[d] == -1 for d in in_dims)):
+                continue
+            if len(out_dims) != 1:
+                log.warning(f'Cannot infer the dynamic dimension for the RESHAPE op: {in_sig} -> {out_shape}')
+                return [sig]
+            dynamic_dims.append(out_dims[0])
+
+        if len(dynamic_dims) > 1:
+            log.warning(f'RESHAPE op with multiple dynamic output dimensions is not supported: {in_sig} -> {out_shape}')
+            return [sig]
+
+        for d in dynamic_dims:
+            sig[d] = -1
+
+        new_shape = np.array(sig, dtype='int32')
+        if len(op.inputs) > 1 and op.inputs[1].buffer is not None:
+            if not self.update_constant(op.inputs[1], new_shape):
+                return [out_shape]
+        op.newShape = new_shape
+
+        return [sig]
+
+    def propagate_slice(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        in_sig = input_sigs[0]
+        begin = op.inputs[1].tensor
+        size = op.inputs[2].tensor.copy()
+
+        sig = list(op.outputs[0].shape)
+        for d, s in enumerate(in_sig):
+            if s == -1 and begin[d] == 0 and size[d] in (-1, op.inputs[0].shape[d]):
+                size[d] = -1
+                sig[d] = -1
+
+        if (size != op.inputs[2].tensor).any() and not self.update_constant(op.inputs[2], size):
+            return [list(op.outputs[0].shape)]
+
+        return [sig]
+
+    def propagate_strided_slice(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        if op.ellipsisMask != 0 or op.newAxisMask != 0:
+            return self.propagate_elementwise(op, input_sigs)
+
+        in_sig = input_sigs[0]
+        begin = op.inputs[1].tensor
+        end = op.inputs[2].tensor
+        strides = op.inputs[3].tensor
+
+        sig = []
+        for d, s in enumerate(in_sig):
+            if op.shrinkAxisMask & (1 << d):
+                continue
+            full_begin = op.beginMask & (1 << d) or begin[d] == 0
+            full_end = op.endMask & (1 << d) or end[d] >= op.inputs[0].shape[d]
+            if s == -1 and full_begin and full_end and strides[d] == 1:
+                op.endMask |= 1 << d
+                sig.append(-1)
+            else:
+                sig.append(op.outputs[0].shape[len(sig)])
+
+        return [sig]
+
+    def propagate_concatenation(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        sig = self.propagate_elementwise(op, input_sigs)[0]
+        axis = op.axis if op.axis >= 0 else op.axis + len(sig)
+        sig[axis] = op.outputs[0].shape[axis]
+        return [sig]
+
+    def propagate_pack(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        sig = list(input_sigs[0])
+        for s in input_sigs[1:]:
+            sig = [-1 if -1 in (x, y) else x for x, y in zip(sig, s)]
+        axis = op.axis if op.axis >= 0 else op.axis + len(sig) + 1
+        sig.insert(axis, op.valuesCount)
+        return [sig]
+
+    def propagate_unpack(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        sig = list(input_sigs[0])
+        axis = op.axis if op.axis >= 0 else op.axis + len(sig)
+        del sig[axis]
+        return [list(sig) for _ in op.outputs]
+
+    def propagate_split(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        sig = list(input_sigs[1])
+        axis = int(op.inputs[0].tensor)
+        axis = axis if axis >= 0 else axis + len(sig)
+        return [sig[:axis] + [t.shape[axis]] + sig[axis + 1 :] for t in op.outputs]
+
+    def propagate_split_v(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        sig = list(input_sigs[0])
+        axis = int(op.inputs[2].tensor)
+        axis = axis if axis >= 0 else axis + len(sig)
+        return [sig[:axis] + [t.shape[axis]] + sig[axis + 1 :] for t in op.outputs]
+
+    def propagate_gather(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        in_sig, idx_sig = input_sigs[:2]
+        axis = op.axis if op.axis >= 0 else op.axis + len(in_sig)
+        return [in_sig[:axis] + idx_sig[op.batchDims :] + in_sig[axis + 1 :]]
+
+    def propagate_squeeze(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        in_sig = input_sigs[0]
+        in_shape = op.inputs[0].shape
+        dims = [d if d >= 0 else d + len(in_sig) for d in op.squeezeDims]
+        if len(dims) == 0:
+            dims = [d for d, s in enumerate(in_shape) if s == 1]
+        return [[s for d, s in enumerate(in_sig) if d not in dims]]
+
+    def propagate_expand_dims(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        sig = list(input_sigs[0])
+        axis = int(op.inputs[1].tensor)
+        axis = axis if axis >= 0 else axis + len(sig) + 1
+        sig.insert(axis, 1)
+        return [sig]
+
+    def propagate_reduce(self, op: tfl.BaseOperator, input_sigs: typing.List[typing.List[int]]):
+        in_sig = input_sigs[0]
+        axes = [a if a >= 0 else a + len(in_sig) for a in op.inputs[1].tensor.reshape(-1).tolist()]
+        if op.keepDims:
+            return [[1 if d in axes else s for d, s in enumerate(in_sig)]]
+        else:
+            return [[s for d, s in enumerate(in_sig) if d not in axes]]
+
+    propagate_mean = propagate_reduce
+    propagate_sum = propagate_reduce
+    propagate_reduce_max = propagate_reduce
+    propagate_reduce_min = propagate_reduce
+    propagate_reduce_prod = propagate_reduce
+    propagate_reduce_any = propagate_reduce
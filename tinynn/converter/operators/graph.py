@@ -14,6 +14,58 @@ from tinynn.util.util import get_logger
 log = get_logger(__name__, 'INFO')
 
 
+class CommonSubGraph(object):
+    name: str
+    operators: typing.List[tfl.BaseOperator]
+    inputs: typing.List[tfl.Tensor]
+    outputs: typing.List[tfl.Tensor]
+
+    def __init__(
+        self,
+        name: str,
+        operators: typing.List[tfl.BaseOperator],
+        inputs: typing.List[tfl.Tensor],
+        outputs: typing.List[tfl.Tensor],
+    ) -> None:
+        """A subgraph that is referenced by the control flow ops (e.g. WHILE) in the main graph. The operators in it
+        are expected to be in topological order and are not touched by the graph optimizer.
+
+        Args:
+            name (str): The name of the subgraph
+            operators (typing.List[tfl.BaseOperator]): The operators in the subgraph
+            inputs (typing.List[tfl.Tensor]): The input tensors of the subgraph
+            outputs (typing.List[tfl.Tensor]): The output tensors of the subgraph
+        """
+
+        self.name = name
+        self.operators = operators
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def tensor_map(self) -> typing.Dict[str, tfl.Tensor]:
+        """Collect the tensors in the subgraph
+
+        Returns:
+            typing.Dict[str, tfl.Tensor]: The tensors in the subgraph, with the input tensors coming first
+        """
+
+        tensor_map = {}
+        tensors = list(self.inputs)
+        for op in self.operators:
+            tensors.extend(op.inputs)
+            tensors.extend(op.outputs)
+        tensors.extend(self.outputs)
+
+        for t in tensors:
+            if isinstance(t, tfl.OptionalTensor):
+                continue
+            if t.name in tensor_map:
+                assert tensor_map[t.name] is t, f'tensor {t.name} is defined twice in the subgraph {self.name}'
+            else:
+                tensor_map[t.name] = t
+        return tensor_map
+
+
 class CommonGraph(object):
     graph: ig.Graph
     tensor_map: typing.Dict[str, tfl.Tensor]
@@ -24,6 +76,7 @@ class CommonGraph(object):
     input_transpose: typing.List[bool]
     output_transpose: typing.Union[typing.List[typing.Optional[bool]], typing.Optional[bool]]
     node_op_counter: int
+    subgraphs: typing.List[CommonSubGraph]
 
     def __init__(self) -> None:
         self.graph = ig.Graph(directed=True)
@@ -36,6 +89,7 @@ class CommonGraph(object):
         self.output_transpose = None
         self.node_op_counter = 0
         self.q_mapping = {}
+        self.subgraphs = []
 
     def add_iterable_pair(
         self, input_names: typing.List[str], output_names: typing.List[str], key: typing.Optional[str] = None
@@ -196,6 +250,28 @@ class CommonGraph(object):
             self.tensor_node_map[t.name] = node['name']
         return node
 
+    def add_subgraph(
+        self,
+        name: str,
+        operators: typing.List[tfl.BaseOperator],
+        inputs: typing.List[tfl.Tensor],
+        outputs: typing.List[tfl.Tensor],
+    ) -> int:
+        """Add a subgraph for the control flow ops
+
+        Args:
+            name (str): The name of the subgraph
+            operators (typing.List[tfl.BaseOperator]): The operators in the subgraph
+            inputs (typing.List[tfl.Tensor]): The input tensors of the subgraph
+            outputs (typing.List[tfl.Tensor]): The output tensors of the subgraph
+
+        Returns:
+            int: The index of the subgraph in the model (index 0 is reserved for the main graph)
+        """
+
+        self.subgraphs.append(CommonSubGraph(name, operators, inputs, outputs))
+        return len(self.subgraphs)
+
     def add_outputs(self, names: typing.List[str], node_type=ExtendedOperator.OUTPUT_NODE):
         """Add the output nodes with the names given
 
@@ -494,6 +570,8 @@ class CommonGraph(object):
                 ExtendedOperator.RANDOM_STANDARD_NORMAL,
                 ExtendedOperator.MULTINOMIAL,
                 ExtendedOperator.RANDOM_UNIFORM,
+                # The initial values of the loop variables, e.g. the accumulators for the WHILE loops of RNNs
+                ExtendedOperator.FILL,
             ):
                 output_name = v['outputs'][0]
                 type_name = v['op'].type_name()
@@ -530,12 +608,13 @@ class CommonGraph(object):
         return indices
 
     def collect_operators(
-        self, ops: typing.Optional[typing.List[tfl.BaseOperator]] = None
+        self, ops: typing.Optional[typing.List[tfl.BaseOperator]] = None, start: int = 0
     ) -> typing.List[tfl.BaseOperator]:
         """Collect ops
 
         Args:
             ops (typing.Optional[typing.List[tfl.BaseOperator]], optional): TFLite operators. Defaults to None.
+            start (int, optional): The index of the first op. Defaults to 0.
 
         Returns:
             typing.List[tfl.BaseOperator]: operators with the numbered index
@@ -550,7 +629,7 @@ class CommonGraph(object):
 
         log.debug('Collecting operators...')
         result = []
-        for idx, op in enumerate(ops):
+        for idx, op in enumerate(ops, start):
             log.debug(f'[{idx}] {op.type_name()} {op.inputs} -> {op.outputs}')
             op.op.index = idx
             op.tfl_inputs_idx = [x.index for x in op.inputs]
@@ -640,6 +719,40 @@ class CommonGraph(object):
 
         return tensors, buffers, input_idx, output_idx
 
+    def collect_subgraphs(self, op_start: int, buffer_start: int) -> typing.List[typing.Tuple]:
+        """Collect ops, tensors and I/O indices for the subgraphs
+
+        Args:
+            op_start (int): The index of the first op in the subgraphs
+            buffer_start (int): The index of the first buffer in the subgraphs
+
+        Returns:
+            typing.List[typing.Tuple]: name, operators, tensors, buffers and I/O indices of the subgraphs
+        """
+
+        result = []
+        for subgraph in self.subgraphs:
+            tensor_map = subgraph.tensor_map()
+            inputs = [t.name for t in subgraph.inputs]
+            outputs = [t.name for t in subgraph.outputs]
+
+            tensors, buffers, input_idx, output_idx = self.collect_tensor_buffers(
+                tensor_map.keys(), inputs, outputs, tensor_map
+            )
+
+            # Skip the sentinel buffer and make the buffer indices global
+            buffers = buffers[1:]
+            for buffer in buffers:
+                buffer.index += buffer_start - 1
+            buffer_start += len(buffers)
+
+            ops = self.collect_operators(subgraph.operators, op_start)
+            op_start += len(ops)
+
+            result.append((subgraph.name, ops, tensors, buffers, input_idx, output_idx))
+
+        return result
+
     def convert(self, tflite_path: str):
         """Convert from the TinyNeuralNetwork Graph to the tflite model
 
@@ -650,9 +763,10 @@ class CommonGraph(object):
         # Collect multiple data to build a tflite model
         tensors, buffers, input_idx, output_idx = self.collect_tensor_buffers()
         ops = self.collect_operators()
+        subgraphs = self.collect_subgraphs(len(ops), len(buffers))
 
         # Construct the flatbuffer model
-        tflite_model = self.build_model(ops, tensors, buffers, input_idx, output_idx)
+        tflite_model = self.build_model(ops, tensors, buffers, input_idx, output_idx, subgraphs)
 
         # Check output directory
         tflite_dir = os.path.abspath(os.path.dirname(tflite_path))
@@ -711,6 +825,9 @@ class CommonGraph(object):
         buffers: typing.List[tfl.Buffer],
         input_idx: typing.List[int],
         output_idx: typing.List[int],
+        subgraphs: typing.Optional[typing.List[typing.Tuple]] = None,
+        signatures: typing.Optional[typing.List[typing.Tuple]] = None,
+        name: str = 'main_graph',
     ) -> bytearray:
         """Build the flatbuffer model
 
@@ -720,35 +837,152 @@ class CommonGraph(object):
             buffers (typing.List[tfl.Buffer]): TFLite buffers
             input_idx (typing.List[int]): The indices of the input tensors
             output_idx (typing.List[int]): The indices of the output tensors
+            subgraphs (typing.Optional[typing.List[typing.Tuple]], optional): The extra subgraphs returned by \
+                `collect_subgraphs`. Defaults to None.
+            signatures (typing.Optional[typing.List[typing.Tuple]], optional): The signatures in the form of \
+                (key, subgraph index, input names, input indices, output names, output indices). Defaults to None.
+            name (str, optional): The name of the main graph. Defaults to 'main_graph'.
 
         Returns:
             bytearray: The built flatbuffer model
         """
 
+        if subgraphs is None:
+            subgraphs = []
+
+        if signatures is None:
+            signatures = []
+
         # Start flatbuffer
         builder = flatbuffers.Builder(0)
 
         # Write data into flatbuffer
-        tensor_offsets = [t.build(builder) for t in tensors]
-        op_offsets = [op.build(builder) for op in ops]
-        opcode_offsets = [op.op.build(builder) for op in ops]
-        buffer_offsets = [buffer.build(builder) for buffer in buffers]
-
-        # Build Subgraph
-        subgraph = tfl.SubGraph()
-        subgraph.tensors.extend(tensor_offsets)
-        subgraph.inputs.extend(input_idx)
-        subgraph.outputs.extend(output_idx)
-        subgraph.operators.extend(op_offsets)
+        subgraph_offsets = []
+        all_ops = list(ops)
+        all_buffers = list(buffers)
+        for sub_name, sub_ops, sub_tensors, sub_buffers, sub_input_idx, sub_output_idx in [
+            (name, ops, tensors, [], input_idx, output_idx)
+        ] + subgraphs:
+            tensor_offsets = [t.build(builder) for t in sub_tensors]
+            op_offsets = [op.build(builder) for op in sub_ops]
+
+            # Build Subgraph
+            subgraph = tfl.SubGraph(sub_name)
+            subgraph.tensors.extend(tensor_offsets)
+            subgraph.inputs.extend(sub_input_idx)
+            subgraph.outputs.extend(sub_output_idx)
+            subgraph.operators.extend(op_offsets)
+            subgraph_offsets.append(subgraph.build(builder))
+
+            if sub_ops is not ops:
+                all_ops.extend(sub_ops)
+                all_buffers.extend(sub_buffers)
+
+        opcode_offsets = [op.op.build(builder) for op in all_ops]
+        buffer_offsets = [buffer.build(builder) for buffer in all_buffers]
+
+        signature_offsets = []
+        for key, subgraph_index, input_names, sig_input_idx, output_names, sig_output_idx in signatures:
+            signature = tfl.SignatureDef(key, subgraph_index)
+            signature.inputs.extend(tfl.TensorMap(n, i).build(builder) for n, i in zip(input_names, sig_input_idx))
+            signature.outputs.extend(tfl.TensorMap(n, i).build(builder) for n, i in zip(output_names, sig_output_idx))
+            signature_offsets.append(signature.build(builder))
 
         # Build Model
         model = tfl.Model()
         model.buffers.extend(buffer_offsets)
-        model.subgraphs.append(subgraph.build(builder))
+        model.subgraphs.extend(subgraph_offsets)
         model.opcodes.extend(opcode_offsets)
+        model.signature_defs.extend(signature_offsets)
         model = model.build(builder)
         builder.Finish(model, b"TFL3")
 
         # Finish Model
         tflite_model = builder.Output()
         return tflite_model
+
+
+def convert_multi_signature(graphs: typing.Dict[str, CommonGraph], tflite_path: str):
+    """Convert multiple TinyNeuralNetwork Graphs to a single tflite model, in which each graph is exported as a
+    separate subgraph with its own signature and the identical constant buffers are shared across the subgraphs
+
+    Args:
+        graphs (typing.Dict[str, CommonGraph]): The graphs to be exported, with the signature keys as the keys
+        tflite_path (str): Path of the generated tflite model
+    """
+
+    assert len(graphs) > 0, 'At least one graph is expected'
+
+    buffers = [tfl.Buffer(bytes(0))]
+    buffer_map = {}
+    entries = []
+    extra_subgraphs = []
+    while_ops = []
+    num_bytes = 0
+    for key, graph in graphs.items():
+        tensors, graph_buffers, input_idx, output_idx = graph.collect_tensor_buffers()
+        ops = graph.collect_operators()
+        subgraphs = graph.collect_subgraphs(len(ops), 1)
+        for sub in subgraphs:
+            graph_buffers.extend(sub[3])
+
+        # Share the buffers with identical contents
+        for buffer in graph_buffers[1:]:
+            num_bytes += len(buffer.data)
+            content = bytes(buffer.data)
+            shared = buffer_map.get(content, None)
+            if shared is None or len(content) == 0:
+                buffer.index = len(buffers)
+                buffers.append(buffer)
+                buffer_map.setdefault(content, buffer)
+            else:
+                buffer.index = shared.index
+
+        # The control flow subgraphs are placed after all the signature graphs, so the references to them are shifted
+        sub_shift = len(graphs) - 1 + len(extra_subgraphs)
+        for op in ops + [op for sub in subgraphs for op in sub[1]]:
+            if isinstance(op, tfl.WhileOperator):
+                while_ops.append((op, op.condSubgraphIndex, op.bodySubgraphIndex))
+                op.condSubgraphIndex += sub_shift
+                op.bodySubgraphIndex += sub_shift
+
+        extra_subgraphs.extend(
+            (name, sub_ops, sub_tensors, [], i, o) for name, sub_ops, sub_tensors, _, i, o in subgraphs
+        )
+        entries.append((key, ops, tensors, input_idx, output_idx, graph.inputs, graph.outputs))
+
+    shared_bytes = num_bytes - sum(len(b.data) for b in buffers)
+    log.info(f'{len(buffers) - 1} buffers are kept after deduplication, {shared_bytes} bytes are saved')
+
+    main_key, main_ops, main_tensors, main_input_idx, main_output_idx, _, _ = entries[0]
+    signature_graphs = [(key, ops, tensors, [], i, o) for key, ops, tensors, i, o, _, _ in entries[1:]]
+
+    # Renumber the ops so that the opcodes are in the same order as the subgraphs
+    all_ops = [op for entry in entries for op in entry[1]] + [op for sub in extra_subgraphs for op in sub[1]]
+    for idx, op in enumerate(all_ops):
+        op.op.index = idx
+    signatures = [(key, idx, i_names, i, o_names, o) for idx, (key, _, _, i, o, i_names, o_names) in enumerate(entries)]
+
+    try:
+        tflite_model = graphs[main_key].build_model(
+            main_ops,
+            main_tensors,
+            buffers,
+            main_input_idx,
+            main_output_idx,
+            signature_graphs + extra_subgraphs,
+            signatures,
+            main_key,
+        )
+    finally:
+        for op, cond_idx, body_idx in while_ops:
+            op.condSubgraphIndex = cond_idx
+            op.bodySubgraphIndex = body_idx
+
+    # Check output directory
+    tflite_dir = os.path.abspath(os.path.dirname(tflite_path))
+    os.makedirs(tflite_dir, exist_ok=True)
+
+    # Write to file
+    with open(tflite_path, 'wb') as f:
+        f.write(tflite_model)
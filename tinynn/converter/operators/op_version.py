@@ -22,6 +22,10 @@ class OPVersioner(object):
             if node['node_type'] >= 0:
                 self.process_op(node['op'])
 
+        for subgraph in self.graph.subgraphs:
+            for op in subgraph.operators:
+                self.process_op(op)
+
     def process_op(self, op: tfl.BaseOperator):
         """Sets the version of the OP
 
@@ -14,6 +14,7 @@ from ..schemas.tflite.schema_generated import ActivationFunctionType, Padding
 from . import tflite as tfl
 from .base import FUSE_ACTIVATION_MAP, ExtendedOperator
 from .graph import CommonGraph
+from .target import TargetProfile, delegate_partitions, unsupported_ops
 
 log = get_logger(__name__, 'INFO')
 
@@ -26,6 +27,7 @@ class GraphOptimizer(object):
     group_conv_rewrite: bool
     tflite_micro_rewrite: bool
     quantize_input_output_type: typing.Optional[str]
+    target_profile: typing.Optional[TargetProfile]
 
     # Optimization levels
     NO_OPTIMIZE: int = 0
@@ -50,6 +52,7 @@ class GraphOptimizer(object):
         max_transpose_dims: int = -1,
         bypass_elementwise_passthrough_constraint: bool = False,
         group_tensors: bool = False,
+        target_profile: typing.Optional[TargetProfile] = None,
     ) -> None:
         self.graph = graph
         self.fuse_tensor_count = 0
@@ -65,6 +68,15 @@ class GraphOptimizer(object):
         self.max_transpose_dims = max_transpose_dims
         self.bypass_elementwise_passthrough_constraint = bypass_elementwise_passthrough_constraint
         self.group_tensors = group_tensors
+        self.target_profile = target_profile
+        self.delegate_partitions = None
+
+        # Rewrites that are required by the target
+        if target_profile is not None:
+            self.group_conv_rewrite |= target_profile.group_conv_rewrite
+            self.rewrite_quantizable |= target_profile.rewrite_quantizable
+            if self.max_transpose_dims <= 0:
+                self.max_transpose_dims = target_profile.max_transpose_dims
 
     def create_attr_tensor(
         self, tensor: tfl.Tensor, name: str = None, quantization: typing.Optional[tfl.QuantizationParameters] = None
@@ -2334,6 +2346,195 @@ class GraphOptimizer(object):
 
             self.graph.try_restore_edges(mapping)
 
+    @class_conditional(lambda self: self.level >= GraphOptimizer.COMMON_OPTIMIZE)
+    def fuse_bmm_transpose_pass(self):
+        edges = self.graph.graph.es.select(functools.partial(is_bmm_transpose_edge, graph_converter=self.graph.graph))
+
+        # Collect the foldable inputs for each of the BATCH_MATMUL nodes
+        bmm_inputs = {}
+        for edge in edges:
+            transpose = self.graph.graph.vs[edge.source]
+            bmm = self.graph.graph.vs[edge.target]
+            input_idx = bmm['op'].inputs.index(self.graph.tensor_map[edge['name']])
+            bmm_inputs.setdefault(bmm.index, {})[input_idx] = transpose
+
+        remove_ids = []
+        ops = []
+        restore_mapping = []
+        for bmm_idx, transposes in bmm_inputs.items():
+            bmm = self.graph.graph.vs[bmm_idx]
+
+            restore_nodes = []
+            # For each node that is next of a transformable node,
+            #  a. if it is an output node, remove it anyway since it will always be reconstructed
+            #  b. otherwise, record the info of the edge so that we may restore it after reconstruction
+            for out_edge in bmm.out_edges():
+                next_node = self.graph.graph.vs[out_edge.target]
+                if next_node['node_type'] == ExtendedOperator.OUTPUT_NODE:
+                    remove_ids.append(next_node.index)
+                    del self.graph.tensor_map[next_node['outputs'][0]]
+                    del self.graph.tensor_node_map[next_node['outputs'][0]]
+                else:
+                    restore_nodes.append((out_edge['name'], next_node['name']))
+
+            # Remove the mapping since they are going to be removed
+            for node in [bmm] + list(transposes.values()):
+                for output_name in node['outputs']:
+                    del self.graph.tensor_map[output_name]
+                    del self.graph.tensor_node_map[output_name]
+                remove_ids.append(node.index)
+
+            restore_mapping.append(restore_nodes)
+            ops.append((bmm, {k: v['op'] for k, v in transposes.items()}))
+
+        # Make sure the nodes are topologically sorted
+        sorted_ops = [
+            (node['op'], transposes)
+            for node, transposes in sorted(ops, key=lambda x: int(re.search(r'\d+', x[0]['name'])[0]))
+        ]
+
+        # Delete nodes before transformation in the graph
+        self.graph.graph.delete_vertices(remove_ids)
+
+        for (bmm, transposes), mapping in zip(sorted_ops, restore_mapping):
+            inputs = list(bmm.inputs)
+            adj = [bmm.adjX, bmm.adjY]
+
+            ops = []
+            for input_idx, transpose in transposes.items():
+                # Swapping the last two dimensions of the permutation is the same as flipping the adj flag
+                perm = transpose.inputs[1].tensor.tolist()
+                new_perm = perm[:-2] + [perm[-1], perm[-2]]
+                adj[input_idx] = not adj[input_idx]
+
+                if new_perm == list(range(len(perm))):
+                    inputs[input_idx] = transpose.inputs[0]
+                else:
+                    perm_tensor = self.create_attr_tensor(np.array(new_perm, dtype='int32'))
+                    transposed = self.create_transform_tensor(
+                        np.transpose(transpose.inputs[0].tensor, new_perm),
+                        quantization=transpose.outputs[0].quantization,
+                    )
+                    ops.append(tfl.TransposeOperator([transpose.inputs[0], perm_tensor], [transposed]))
+                    inputs[input_idx] = transposed
+
+            ops.append(
+                tfl.BatchMatmulOperator(
+                    inputs,
+                    bmm.outputs,
+                    adjX=adj[0],
+                    adjY=adj[1],
+                    asymmetricQuantizeInputs=bmm.asymmetricQuantizeInputs,
+                )
+            )
+
+            for op in ops:
+                self.graph.add_operator(op, transform=True)
+
+            self.graph.try_restore_edges(mapping)
+
+    @class_conditional(lambda self: self.level >= GraphOptimizer.COMMON_OPTIMIZE)
+    def fuse_qkv_projection_pass(self):
+        # Collect the projections (FULLY_CONNECTED -> RESHAPE -> TRANSPOSE) that split the heads of the same input
+        groups = {}
+        for vertex in self.graph.graph.vs.select(
+            functools.partial(is_head_split_fc_node, graph_converter=self.graph.graph)
+        ):
+            reshape = vertex.out_edges()[0].target_vertex
+            transpose = reshape.out_edges()[0].target_vertex
+            fc = vertex['op']
+            key = (
+                fc.inputs[0].name,
+                fc.keepNumDims,
+                tuple(reshape['op'].outputs[0].shape),
+                tuple(transpose['op'].inputs[1].tensor.tolist()),
+            )
+            groups.setdefault(key, []).append((vertex, reshape, transpose))
+
+        groups = [v for v in groups.values() if len(v) > 1]
+
+        remove_ids = []
+        ops = []
+        restore_mapping = []
+        for group in groups:
+            restore_nodes = []
+            for fc, reshape, transpose in group:
+                # For each node that is next of a transformable node,
+                #  a. if it is an output node, remove it anyway since it will always be reconstructed
+                #  b. otherwise, record the info of the edge so that we may restore it after reconstruction
+                for out_edge in transpose.out_edges():
+                    next_node = self.graph.graph.vs[out_edge.target]
+                    if next_node['node_type'] == ExtendedOperator.OUTPUT_NODE:
+                        remove_ids.append(next_node.index)
+                        del self.graph.tensor_map[next_node['outputs'][0]]
+                        del self.graph.tensor_node_map[next_node['outputs'][0]]
+                    else:
+                        restore_nodes.append((out_edge['name'], next_node['name']))
+
+                # Remove the mapping since they are going to be removed
+                for node in (fc, reshape, transpose):
+                    for output_name in node['outputs']:
+                        del self.graph.tensor_map[output_name]
+                        del self.graph.tensor_node_map[output_name]
+                    remove_ids.append(node.index)
+
+            restore_mapping.append(restore_nodes)
+            ops.append([[x['op'] for x in nodes] for nodes in group])
+
+        # Delete nodes before transformation in the graph
+        self.graph.graph.delete_vertices(remove_ids)
+
+        for group, mapping in zip(ops, restore_mapping):
+            fc_ops = [x[0] for x in group]
+            input_tensor = fc_ops[0].inputs[0]
+            head_shape = list(group[0][1].outputs[0].shape)
+            perm = group[0][2].inputs[1].tensor.tolist()
+
+            # The heads of the projections are concatenated, which are split after the transpose
+            weight = np.concatenate([op.inputs[1].tensor for op in fc_ops], 0)
+            inputs = [input_tensor, self.create_attr_tensor(weight)]
+            if any((len(op.inputs) > 2 and not isinstance(op.inputs[2], tfl.OptionalTensor) for op in fc_ops)):
+                biases = []
+                for op in fc_ops:
+                    if len(op.inputs) > 2 and not isinstance(op.inputs[2], tfl.OptionalTensor):
+                        biases.append(op.inputs[2].tensor)
+                    else:
+                        biases.append(np.zeros(op.inputs[1].shape[0], dtype=op.inputs[1].dtype))
+                inputs.append(self.create_attr_tensor(np.concatenate(biases, 0)))
+
+            head_axis = len(head_shape) - 2
+            split_axis = perm.index(head_axis)
+            head_shape[head_axis] *= len(fc_ops)
+
+            fc_out = self.create_transform_tensor(
+                np.zeros(list(fc_ops[0].outputs[0].shape[:-1]) + [weight.shape[0]], dtype=weight.dtype)
+            )
+            reshaped = self.create_transform_tensor(np.zeros(head_shape, dtype=weight.dtype))
+            transposed = self.create_transform_tensor(np.transpose(reshaped.tensor, perm))
+            shape_tensor = self.create_attr_tensor(np.array(head_shape, dtype='int32'))
+            perm_tensor = self.create_attr_tensor(np.array(perm, dtype='int32'))
+            axis_tensor = self.create_attr_tensor(np.array(split_axis, dtype='int32'))
+
+            new_ops = [
+                tfl.FullyConnectedOperator(inputs, [fc_out], keepNumDims=fc_ops[0].keepNumDims),
+                tfl.ReshapeOperator([fc_out, shape_tensor], [reshaped], head_shape),
+                tfl.TransposeOperator([reshaped, perm_tensor], [transposed]),
+                tfl.SplitOperator([axis_tensor, transposed], [x[2].outputs[0] for x in group], len(group)),
+            ]
+
+            for op in new_ops:
+                self.graph.add_operator(op, transform=True)
+
+            self.graph.try_restore_edges(mapping)
+
+    def attention_rewrite_pass(self):
+        # Fold the transposes for the keys into the adj flags of the BATCH_MATMUL ops, so that the head split of the
+        # query, key and value projections are the same
+        self.fuse_bmm_transpose_pass()
+
+        # Merge the query, key and value projections, so that the heads are split only once
+        self.fuse_qkv_projection_pass()
+
     @class_conditional(lambda self: self.max_transpose_dims > 0)
     def lower_transpose_dim_pass(self):
         vertices = self.graph.graph.vs.select(
@@ -3186,6 +3387,88 @@ class GraphOptimizer(object):
             self.graph.outputs.clear()
             self.graph.outputs.extend(new_outputs)
 
+    @class_conditional(lambda self: self.target_profile is not None)
+    def delegate_decompose_pass(self):
+        profile = self.target_profile
+        vertices = self.graph.graph.vs.select(
+            functools.partial(is_delegate_decomposable_node, graph_converter=self.graph.graph, profile=profile)
+        )
+
+        remove_ids = []
+        restore_mapping = []
+        for node in vertices:
+            restore_nodes = []
+            # For each node that is next of a decomposable node,
+            #  a. if it is an output node, remove it anyway since it will always be reconstructed
+            #  b. otherwise, record the info of the edge so that we may restore it after reconstruction
+            for out_edge in node.out_edges():
+                next_node = self.graph.graph.vs[out_edge.target]
+                if next_node['node_type'] == ExtendedOperator.OUTPUT_NODE:
+                    remove_ids.append(next_node.index)
+                    del self.graph.tensor_map[next_node['outputs'][0]]
+                    del self.graph.tensor_node_map[next_node['outputs'][0]]
+                else:
+                    restore_nodes.append((out_edge['name'], next_node['name']))
+
+            # Remove the mapping since they are going to be removed
+            for output_name in node['outputs']:
+                del self.graph.tensor_map[output_name]
+                del self.graph.tensor_node_map[output_name]
+
+            restore_mapping.append(restore_nodes)
+            remove_ids.append(node.index)
+
+        # Make sure the nodes are topologically sorted
+        sorted_ops = [node['op'] for node in sorted(vertices, key=lambda x: int(re.search(r'\d+', x['name'])[0]))]
+
+        # Delete nodes before transformation in the graph
+        self.graph.graph.delete_vertices(remove_ids)
+
+        for op, mapping in zip(sorted_ops, restore_mapping):
+            input_tensor = op.inputs[0]
+            output_tensor = op.outputs[0]
+
+            ops = []
+            if isinstance(op, (tfl.SquareOperator, tfl.PowOperator)):
+                ops.append(tfl.MulOperator([input_tensor, input_tensor], [output_tensor]))
+            elif isinstance(op, tfl.SquaredDifferenceOperator):
+                diff = self.create_transform_tensor(input_tensor.tensor - op.inputs[1].tensor)
+                ops.append(tfl.SubOperator([input_tensor, op.inputs[1]], [diff]))
+                ops.append(tfl.MulOperator([diff, diff], [output_tensor]))
+            elif isinstance(op, tfl.RsqrtOperator):
+                sqrt = self.create_transform_tensor(np.sqrt(input_tensor.tensor))
+                one = self.create_attr_tensor(np.array([1.0], dtype=input_tensor.dtype))
+                ops.append(tfl.SqrtOperator([input_tensor], [sqrt]))
+                ops.append(tfl.DivOperator([one, sqrt], [output_tensor]))
+            else:
+                assert False, f'Unknown op for decomposition: {op.type_name()}'
+
+            for new_op in ops:
+                self.graph.add_operator(new_op, transform=True)
+
+            self.graph.try_restore_edges(mapping)
+
+    @class_conditional(lambda self: self.target_profile is not None)
+    def delegate_partition_pass(self):
+        profile = self.target_profile
+
+        partitions = delegate_partitions(self.graph, profile)
+        self.delegate_partitions = len(partitions)
+
+        ops = unsupported_ops(self.graph, profile)
+        log.info(f'Predicted number of partitions for the {profile.name} delegate: {len(partitions)}')
+        if len(ops) > 0:
+            log.info(f'Ops not supported by the {profile.name} delegate: {", ".join(ops)}')
+
+        if profile.max_partitions > 0 and len(partitions) > profile.max_partitions:
+            num_ops = sum((len(p) for p in partitions[profile.max_partitions :]))
+            log.warning(
+                f'The {profile.name} delegate only accepts {profile.max_partitions} partition(s), so {num_ops} op(s)'
+                ' in the remaining partitions will fall back to the CPU kernels'
+            )
+
+        return len(partitions)
+
     def optimize(self):
         # Input/output passes
         self.output_list_unpack_pass()
@@ -3276,6 +3559,9 @@ class GraphOptimizer(object):
             self.fuse_simple_reshape_pass()
             self.fuse_simple_transpose_pass()
 
+        # Attention specific
+        self.attention_rewrite_pass()
+
         self.lower_transpose_dim_pass()
 
         # Some advanced fusion logic
@@ -3304,6 +3590,9 @@ class GraphOptimizer(object):
         self.group_conv_rewrite_pass()
         self.group_deconv_rewrite_pass()
 
+        # Delegate specific
+        self.delegate_decompose_pass()
+
         # TFLite micro specific
         self.cat_split_pass()
         self.split_requantize()
@@ -3446,6 +3735,36 @@ def is_high_dim_transpose_node(vertex: ig.Vertex, graph_converter: ig.Graph, max
     return vertex['node_type'] == ExtendedOperator.TRANSPOSE and vertex['op'].inputs[1].tensor.size > max_transpose_dims
 
 
+def is_delegate_decomposable_node(vertex: ig.Vertex, graph_converter: ig.Graph, profile: TargetProfile):
+    if vertex['node_type'] < 0 or profile.is_supported(vertex['op']):
+        return False
+
+    op = vertex['op']
+    if vertex['node_type'] == ExtendedOperator.SQUARE:
+        return ExtendedOperator.MUL in profile.supported_ops
+    elif vertex['node_type'] == ExtendedOperator.POW:
+        return (
+            op.inputs[1].buffer is not None
+            and op.inputs[1].tensor.size == 1
+            and np.all(op.inputs[1].tensor == 2)
+            and ExtendedOperator.MUL in profile.supported_ops
+        )
+    elif vertex['node_type'] == ExtendedOperator.SQUARED_DIFFERENCE:
+        return (
+            op.inputs[0].quantization is None
+            and ExtendedOperator.SUB in profile.supported_ops
+            and ExtendedOperator.MUL in profile.supported_ops
+        )
+    elif vertex['node_type'] == ExtendedOperator.RSQRT:
+        return (
+            op.inputs[0].quantization is None
+            and ExtendedOperator.SQRT in profile.supported_ops
+            and ExtendedOperator.DIV in profile.supported_ops
+        )
+
+    return False
+
+
 def is_group_conv_node(vertex: ig.Vertex, graph_converter: ig.Graph):
     return (
         vertex['node_type'] == ExtendedOperator.CONV_2D
@@ -3755,6 +4074,58 @@ def is_bmm_add_edge(edge: ig.Edge, graph_converter: ig.Graph):
     )
 
 
+def is_bmm_transpose_edge(edge: ig.Edge, graph_converter: ig.Graph):
+    source_vertex = graph_converter.vs[edge.source]
+    target_vertex = graph_converter.vs[edge.target]
+
+    if (
+        source_vertex['node_type'] != ExtendedOperator.TRANSPOSE
+        or target_vertex['node_type'] != ExtendedOperator.BATCH_MATMUL
+    ):
+        return False
+
+    # Only the transposes that move the last dimension to the second last one are folded, so that the last dimension
+    # is kept after folding
+    perm = source_vertex['op'].inputs[1].tensor.tolist()
+    input_names = [t.name for t in target_vertex['op'].inputs[:2]]
+    return (
+        source_vertex.outdegree() == 1
+        and len(perm) >= 2
+        and perm[-2] == len(perm) - 1
+        and input_names.count(edge['name']) == 1
+    )
+
+
+def is_head_split_fc_node(vertex: ig.Vertex, graph_converter: ig.Graph):
+    if vertex['node_type'] != ExtendedOperator.FULLY_CONNECTED or vertex.outdegree() != 1:
+        return False
+
+    fc = vertex['op']
+    if (
+        fc.fusedActivationFunction != ActivationFunctionType.NONE
+        or fc.inputs[1].buffer is None
+        or str(fc.inputs[1].dtype) != 'float32'
+        or fc.outputs[0].quantization is not None
+    ):
+        return False
+
+    reshape = vertex.out_edges()[0].target_vertex
+    if reshape['node_type'] != ExtendedOperator.RESHAPE or reshape.outdegree() != 1:
+        return False
+
+    in_shape = list(fc.outputs[0].shape)
+    out_shape = list(reshape['op'].outputs[0].shape)
+    if len(out_shape) != len(in_shape) + 1 or out_shape[:-2] != in_shape[:-1]:
+        return False
+
+    transpose = reshape.out_edges()[0].target_vertex
+    return (
+        transpose['node_type'] == ExtendedOperator.TRANSPOSE
+        and transpose.outdegree() >= 1
+        and transpose['op'].inputs[1].buffer is not None
+    )
+
+
 def is_wrapped_reshape_within_transpose_edge(edge: ig.Edge, graph_converter: ig.Graph):
     source_vertex = graph_converter.vs[edge.source]
     target_vertex = graph_converter.vs[edge.target]
@@ -0,0 +1,324 @@
+import typing
+
+import igraph as ig
+
+from . import tflite as tfl
+from .base import ExtendedOperator
+from .graph import CommonGraph
+
+from tinynn.util.util import get_logger
+
+log = get_logger(__name__, 'INFO')
+
+
+# Ops that are supported by the delegates in general. The tables are collected from the docs of the delegates in
+# TensorFlow Lite, but they may lag behind the latest versions of the runtime, so they are only used for estimation.
+_COMMON_OPS = {
+    ExtendedOperator.ADD,
+    ExtendedOperator.AVERAGE_POOL_2D,
+    ExtendedOperator.CONCATENATION,
+    ExtendedOperator.CONV_2D,
+    ExtendedOperator.DEPTHWISE_CONV_2D,
+    ExtendedOperator.DEPTH_TO_SPACE,
+    ExtendedOperator.DEQUANTIZE,
+    ExtendedOperator.DIV,
+    ExtendedOperator.ELU,
+    ExtendedOperator.FLOOR,
+    ExtendedOperator.FULLY_CONNECTED,
+    ExtendedOperator.HARD_SWISH,
+    ExtendedOperator.LEAKY_RELU,
+    ExtendedOperator.LOGISTIC,
+    ExtendedOperator.MAX_POOL_2D,
+    ExtendedOperator.MAXIMUM,
+    ExtendedOperator.MEAN,
+    ExtendedOperator.MINIMUM,
+    ExtendedOperator.MUL,
+    ExtendedOperator.NEG,
+    ExtendedOperator.PAD,
+    ExtendedOperator.PRELU,
+    ExtendedOperator.QUANTIZE,
+    ExtendedOperator.RELU,
+    ExtendedOperator.RELU6,
+    ExtendedOperator.RELU_N1_TO_1,
+    ExtendedOperator.RESHAPE,
+    ExtendedOperator.RESIZE_BILINEAR,
+    ExtendedOperator.SLICE,
+    ExtendedOperator.SOFTMAX,
+    ExtendedOperator.SPACE_TO_DEPTH,
+    ExtendedOperator.SPLIT,
+    ExtendedOperator.SQRT,
+    ExtendedOperator.STRIDED_SLICE,
+    ExtendedOperator.SUB,
+    ExtendedOperator.TANH,
+    ExtendedOperator.TRANSPOSE,
+    ExtendedOperator.TRANSPOSE_CONV,
+}
+
+_XNNPACK_OPS = _COMMON_OPS | {
+    ExtendedOperator.ABS,
+    ExtendedOperator.BATCH_MATMUL,
+    ExtendedOperator.CEIL,
+    ExtendedOperator.GELU,
+    ExtendedOperator.RESIZE_NEAREST_NEIGHBOR,
+    ExtendedOperator.ROUND,
+    ExtendedOperator.SQUARE,
+    ExtendedOperator.SQUARED_DIFFERENCE,
+}
+
+_GPU_OPS = _COMMON_OPS | {
+    ExtendedOperator.ABS,
+    ExtendedOperator.BATCH_MATMUL,
+    ExtendedOperator.CEIL,
+    ExtendedOperator.COS,
+    ExtendedOperator.EXP,
+    ExtendedOperator.LOG,
+    ExtendedOperator.MIRROR_PAD,
+    ExtendedOperator.PACK,
+    ExtendedOperator.POW,
+    ExtendedOperator.REDUCE_MAX,
+    ExtendedOperator.REDUCE_MIN,
+    ExtendedOperator.REDUCE_PROD,
+    ExtendedOperator.RESIZE_NEAREST_NEIGHBOR,
+    ExtendedOperator.RSQRT,
+    ExtendedOperator.SIN,
+    ExtendedOperator.SQUARE,
+    ExtendedOperator.SQUARED_DIFFERENCE,
+    ExtendedOperator.SUM,
+    ExtendedOperator.TILE,
+}
+
+_NNAPI_OPS = _COMMON_OPS | {
+    ExtendedOperator.ABS,
+    ExtendedOperator.BATCH_TO_SPACE_ND,
+    ExtendedOperator.CAST,
+    ExtendedOperator.EQUAL,
+    ExtendedOperator.EXP,
+    ExtendedOperator.EXPAND_DIMS,
+    ExtendedOperator.GATHER,
+    ExtendedOperator.GREATER,
+    ExtendedOperator.GREATER_EQUAL,
+    ExtendedOperator.L2_NORMALIZATION,
+    ExtendedOperator.LESS,
+    ExtendedOperator.LESS_EQUAL,
+    ExtendedOperator.LOG,
+    ExtendedOperator.LOG_SOFTMAX,
+    ExtendedOperator.MIRROR_PAD,
+    ExtendedOperator.NOT_EQUAL,
+    ExtendedOperator.PACK,
+    ExtendedOperator.PADV2,
+    ExtendedOperator.POW,
+    ExtendedOperator.REDUCE_MAX,
+    ExtendedOperator.REDUCE_MIN,
+    ExtendedOperator.REDUCE_PROD,
+    ExtendedOperator.RESIZE_NEAREST_NEIGHBOR,
+    ExtendedOperator.RSQRT,
+    ExtendedOperator.SELECT,
+    ExtendedOperator.SELECT_V2,
+    ExtendedOperator.SIN,
+    ExtendedOperator.SPACE_TO_BATCH_ND,
+    ExtendedOperator.SPLIT_V,
+    ExtendedOperator.SQUEEZE,
+    ExtendedOperator.SUM,
+    ExtendedOperator.TILE,
+    ExtendedOperator.TOPK_V2,
+    ExtendedOperator.UNIDIRECTIONAL_SEQUENCE_LSTM,
+}
+
+
+class TargetProfile(object):
+    name: str
+    supported_ops: typing.Set[ExtendedOperator]
+    supported_dtypes: typing.Set[str]
+    max_rank: int
+    max_partitions: int
+    group_conv_rewrite: bool
+    rewrite_quantizable: bool
+    max_transpose_dims: int
+
+    def __init__(
+        self,
+        name: str,
+        supported_ops: typing.Iterable[ExtendedOperator],
+        supported_dtypes: typing.Iterable[str],
+        max_rank: int = -1,
+        max_partitions: int = -1,
+        group_conv_rewrite: bool = False,
+        rewrite_quantizable: bool = False,
+        max_transpose_dims: int = -1,
+    ) -> None:
+        """The description of a delegate (or a runtime) of TFLite
+
+        Args:
+            name (str): The name of the profile
+            supported_ops (typing.Iterable[ExtendedOperator]): The ops that can be handled by the delegate
+            supported_dtypes (typing.Iterable[str]): The dtypes of the activation tensors that can be handled
+            max_rank (int, optional): Max rank of the activation tensors. Defaults to -1, which means unlimited
+            max_partitions (int, optional): Max number of the partitions that will be delegated. Defaults to -1, \
+                which means unlimited
+            group_conv_rewrite (bool, optional): Whether group [de]convolution should be rewritten. Defaults to False
+            rewrite_quantizable (bool, optional): Whether quantizable ops should be rewritten. Defaults to False
+            max_transpose_dims (int, optional): Max dimensions for the `Transpose` op. Defaults to -1
+        """
+
+        self.name = name
+        self.supported_ops = set(supported_ops)
+        self.supported_dtypes = set(supported_dtypes)
+        self.max_rank = max_rank
+        self.max_partitions = max_partitions
+        self.group_conv_rewrite = group_conv_rewrite
+        self.rewrite_quantizable = rewrite_quantizable
+        self.max_transpose_dims = max_transpose_dims
+
+    def is_supported(self, op: tfl.BaseOperator) -> bool:
+        """Whether the op can be handled by the delegate
+
+        Args:
+            op (tfl.BaseOperator): The TFLite operator
+
+        Returns:
+            bool: Whether the op is supported
+        """
+
+        if op.op.custom_code is not None or op.op.code not in self.supported_ops:
+            return False
+
+        for t in op.inputs + op.outputs:
+            # Constant tensors (weights, shapes, permutations, etc.) are not limited by the delegates
+            if isinstance(t, tfl.OptionalTensor) or t.buffer is not None:
+                continue
+
+            if str(t.dtype) not in self.supported_dtypes:
+                return False
+
+            if self.max_rank > 0 and len(t.shape) > self.max_rank:
+                return False
+
+        if op.op.code == ExtendedOperator.CONV_2D and op.inputs[0].shape[3] != op.inputs[1].shape[3]:
+            return not self.group_conv_rewrite
+
+        return True
+
+    def __repr__(self) -> str:
+        return f'TargetProfile({self.name})'
+
+
+TARGET_PROFILES = {
+    'xnnpack': TargetProfile(
+        'xnnpack',
+        _XNNPACK_OPS,
+        ('float32', 'float16', 'int8', 'uint8'),
+        max_rank=6,
+        rewrite_quantizable=True,
+        max_transpose_dims=6,
+    ),
+    'gpu': TargetProfile(
+        'gpu',
+        _GPU_OPS,
+        ('float32', 'float16', 'int8', 'uint8'),
+        max_rank=4,
+        max_partitions=1,
+        group_conv_rewrite=True,
+        max_transpose_dims=4,
+    ),
+    'nnapi': TargetProfile(
+        'nnapi',
+        _NNAPI_OPS,
+        ('float32', 'float16', 'int8', 'uint8', 'int32'),
+        max_rank=4,
+        max_partitions=3,
+        group_conv_rewrite=True,
+        rewrite_quantizable=True,
+        max_transpose_dims=4,
+    ),
+}
+
+
+def get_target_profile(profile: typing.Union[str, TargetProfile]) -> TargetProfile:
+    """Get the target profile by name
+
+    Args:
+        profile (typing.Union[str, TargetProfile]): The name of the profile, or the profile itself
+
+    Returns:
+        TargetProfile: The target profile
+    """
+
+    if isinstance(profile, TargetProfile):
+        return profile
+
+    if profile not in TARGET_PROFILES:
+        raise AttributeError(f'unknown target profile: {profile}, expected: {", ".join(TARGET_PROFILES.keys())}')
+
+    return TARGET_PROFILES[profile]
+
+
+def delegate_partitions(graph: CommonGraph, profile: TargetProfile) -> typing.List[typing.List[ig.Vertex]]:
+    """Predict the partitions that will be delegated, using the same greedy strategy as TFLite, which alternately
+    collects all the ready nodes of the same kind (supported or unsupported) in topological order
+
+    Args:
+        graph (CommonGraph): The graph to be partitioned
+        profile (TargetProfile): The target profile
+
+    Returns:
+        typing.List[typing.List[ig.Vertex]]: The op nodes in each of the delegated partitions
+    """
+
+    op_nodes = [v for v in graph.graph.vs if v['node_type'] >= 0]
+    if len(op_nodes) == 0:
+        return []
+
+    supported = {v.index: profile.is_supported(v['op']) for v in op_nodes}
+
+    pending = {}
+    for v in op_nodes:
+        pending[v.index] = len([e for e in v.in_edges() if e.source in supported])
+
+    ready = {True: [], False: []}
+    for v in op_nodes:
+        if pending[v.index] == 0:
+            ready[supported[v.index]].append(v.index)
+
+    partitions = []
+    kind = len(ready[True]) > 0
+    while len(ready[True]) + len(ready[False]) > 0:
+        queue = ready[kind]
+        ready[kind] = []
+        nodes = []
+        while queue:
+            idx = queue.pop(0)
+            nodes.append(idx)
+            for e in graph.graph.vs[idx].out_edges():
+                if e.target not in pending:
+                    continue
+                pending[e.target] -= 1
+                if pending[e.target] == 0:
+                    if supported[e.target] == kind:
+                        queue.append(e.target)
+                    else:
+                        ready[supported[e.target]].append(e.target)
+
+        if kind and len(nodes) > 0:
+            partitions.append([graph.graph.vs[i] for i in nodes])
+
+        kind = not kind
+
+    return partitions
+
+
+def unsupported_ops(graph: CommonGraph, profile: TargetProfile) -> typing.List[str]:
+    """Returns the names of the ops that are not supported by the delegate
+
+    Args:
+        graph (CommonGraph): The graph to be checked
+        profile (TargetProfile): The target profile
+
+    Returns:
+        typing.List[str]: The type names of the unsupported ops
+    """
+
+    ops = set()
+    for v in graph.graph.vs:
+        if v['node_type'] >= 0 and not profile.is_supported(v['op']):
+            ops.add(v['op'].type_name())
+    return sorted(ops)
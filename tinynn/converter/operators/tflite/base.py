@@ -161,6 +161,7 @@ class Tensor(object):
     buffer: typing.Optional[Buffer]
     dtype: np.dtype
     shape: typing.Iterable[int]
+    shape_signature: typing.Optional[typing.Iterable[int]]
     tfl_tensor: int
 
     def __init__(
@@ -259,6 +260,7 @@ class Tensor(object):
 
         self.dtype = self.tensor.dtype
         self.shape = self.tensor.shape
+        self.shape_signature = None
 
         if quantization is not None:
             self.quantization = copy.deepcopy(quantization)
@@ -277,6 +279,10 @@ class Tensor(object):
         shape = create_numpy_array(builder, tflite.Tensor.Shape, self.shape)
         dtype = numpy_tflite_dtype_mappings[str(self.dtype)]
 
+        shape_signature = 0
+        if self.shape_signature is not None:
+            shape_signature = create_numpy_array(builder, tflite.Tensor.ShapeSignature, self.shape_signature)
+
         buffer = 0
         if self.buffer is not None:
             buffer = self.buffer.index
@@ -292,6 +298,8 @@ class Tensor(object):
         tflite.TensorAddShape(builder, shape)
         tflite.TensorAddType(builder, dtype)
         tflite.TensorAddQuantization(builder, quantization)
+        if shape_signature != 0:
+            tflite.TensorAddShapeSignature(builder, shape_signature)
         self.tfl_tensor = tflite.TensorEnd(builder)
 
         return self.tfl_tensor
@@ -305,6 +313,7 @@ class OptionalTensor(Tensor):
         self.is_variable = False
         self.tensor = None
         self.shape = None
+        self.shape_signature = None
         self.dtype = None
         self.buffer = None
 
@@ -320,9 +329,11 @@ class SubGraph(object):
     inputs: typing.List[int]
     outputs: typing.List[int]
     operators: typing.List[Offset]
+    name: str
     tfl_subgraph: int
 
-    def __init__(self):
+    def __init__(self, name: str = 'main_graph'):
+        self.name = name
         self.tensors = []
         self.inputs = []
         self.outputs = []
@@ -335,7 +346,7 @@ class SubGraph(object):
         outputs = create_numpy_array(builder, tflite.SubGraph.Outputs, self.outputs)
         operators = create_offset_vector(builder, tflite.SubGraph.Operators, self.operators)
         tensors = create_offset_vector(builder, tflite.SubGraph.Tensors, self.tensors)
-        name = create_string(builder, tflite.SubGraph.Name, "main_graph")
+        name = create_string(builder, tflite.SubGraph.Name, self.name)
 
         tflite.SubGraphStart(builder)
         tflite.SubGraphAddInputs(builder, inputs)
@@ -348,16 +359,70 @@ class SubGraph(object):
         return self.tfl_subgraph
 
 
+class TensorMap(object):
+    name: str
+    tensor_index: int
+    tfl_tensor_map: Offset
+
+    def __init__(self, name: str, tensor_index: int):
+        self.name = name
+        self.tensor_index = tensor_index
+
+        self.tfl_tensor_map = 0
+
+    def build(self, builder: flatbuffers.Builder) -> Offset:
+        name = create_string(builder, tflite.TensorMap.Name, self.name)
+
+        tflite.TensorMapStart(builder)
+        tflite.TensorMapAddName(builder, name)
+        tflite.TensorMapAddTensorIndex(builder, self.tensor_index)
+        self.tfl_tensor_map = tflite.TensorMapEnd(builder)
+
+        return self.tfl_tensor_map
+
+
+class SignatureDef(object):
+    inputs: typing.List[Offset]
+    outputs: typing.List[Offset]
+    signature_key: str
+    subgraph_index: int
+    tfl_signature_def: Offset
+
+    def __init__(self, signature_key: str, subgraph_index: int):
+        self.signature_key = signature_key
+        self.subgraph_index = subgraph_index
+        self.inputs = []
+        self.outputs = []
+
+        self.tfl_signature_def = 0
+
+    def build(self, builder: flatbuffers.Builder) -> Offset:
+        inputs = create_offset_vector(builder, tflite.SignatureDef.Inputs, self.inputs)
+        outputs = create_offset_vector(builder, tflite.SignatureDef.Outputs, self.outputs)
+        signature_key = create_string(builder, tflite.SignatureDef.SignatureKey, self.signature_key)
+
+        tflite.SignatureDefStart(builder)
+        tflite.SignatureDefAddInputs(builder, inputs)
+        tflite.SignatureDefAddOutputs(builder, outputs)
+        tflite.SignatureDefAddSignatureKey(builder, signature_key)
+        tflite.SignatureDefAddSubgraphIndex(builder, self.subgraph_index)
+        self.tfl_signature_def = tflite.SignatureDefEnd(builder)
+
+        return self.tfl_signature_def
+
+
 class Model(object):
     buffers: typing.List[Offset]
     opcodes: typing.List[Offset]
     subgraphs: typing.List[Offset]
+    signature_defs: typing.List[Offset]
     tfl_model: Offset
 
     def __init__(self):
         self.buffers = []
         self.opcodes = []
         self.subgraphs = []
+        self.signature_defs = []
 
         self.tfl_model = 0
 
@@ -368,12 +433,18 @@ class Model(object):
         description = create_string(builder, tflite.Model.Description, "TinyNeuralNetwork Converted.")
         version = 3
 
+        signature_defs = 0
+        if len(self.signature_defs) > 0:
+            signature_defs = create_offset_vector(builder, tflite.Model.SignatureDefs, self.signature_defs)
+
         tflite.ModelStart(builder)
         tflite.ModelAddBuffers(builder, buffers)
         tflite.ModelAddDescription(builder, description)
         tflite.ModelAddVersion(builder, version)
         tflite.ModelAddOperatorCodes(builder, opcodes)
         tflite.ModelAddSubgraphs(builder, subgraphs)
+        if signature_defs != 0:
+            tflite.ModelAddSignatureDefs(builder, signature_defs)
         self.tfl_model = tflite.ModelEnd(builder)
 
         return self.tfl_model
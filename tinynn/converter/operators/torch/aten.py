@@ -67,6 +67,76 @@ class ATenLstmOperator(ATenLstmSchema):
             assert self.unroll_rnn, "Input state tensors are only supported when unroll_rnn=True is specified"
             input_tensors[input_index] = tf_state_tensor[slice_idx]
 
+    def lstm_weight_helper(self, input_tensors, input_start):
+        if not self.separated_rnn_gate_calc:
+            w_i = self.create_attr_tensor(
+                np.concatenate([input_tensors[x].tensor for x in range(input_start, input_start + 4)], 0),
+                quantization=input_tensors[input_start].quantization,
+            )
+            w_r = self.create_attr_tensor(
+                np.concatenate([input_tensors[x].tensor for x in range(input_start + 4, input_start + 8)], 0),
+                quantization=input_tensors[input_start + 4].quantization,
+            )
+            b_i = self.create_attr_tensor(
+                np.concatenate([input_tensors[x].tensor for x in range(input_start + 11, input_start + 15)], 0)
+            )
+            b_r = self.create_attr_tensor(np.zeros_like(b_i.tensor))
+            return [w_i], [w_r], [b_i], [b_r]
+        else:
+            w_i_list = [input_tensors[x] for x in range(input_start, input_start + 4)]
+            w_r_list = [input_tensors[x] for x in range(input_start + 4, input_start + 8)]
+            b_i_list = [input_tensors[x] for x in range(input_start + 11, input_start + 15)]
+            b_r_list = [self.create_attr_tensor(np.zeros_like(b_i.tensor)) for b_i in b_i_list]
+            return w_i_list, w_r_list, b_i_list, b_r_list
+
+    def lstm_step_helper(self, ops, t, h, c, weights):
+        gate_outs = []
+        for w_i, w_r, b_i, b_r in zip(*weights):
+            input_mm = self.create_transform_tensor(np.matmul(t.tensor, np.transpose(w_i.tensor, [1, 0])) + b_i.tensor)
+            ops.append(tfl.FullyConnectedOperator([t, w_i, b_i], [input_mm]))
+
+            hidden_mm = self.create_transform_tensor(np.matmul(h.tensor, np.transpose(w_r.tensor, [1, 0])) + b_r.tensor)
+            ops.append(tfl.FullyConnectedOperator([h, w_r, b_r], [hidden_mm]))
+
+            add_out = self.create_transform_tensor(input_mm.tensor + hidden_mm.tensor)
+            ops.append(tfl.AddOperator([input_mm, hidden_mm], [add_out]))
+            gate_outs.append(add_out)
+
+        if len(gate_outs) == 1:
+            add_out = gate_outs[0]
+            gate_outs = [self.create_transform_tensor(t) for t in np.split(add_out.tensor, 4, 1)]
+            split_dim_tensor = self.create_attr_tensor(np.array([1], dtype='int32'))
+            ops.append(tfl.SplitOperator([split_dim_tensor, add_out], gate_outs, 4))
+
+        gate_i = self.create_transform_tensor(torch.sigmoid(torch.from_numpy(gate_outs[0].tensor)).numpy())
+        ops.append(tfl.LogisticOperator([gate_outs[0]], [gate_i]))
+
+        gate_f = self.create_transform_tensor(torch.sigmoid(torch.from_numpy(gate_outs[1].tensor)).numpy())
+        ops.append(tfl.LogisticOperator([gate_outs[1]], [gate_f]))
+
+        gate_g = self.create_transform_tensor(np.tanh(gate_outs[2].tensor))
+        ops.append(tfl.TanhOperator([gate_outs[2]], [gate_g]))
+
+        gate_o = self.create_transform_tensor(torch.sigmoid(torch.from_numpy(gate_outs[3].tensor)).numpy())
+        ops.append(tfl.LogisticOperator([gate_outs[3]], [gate_o]))
+
+        c_left = self.create_transform_tensor(gate_f.tensor * c.tensor)
+        ops.append(tfl.MulOperator([gate_f, c], [c_left]))
+
+        c_right = self.create_transform_tensor(gate_i.tensor * gate_g.tensor)
+        ops.append(tfl.MulOperator([gate_i, gate_g], [c_right]))
+
+        c = self.create_transform_tensor(c_left.tensor + c_right.tensor)
+        ops.append(tfl.AddOperator([c_left, c_right], [c]))
+
+        c_act = self.create_transform_tensor(np.tanh(c.tensor))
+        ops.append(tfl.TanhOperator([c], [c_act]))
+
+        h = self.create_transform_tensor(gate_o.tensor * c_act.tensor)
+        ops.append(tfl.MulOperator([gate_o, c_act], [h]))
+
+        return [h, c]
+
     def parse_common(
         self,
         input_tensor,
@@ -166,7 +236,45 @@ class ATenLstmOperator(ATenLstmSchema):
                 layer_output = self.create_transform_tensor(np.empty(output_shape, dtype=inputs[0].dtype))
             outputs = [layer_output]
 
-            if self.unroll_rnn:
+            if self.unroll_rnn and self.rnn_while_loop:
+                ts_axis = 1 if batch_first else 0
+                output_ts = []
+                for direction_idx in range(num_directions):
+                    input_start = input_start_indices[direction_idx]
+                    weights = self.lstm_weight_helper(inputs, input_start)
+
+                    state_start = state_start_index + direction_idx * num_directions
+                    h = inputs[state_start]
+                    c = inputs[state_start + 1]
+
+                    if bidirectional:
+                        output_shape = list(outputs[0].shape)
+                        output_shape[-1] //= 2
+                        direction_output = self.create_transform_tensor(np.empty(output_shape, dtype=outputs[0].dtype))
+                    else:
+                        direction_output = outputs[0]
+
+                    h, c = self.rnn_while_loop_helper(
+                        graph_converter,
+                        ops,
+                        inputs[0],
+                        [h, c],
+                        direction_output,
+                        ts_axis,
+                        direction_idx == 1,
+                        lambda step_ops, t, states, weights=weights: self.lstm_step_helper(
+                            step_ops, t, states[0], states[1], weights
+                        ),
+                    )
+
+                    tf_out_state_tensors[0].append(h)
+                    tf_out_state_tensors[1].append(c)
+
+                    output_ts.append(direction_output)
+
+                if bidirectional:
+                    ops.append(tfl.ConcatenationOperator(output_ts, outputs, axis=2))
+            elif self.unroll_rnn:
                 ts_axis = 1 if batch_first else 0
                 num_timestep = inputs[0].shape[ts_axis]
                 if inputs[0].name in unpacked_tensors:
@@ -530,6 +638,59 @@ class ATenGruOperator(ATenGruSchema):
             assert self.unroll_rnn, "Input state tensors are only supported when unroll_rnn=True is specified"
             input_tensors[input_index] = tf_state_tensor[slice_idx]
 
+    def gru_step_helper(self, ops, t, h, weights):
+        w_i_list, w_r_list, b_i_list, b_r_list = weights
+
+        input_mm_list = []
+        for w_i, b_i in zip(w_i_list, b_i_list):
+            input_mm = self.create_transform_tensor(np.matmul(t.tensor, np.transpose(w_i.tensor, [1, 0])) + b_i.tensor)
+            ops.append(tfl.FullyConnectedOperator([t, w_i, b_i], [input_mm]))
+            input_mm_list.append(input_mm)
+
+        hidden_mm_list = []
+        for w_r, b_r in zip(w_r_list, b_r_list):
+            hidden_mm = self.create_transform_tensor(np.matmul(h.tensor, np.transpose(w_r.tensor, [1, 0])) + b_r.tensor)
+            ops.append(tfl.FullyConnectedOperator([h, w_r, b_r], [hidden_mm]))
+            hidden_mm_list.append(hidden_mm)
+
+        # calculate r,z,n gates
+        rgate_in = self.create_transform_tensor(input_mm_list[0].tensor + hidden_mm_list[0].tensor)
+        ops.append(tfl.AddOperator([input_mm_list[0], hidden_mm_list[0]], [rgate_in]))
+
+        zgate_in = self.create_transform_tensor(input_mm_list[1].tensor + hidden_mm_list[1].tensor)
+        ops.append(tfl.AddOperator([input_mm_list[1], hidden_mm_list[1]], [zgate_in]))
+
+        zgate_out = self.create_transform_tensor(torch.sigmoid(torch.from_numpy(zgate_in.tensor)).numpy())
+        ops.append(tfl.LogisticOperator([zgate_in], [zgate_out]))
+
+        rgate_out = self.create_transform_tensor(torch.sigmoid(torch.from_numpy(rgate_in.tensor)).numpy())
+        ops.append(tfl.LogisticOperator([rgate_in], [rgate_out]))
+
+        ngate_in_hside = self.create_transform_tensor(rgate_out.tensor * hidden_mm_list[2].tensor)
+        ops.append(tfl.MulOperator([rgate_out, hidden_mm_list[2]], [ngate_in_hside]))
+
+        ngate_in = self.create_transform_tensor(input_mm_list[2].tensor + ngate_in_hside.tensor)
+        ops.append(tfl.AddOperator([input_mm_list[2], ngate_in_hside], [ngate_in]))
+
+        ngate_out = self.create_transform_tensor(torch.tanh(torch.from_numpy(ngate_in.tensor)).numpy())
+        ops.append(tfl.TanhOperator([ngate_in], [ngate_out]))
+
+        constant_tensor = self.create_attr_tensor(torch.tensor(1, dtype=torch.float32))
+
+        h_left_0 = self.create_transform_tensor(constant_tensor.tensor - zgate_out.tensor)
+        ops.append(tfl.SubOperator([constant_tensor, zgate_out], [h_left_0]))
+
+        h_left = self.create_transform_tensor(h_left_0.tensor * ngate_out.tensor)
+        ops.append(tfl.MulOperator([h_left_0, ngate_out], [h_left]))
+
+        h_right = self.create_transform_tensor(zgate_out.tensor * h.tensor)
+        ops.append(tfl.MulOperator([zgate_out, h], [h_right]))
+
+        h = self.create_transform_tensor(h_left.tensor + h_right.tensor)
+        ops.append(tfl.AddOperator([h_left, h_right], [h]))
+
+        return [h]
+
     def parse_common(
         self,
         input_tensor,
@@ -636,7 +797,49 @@ class ATenGruOperator(ATenGruSchema):
 
             outputs = [layer_output]
 
-            if self.unroll_rnn:
+            if self.unroll_rnn and self.rnn_while_loop:
+                ts_axis = 1 if batch_first else 0
+                output_ts = []
+                for direction_idx in range(num_directions):
+                    weights = self.gru_input_helper(
+                        inputs,
+                        params_tensors,
+                        has_biases,
+                        params_offset + param_start_indices[direction_idx],
+                        input_start_indices[direction_idx],
+                        layer_idx,
+                        suffixes[direction_idx],
+                    )
+
+                    h = inputs[state_start_index[direction_idx]]
+
+                    if bidirectional:
+                        output_shape = list(outputs[0].shape)
+                        output_shape[-1] //= 2
+                        direction_output = self.create_transform_tensor(np.empty(output_shape, dtype=outputs[0].dtype))
+                    else:
+                        direction_output = outputs[0]
+
+                    (h,) = self.rnn_while_loop_helper(
+                        graph_converter,
+                        ops,
+                        inputs[0],
+                        [h],
+                        direction_output,
+                        ts_axis,
+                        direction_idx == 1,
+                        lambda step_ops, t, states, weights=weights: self.gru_step_helper(
+                            step_ops, t, states[0], weights
+                        ),
+                    )
+
+                    tf_out_state_tensors[0].append(h)
+
+                    output_ts.append(direction_output)
+
+                if bidirectional:
+                    ops.append(tfl.ConcatenationOperator(output_ts, outputs, axis=2))
+            elif self.unroll_rnn:
                 ts_axis = 1 if batch_first else 0
                 num_timestep = inputs[0].shape[ts_axis]
                 if inputs[0].name in unpacked_tensors:
@@ -30,6 +30,7 @@ class OperatorConverter(ABC):
         unroll_rnn=False,
         separated_rnn_gate_calc=False,
         conv_transpose_with_bias=True,
+        rnn_while_loop=False,
     ) -> None:
         self.input_names = self.get_input_names(node)
         self.output_names = self.get_output_names(node)
@@ -48,6 +49,7 @@ class OperatorConverter(ABC):
         self.unroll_rnn = unroll_rnn
         self.separated_rnn_gate_calc = separated_rnn_gate_calc
         self.conv_transpose_with_bias = conv_transpose_with_bias
+        self.rnn_while_loop = rnn_while_loop
 
     @abstractmethod
     def parse(self, node, attrs, args, graph_converter):
@@ -245,6 +247,120 @@ class OperatorConverter(ABC):
 
         return tensor
 
+    def rnn_while_loop_helper(
+        self,
+        graph_converter,
+        ops: typing.List[tfl.BaseOperator],
+        input_seq: tfl.Tensor,
+        states: typing.List[tfl.Tensor],
+        output: tfl.Tensor,
+        ts_axis: int,
+        reverse: bool,
+        step_func: typing.Callable,
+    ) -> typing.List[tfl.Tensor]:
+        """Lowers the timesteps of a RNN to a `WHILE` op, whose body subgraph computes a single timestep
+
+        Args:
+            graph_converter (CommonGraph): The computation graph
+            ops (typing.List[tfl.BaseOperator]): The ops in the main graph, to which the new ops will be appended
+            input_seq (tfl.Tensor): The input sequence
+            states (typing.List[tfl.Tensor]): The initial states (e.g. [h, c] for LSTMs)
+            output (tfl.Tensor): The output sequence, which is the stacked hidden states of all the timesteps
+            ts_axis (int): The axis of the timesteps
+            reverse (bool): Whether to iterate over the sequence in the reverse order
+            step_func (typing.Callable): A function that takes `(ops, input, states)` and appends the ops for a \
+                single timestep, returning the new states with the hidden state coming first
+
+        Returns:
+            typing.List[tfl.Tensor]: The final states
+        """
+
+        num_timestep = input_seq.shape[ts_axis]
+
+        def _loop_vars():
+            counter = self.create_transform_tensor(np.array(0, dtype='int32'))
+            loop_states = [self.create_transform_tensor(np.zeros_like(t.tensor)) for t in states]
+            acc = self.create_transform_tensor(np.zeros_like(output.tensor))
+            seq = self.create_transform_tensor(np.zeros_like(input_seq.tensor))
+            return [counter] + loop_states + [acc, seq]
+
+        # Condition: counter < num_timestep
+        cond_inputs = _loop_vars()
+        limit = self.create_attr_tensor(np.array(num_timestep, dtype='int32'))
+        cond_output = self.create_transform_tensor(np.array(True))
+        cond_ops = [tfl.LessOperator([cond_inputs[0], limit], [cond_output])]
+
+        # Body: computes the states of the current timestep and writes the hidden state to the output sequence
+        body_inputs = _loop_vars()
+        counter, body_states, acc, seq = body_inputs[0], body_inputs[1:-2], body_inputs[-2], body_inputs[-1]
+        body_ops = []
+
+        if reverse:
+            last_index = self.create_attr_tensor(np.array(num_timestep - 1, dtype='int32'))
+            index = self.create_transform_tensor(np.array(0, dtype='int32'))
+            body_ops.append(tfl.SubOperator([last_index, counter], [index]))
+        else:
+            index = counter
+
+        step_input = self.create_transform_tensor(np.take(seq.tensor, 0, axis=ts_axis))
+        body_ops.append(tfl.GatherOperator([seq, index], [step_input], axis=ts_axis))
+
+        new_states = step_func(body_ops, step_input, body_states)
+        assert len(new_states) == len(states)
+
+        hidden = new_states[0]
+        update = self.create_transform_tensor(np.expand_dims(hidden.tensor, ts_axis))
+        update_shape = self.create_attr_tensor(np.array(update.shape, dtype='int32'))
+        body_ops.append(tfl.ReshapeOperator([hidden, update_shape], [update], update_shape.tensor))
+
+        zero = self.create_attr_tensor(np.array(0, dtype='int32'))
+        start_items = [zero] * len(output.shape)
+        start_items[ts_axis] = index
+        start = self.create_transform_tensor(np.zeros(len(output.shape), dtype='int32'))
+        body_ops.append(tfl.PackOperator(start_items, [start], len(start_items), 0))
+
+        new_acc = self.create_transform_tensor(np.zeros_like(acc.tensor))
+        body_ops.append(tfl.DynamicUpdateSliceOperator([acc, update, start], [new_acc]))
+
+        one = self.create_attr_tensor(np.array(1, dtype='int32'))
+        new_counter = self.create_transform_tensor(np.array(0, dtype='int32'))
+        body_ops.append(tfl.AddOperator([counter, one], [new_counter]))
+
+        body_outputs = [new_counter] + list(new_states) + [new_acc, seq]
+
+        name = self.output_names[0]
+        cond_index = graph_converter.add_subgraph(f'{name}_cond', cond_ops, cond_inputs, [cond_output])
+        body_index = graph_converter.add_subgraph(f'{name}_body', body_ops, body_inputs, body_outputs)
+
+        # The initial value of the counter and the output sequence
+        init_counter = self.create_attr_tensor(np.array(0, dtype='int32'))
+        acc_shape = self.create_attr_tensor(np.array(output.shape, dtype='int32'))
+        acc_value = self.create_attr_tensor(np.array(0, dtype=output.dtype))
+        init_acc = self.create_transform_tensor(np.zeros_like(output.tensor))
+        ops.append(tfl.FillOperator([acc_shape, acc_value], [init_acc]))
+
+        # Variable tensors cannot be used as loop variables, so we use the constant version instead
+        init_states = []
+        for t in states:
+            if t.is_variable:
+                init_states.append(self.create_attr_tensor(t.tensor))
+            else:
+                init_states.append(t)
+
+        final_counter = self.create_transform_tensor(np.array(num_timestep, dtype='int32'))
+        final_states = [self.create_transform_tensor(np.zeros_like(t.tensor)) for t in states]
+        final_seq = self.create_transform_tensor(input_seq.tensor)
+        ops.append(
+            tfl.WhileOperator(
+                [init_counter] + init_states + [init_acc, input_seq],
+                [final_counter] + final_states + [output, final_seq],
+                condSubgraphIndex=cond_index,
+                bodySubgraphIndex=body_index,
+            )
+        )
+
+        return final_states
+
     def unpack_params(self, params):
         result = {}
         for method in params._method_names():
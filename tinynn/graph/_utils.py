@@ -268,6 +268,15 @@ def patch_new(base_cls, func):
     return orig_mp_funcs, orig_gm_funcs
 
 
+def get_new(base_cls):
+    """Returns the current `tp_new` function of the class, which can still be called after `patch_new`"""
+    tyobj = PyTypeObject.from_address(id(base_cls))
+    orig_mp = ctypes.cast(getattr(tyobj, "tp_new"), ctypes.c_void_p)
+
+    # Unlike `CFUNCTYPE`, the GIL is held during the call
+    return ctypes.PYFUNCTYPE(PyObject_p, PyObject_p, PyObject_p, ctypes.c_void_p)(orig_mp.value)
+
+
 def revert_new(base_cls, func):
     cls_list = [base_cls]
 
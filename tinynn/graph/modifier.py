@@ -3298,6 +3298,14 @@ class GraphChannelModifier(object):
         self.graph = graph
         self.center_nodes = center_nodes
         self.bn_compensation = bn_compensation
+
+        # The dimension analysis runs the operators on real data, so neither the activations nor the weights can be
+        # meta tensors
+        assert not any(
+            (t.is_meta for t in self.graph.module.state_dict().values())
+        ), 'GraphChannelModifier requires the real weights, please load them before pruning a model on the meta device'
+        self.graph.materialize_tensors()
+
         if self.bn_compensation:
             log.info("open bn compensation")
         self.modifiers = self.register_modifier()
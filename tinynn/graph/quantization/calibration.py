@@ -0,0 +1,566 @@
+import copy
+import os
+import queue
+import threading
+import time
+import typing
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+import torch.quantization as torch_q
+
+from torch.quantization.observer import ObserverBase
+
+from tinynn.util.train_util import AverageMeter, get_module_device
+from tinynn.util.util import get_logger
+
+log = get_logger(__name__)
+
+
+def observer_state_dict(model: nn.Module) -> typing.Dict[str, typing.Dict[str, torch.Tensor]]:
+    """Collects the states of the observers in the model
+
+    Args:
+        model (nn.Module): The PTQ-prepared model
+
+    Returns:
+        typing.Dict[str, typing.Dict[str, torch.Tensor]]: The states of the observers, keyed by the module names
+    """
+
+    states = {}
+    for name, m in model.named_modules():
+        if isinstance(m, ObserverBase):
+            # Updated in place to keep the metadata (e.g. the versions) of the state dict
+            state = m.state_dict()
+            for k, v in state.items():
+                state[k] = v.detach().cpu().clone()
+            states[name] = state
+    return states
+
+
+def load_observer_state_dict(model: nn.Module, states: typing.Dict[str, typing.Dict[str, torch.Tensor]]):
+    """Loads the states of the observers into the model
+
+    Args:
+        model (nn.Module): The PTQ-prepared model
+        states (typing.Dict[str, typing.Dict[str, torch.Tensor]]): The states of the observers, keyed by the module \
+            names
+    """
+
+    modules = dict(model.named_modules())
+    for name, state in states.items():
+        assert name in modules, f'Observer {name} is not found in the model'
+        assert isinstance(modules[name], ObserverBase), f'{name} is not an observer'
+        # Some observers (e.g. HistogramObserver) take the tensors in the state dict as their buffers
+        modules[name].load_state_dict(copy.deepcopy(state))
+
+
+def _range_keys(state: typing.Dict[str, torch.Tensor]) -> typing.Optional[typing.Tuple[str, str]]:
+    # The per-channel observers use `min_vals` and `max_vals` in the legacy versions of PyTorch
+    for min_key, max_key in (('min_val', 'max_val'), ('min_vals', 'max_vals')):
+        if min_key in state and max_key in state:
+            return min_key, max_key
+    return None
+
+
+def _is_initialized(state: typing.Dict[str, torch.Tensor], min_key: str, max_key: str) -> bool:
+    min_val, max_val = state[min_key], state[max_key]
+    return min_val.numel() > 0 and bool(torch.all(min_val <= max_val))
+
+
+def rebin_histogram(
+    histogram: torch.Tensor, min_val: float, max_val: float, new_min: float, new_max: float, bins: int
+) -> torch.Tensor:
+    """Redistributes a histogram to `bins` bins over a new range that covers the old one, assuming that the values are
+    distributed uniformly within each bin
+
+    Args:
+        histogram (torch.Tensor): The histogram
+        min_val (float): The lower bound of the histogram
+        max_val (float): The upper bound of the histogram
+        new_min (float): The lower bound of the new histogram
+        new_max (float): The upper bound of the new histogram
+        bins (int): The number of bins of the new histogram
+
+    Returns:
+        torch.Tensor: The new histogram
+    """
+
+    assert new_min <= min_val and max_val <= new_max, 'The new range should cover the old one'
+
+    hist = histogram.detach().cpu().double().numpy()
+    if new_max == new_min:
+        new_hist = np.zeros(bins)
+        new_hist[0] = hist.sum()
+    elif max_val == min_val:
+        # All the values are the same, which lie in a single bin
+        index = min(int((min_val - new_min) / (new_max - new_min) * bins), bins - 1)
+        new_hist = np.zeros(bins)
+        new_hist[index] = hist.sum()
+    else:
+        # Evaluate the piecewise-linear CDF of the old histogram at the edges of the new bins
+        old_edges = np.linspace(min_val, max_val, hist.size + 1)
+        new_edges = np.linspace(new_min, new_max, bins + 1)
+        cdf = np.concatenate([np.zeros(1), np.cumsum(hist)])
+        new_hist = np.diff(np.interp(new_edges, old_edges, cdf))
+
+    return torch.from_numpy(new_hist).to(dtype=histogram.dtype, device=histogram.device)
+
+
+def merge_observer_states(
+    model: nn.Module, states: typing.List[typing.Dict[str, typing.Dict[str, torch.Tensor]]]
+) -> typing.Dict[str, typing.Dict[str, torch.Tensor]]:
+    """Merges the observer states collected on the different shards of the calibration data
+
+    Args:
+        model (nn.Module): The PTQ-prepared model, which provides the types of the observers
+        states (typing.List[typing.Dict[str, typing.Dict[str, torch.Tensor]]]): The observer states of the workers, \
+            which are the results of `observer_state_dict`
+
+    Returns:
+        typing.Dict[str, typing.Dict[str, torch.Tensor]]: The merged observer states, which can be loaded with \
+            `load_observer_state_dict`
+    """
+
+    assert len(states) > 0, 'At least one observer state dict is required'
+
+    modules = dict(model.named_modules())
+    merged = {}
+    for name in states[0]:
+        assert all(name in s for s in states), f'Observer {name} is missing in some of the states'
+
+        observer = modules.get(name, None)
+        observer_states = [s[name] for s in states]
+        state = copy.deepcopy(observer_states[0])
+        merged[name] = state
+
+        keys = _range_keys(state)
+        if keys is None:
+            log.warning(f'Don\'t know how to merge the states of {type(observer).__name__}, using the first one')
+            continue
+
+        min_key, max_key = keys
+        observer_states = [s for s in observer_states if _is_initialized(s, min_key, max_key)]
+        if len(observer_states) == 0:
+            continue
+
+        min_vals = torch.stack([s[min_key] for s in observer_states])
+        max_vals = torch.stack([s[max_key] for s in observer_states])
+
+        if isinstance(observer, (torch_q.MovingAverageMinMaxObserver, torch_q.MovingAveragePerChannelMinMaxObserver)):
+            # The moving averages cannot be merged exactly, so the average of them is used instead
+            state[min_key] = min_vals.mean(0)
+            state[max_key] = max_vals.mean(0)
+        else:
+            state[min_key] = min_vals.min(0)[0]
+            state[max_key] = max_vals.max(0)[0]
+
+        if 'histogram' in state:
+            new_min, new_max = state[min_key].item(), state[max_key].item()
+            histogram = torch.zeros_like(state['histogram'])
+            for s in observer_states:
+                histogram += rebin_histogram(
+                    s['histogram'], s[min_key].item(), s[max_key].item(), new_min, new_max, histogram.numel()
+                )
+            state['histogram'] = histogram
+
+    return merged
+
+
+def sync_observer_states(model: nn.Module, group=None) -> typing.Dict[str, typing.Dict[str, torch.Tensor]]:
+    """Gathers the observer states from all the processes in the group, merges them and loads the result into the
+    model of every process. With the `gloo` backend, the calibration data can be sharded across CPU workers, e.g.
+
+        dist.init_process_group('gloo', rank=rank, world_size=world_size)
+        quantizer.calibrate(ptq_model, shard_of_data)
+        sync_observer_states(ptq_model)
+
+    Args:
+        model (nn.Module): The PTQ-prepared model
+        group (optional): The process group. Defaults to None, in which case the default group is used.
+
+    Returns:
+        typing.Dict[str, typing.Dict[str, torch.Tensor]]: The merged observer states
+    """
+
+    assert dist.is_available() and dist.is_initialized(), 'The default process group is not initialized'
+    assert hasattr(dist, 'all_gather_object'), 'sync_observer_states requires PyTorch 1.8.0+'
+
+    states = observer_state_dict(model)
+    gathered = [None] * dist.get_world_size(group)
+    dist.all_gather_object(gathered, states, group=group)
+
+    merged = merge_observer_states(model, gathered)
+    load_observer_state_dict(model, merged)
+    return merged
+
+
+def observer_ranges(model: nn.Module) -> typing.Dict[str, typing.Tuple[torch.Tensor, torch.Tensor]]:
+    """Collects the ranges (min_val, max_val) of the observers in the model
+
+    Args:
+        model (nn.Module): The PTQ-prepared model
+
+    Returns:
+        typing.Dict[str, typing.Tuple[torch.Tensor, torch.Tensor]]: The ranges of the observers
+    """
+
+    ranges = {}
+    for name, m in model.named_modules():
+        if isinstance(m, ObserverBase):
+            min_val = getattr(m, 'min_val', None)
+            max_val = getattr(m, 'max_val', None)
+            if isinstance(min_val, torch.Tensor) and isinstance(max_val, torch.Tensor):
+                ranges[name] = (min_val.detach().clone(), max_val.detach().clone())
+    return ranges
+
+
+def max_range_change(
+    old_ranges: typing.Dict[str, typing.Tuple[torch.Tensor, torch.Tensor]],
+    new_ranges: typing.Dict[str, typing.Tuple[torch.Tensor, torch.Tensor]],
+) -> float:
+    """Computes the maximum change of the observer ranges, relative to the width of the old ranges
+
+    Args:
+        old_ranges (typing.Dict[str, typing.Tuple[torch.Tensor, torch.Tensor]]): The ranges before the update
+        new_ranges (typing.Dict[str, typing.Tuple[torch.Tensor, torch.Tensor]]): The ranges after the update
+
+    Returns:
+        float: The maximum relative change, which is `inf` if some of the ranges are not initialized
+    """
+
+    max_change = 0.0
+    for name, (new_min, new_max) in new_ranges.items():
+        if name not in old_ranges:
+            return float('inf')
+
+        old_min, old_max = old_ranges[name]
+        if old_min.shape != new_min.shape or old_min.numel() == 0:
+            return float('inf')
+
+        width = (old_max - old_min).abs().clamp(min=1e-12)
+        change = torch.max((new_min - old_min).abs(), (new_max - old_max).abs()) / width
+        change = change.max().item()
+        if change != change:
+            return float('inf')
+
+        max_change = max(max_change, change)
+    return max_change
+
+
+def move_to_device(data, device: torch.device, non_blocking: bool = False, pin_memory: bool = False):
+    """Moves the tensors in (nested) lists, tuples and dicts to the device
+
+    Args:
+        data: The data to be moved
+        device (torch.device): The target device
+        non_blocking (bool, optional): Whether to copy asynchronously. Defaults to False.
+        pin_memory (bool, optional): Whether to pin the CPU tensors before copying. Defaults to False.
+
+    Returns:
+        The data on the target device
+    """
+
+    if isinstance(data, torch.Tensor):
+        if pin_memory and data.device.type == 'cpu':
+            data = data.pin_memory()
+        return data.to(device=device, non_blocking=non_blocking)
+    elif isinstance(data, (list, tuple)):
+        return type(data)(move_to_device(x, device, non_blocking, pin_memory) for x in data)
+    elif isinstance(data, dict):
+        return {k: move_to_device(v, device, non_blocking, pin_memory) for k, v in data.items()}
+    else:
+        return data
+
+
+class Prefetcher(object):
+    """Loads the batches in a background thread and moves them to the target device ahead of time"""
+
+    _END = object()
+
+    def __init__(
+        self,
+        data: typing.Iterable,
+        device: typing.Optional[torch.device] = None,
+        num_prefetch: int = 2,
+        pin_memory: typing.Optional[bool] = None,
+        skip: int = 0,
+    ):
+        """Constructs a new Prefetcher object
+
+        Args:
+            data (typing.Iterable): An iterable of batches, e.g. a DataLoader
+            device (typing.Optional[torch.device], optional): The target device. Defaults to None, in which case \
+                the batches are not moved.
+            num_prefetch (int, optional): The maximum number of batches loaded ahead. Defaults to 2.
+            pin_memory (typing.Optional[bool], optional): Whether to pin the batches before copying. Defaults to \
+                None, in which case it is enabled for CUDA devices.
+            skip (int, optional): The number of leading batches to skip. Defaults to 0.
+        """
+
+        assert num_prefetch > 0, 'num_prefetch should be a positive integer'
+
+        if device is not None:
+            device = torch.device(device)
+        if pin_memory is None:
+            pin_memory = device is not None and device.type == 'cuda'
+
+        self.data = data
+        self.device = device
+        self.pin_memory = pin_memory
+        self.skip = skip
+        self.queue = queue.Queue(maxsize=num_prefetch)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __iter__(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+        try:
+            while True:
+                item, error = self.queue.get()
+                if error is not None:
+                    raise error
+                if item is self._END:
+                    break
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops the background thread"""
+
+        self.stop_event.set()
+        if self.thread is not None:
+            # Unblock the worker if it is waiting for a free slot
+            while self.thread.is_alive():
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    self.thread.join(0.01)
+            self.thread = None
+
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def _put(self, item, error=None) -> bool:
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _worker(self):
+        stream = None
+        if self.device is not None and self.device.type == 'cuda':
+            stream = torch.cuda.Stream(device=self.device)
+
+        try:
+            for i, batch in enumerate(self.data):
+                if self.stop_event.is_set():
+                    return
+
+                if i < self.skip:
+                    continue
+
+                if self.device is not None:
+                    if stream is not None:
+                        with torch.cuda.stream(stream):
+                            batch = move_to_device(batch, self.device, True, self.pin_memory)
+                        stream.synchronize()
+                    else:
+                        batch = move_to_device(batch, self.device, False, self.pin_memory)
+
+                if not self._put(batch):
+                    return
+
+            self._put(self._END)
+        except BaseException as e:
+            self._put(None, e)
+
+
+def default_input_func(batch) -> typing.Tuple:
+    """Gets the model inputs from a batch. For lists and tuples (e.g. `(image, label)`), the first item is used."""
+
+    if isinstance(batch, (list, tuple)):
+        return (batch[0],)
+    return (batch,)
+
+
+class Calibrator(object):
+    max_batches: typing.Optional[int]
+    device: typing.Optional[torch.device]
+    num_prefetch: int
+    pin_memory: typing.Optional[bool]
+    tolerance: typing.Optional[float]
+    patience: int
+    checkpoint_path: typing.Optional[str]
+    checkpoint_interval: int
+    resume: bool
+    input_func: typing.Callable[[typing.Any], typing.Tuple]
+    log_interval: int
+
+    def __init__(
+        self,
+        max_batches: typing.Optional[int] = None,
+        device: typing.Optional[torch.device] = None,
+        num_prefetch: int = 2,
+        pin_memory: typing.Optional[bool] = None,
+        tolerance: typing.Optional[float] = None,
+        patience: int = 5,
+        checkpoint_path: typing.Optional[str] = None,
+        checkpoint_interval: int = 100,
+        resume: bool = True,
+        input_func: typing.Optional[typing.Callable[[typing.Any], typing.Tuple]] = None,
+        log_interval: int = 10,
+    ):
+        """Constructs a new Calibrator object, which feeds batches to a PTQ-prepared model to collect the statistics
+        of the observers
+
+        Args:
+            max_batches (typing.Optional[int], optional): The maximum number of batches. Defaults to None (no limit).
+            device (typing.Optional[torch.device], optional): The device of the batches. Defaults to None, in which \
+                case the device of the model is used.
+            num_prefetch (int, optional): The number of batches loaded ahead in the background. Defaults to 2.
+            pin_memory (typing.Optional[bool], optional): Whether to pin the batches before copying. Defaults to \
+                None, in which case it is enabled for CUDA devices.
+            tolerance (typing.Optional[float], optional): Stops early when the ranges of all the observers change \
+                less than `tolerance` (relative to their widths) for `patience` consecutive batches. Defaults to None \
+                (no early stopping).
+            patience (int, optional): The number of consecutive stable batches for early stopping. Defaults to 5.
+            checkpoint_path (typing.Optional[str], optional): The path of the checkpoint file of the observer states. \
+                Defaults to None (no checkpointing).
+            checkpoint_interval (int, optional): The number of batches between checkpoints. Defaults to 100.
+            resume (bool, optional): Whether to resume from the checkpoint if it exists. The batches that have been \
+                calibrated are skipped, so the order of the batches should be deterministic. Defaults to True.
+            input_func (typing.Optional[typing.Callable[[typing.Any], typing.Tuple]], optional): Gets the model \
+                inputs from a batch. Defaults to None, in which case `default_input_func` is used.
+            log_interval (int, optional): The number of batches between progress logs. Defaults to 10.
+        """
+
+        assert patience > 0, 'patience should be a positive integer'
+        assert checkpoint_interval > 0, 'checkpoint_interval should be a positive integer'
+
+        self.max_batches = max_batches
+        self.device = device
+        self.num_prefetch = num_prefetch
+        self.pin_memory = pin_memory
+        self.tolerance = tolerance
+        self.patience = patience
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.resume = resume
+        self.input_func = default_input_func if input_func is None else input_func
+        self.log_interval = log_interval
+
+    def save_checkpoint(self, model: nn.Module, num_batches: int, stable_batches: int):
+        """Saves the observer states to the checkpoint file atomically"""
+
+        state = {
+            'num_batches': num_batches,
+            'stable_batches': stable_batches,
+            'observers': observer_state_dict(model),
+        }
+
+        dirname = os.path.dirname(self.checkpoint_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def load_checkpoint(self, model: nn.Module) -> typing.Tuple[int, int]:
+        """Loads the observer states from the checkpoint file
+
+        Returns:
+            typing.Tuple[int, int]: The number of calibrated batches and the number of consecutive stable batches
+        """
+
+        state = torch.load(self.checkpoint_path, map_location='cpu')
+        load_observer_state_dict(model, state['observers'])
+        return state['num_batches'], state['stable_batches']
+
+    def calibrate(self, model: nn.Module, data: typing.Iterable) -> int:
+        """Calibrates the PTQ-prepared model
+
+        Args:
+            model (nn.Module): The PTQ-prepared model
+            data (typing.Iterable): An iterable of batches, e.g. a DataLoader
+
+        Returns:
+            int: The number of batches that the model is calibrated with
+        """
+
+        num_batches = 0
+        stable_batches = 0
+        if self.checkpoint_path is not None and self.resume and os.path.exists(self.checkpoint_path):
+            num_batches, stable_batches = self.load_checkpoint(model)
+            log.info(f'Resumed calibration from {self.checkpoint_path} after {num_batches} batches')
+
+        device = self.device
+        if device is None:
+            device = get_module_device(model)
+
+        converged = self.tolerance is not None and stable_batches >= self.patience
+        if converged or (self.max_batches is not None and num_batches >= self.max_batches):
+            return num_batches
+
+        ranges = observer_ranges(model) if self.tolerance is not None else None
+        last_checkpoint = num_batches
+        total = len(data) if hasattr(data, '__len__') else None
+        if self.max_batches is not None:
+            total = self.max_batches if total is None else min(total, self.max_batches)
+
+        avg_batch_time = AverageMeter()
+        prefetcher = Prefetcher(data, device, self.num_prefetch, self.pin_memory, num_batches)
+
+        with torch.no_grad():
+            end = time.time()
+            try:
+                for batch in prefetcher:
+                    model(*self.input_func(batch))
+                    num_batches += 1
+
+                    avg_batch_time.update(time.time() - end)
+                    end = time.time()
+
+                    if self.log_interval > 0 and num_batches % self.log_interval == 0:
+                        log.info(f'Calibrate: [{num_batches}/{total}]\tTime {avg_batch_time.avg:.5f}')
+
+                    if self.tolerance is not None:
+                        new_ranges = observer_ranges(model)
+                        if max_range_change(ranges, new_ranges) < self.tolerance:
+                            stable_batches += 1
+                        else:
+                            stable_batches = 0
+                        ranges = new_ranges
+
+                        converged = stable_batches >= self.patience
+
+                    done = converged or (self.max_batches is not None and num_batches >= self.max_batches)
+
+                    if self.checkpoint_path is not None and (
+                        done or num_batches - last_checkpoint >= self.checkpoint_interval
+                    ):
+                        self.save_checkpoint(model, num_batches, stable_batches)
+                        last_checkpoint = num_batches
+
+                    if converged:
+                        log.info(f'Observer ranges converged after {num_batches} batches, stopping calibration')
+
+                    if done:
+                        break
+            finally:
+                prefetcher.close()
+
+        if self.checkpoint_path is not None and last_checkpoint != num_batches:
+            self.save_checkpoint(model, num_batches, stable_batches)
+
+        return num_batches
@@ -1,7 +1,17 @@
+import sys
+from distutils.version import LooseVersion
+
 import torch
 from torch.nn import Module
 from torch.quantization.observer import _with_args
 
+try:
+    from torch._dynamo import is_compiling as _is_compiling
+except ImportError:
+
+    def _is_compiling():
+        return False
+
 
 class FakeQuantizeBFloat16(Module):
     """Simulate the quantize and dequantize operations in training time for bfloat16"""
@@ -28,8 +38,275 @@ class FakeQuantizeBFloat16(Module):
     with_args = classmethod(_with_args)
 
 
-class FakeQuantizeTFLite(torch.quantization.FakeQuantize):
+def _get_aten_op(name):
+    try:
+        return getattr(torch.ops.aten, name)
+    except (AttributeError, RuntimeError):
+        return None
+
+
+_fake_quantize_per_tensor_cachemask = getattr(torch, '_fake_quantize_per_tensor_affine_cachemask_tensor_qparams', None)
+_fake_quantize_per_channel_cachemask = _get_aten_op('fake_quantize_per_channel_affine_cachemask')
+
+
+def _tflite_rounding_nudge(X, scale, ch_axis):
+    """The offset that rounds the halfway values away from zero (as TFLite does) in `torch.fake_quantize_*`"""
+
+    if ch_axis is not None:
+        shape = [1] * X.dim()
+        shape[ch_axis] = -1
+        scale = scale.reshape(shape)
+
+    nudge = torch.sign(X.detach())
+    nudge.mul_(scale * 1e-6)
+    return nudge
+
+
+def _fake_quantize_per_tensor(X, scale, zero_point, fake_quant_enabled, quant_min, quant_max):
+    """Per-tensor fake quantization that is skipped when `fake_quant_enabled` is zero, without Python branches"""
+
+    if not _is_compiling():
+        Y, _ = _fake_quantize_per_tensor_cachemask(X, scale, zero_point, fake_quant_enabled, quant_min, quant_max)
+        return Y
+
+    # The fused kernel cannot run with fake tensors, so it is decomposed into the same computation when compiled
+    X_detached = X.detach()
+    X_q = torch.round(X_detached * (1.0 / scale)) + zero_point
+    Y = (torch.clamp(X_q, quant_min, quant_max) - zero_point) * scale
+
+    enabled = fake_quant_enabled[0] == 1
+    Y = torch.where(enabled, Y, X_detached)
+    mask = ((X_q >= quant_min) & (X_q <= quant_max)) | ~enabled
+
+    # Straight-through estimator
+    return Y + (X - X_detached) * mask
+
+
+_BRANCHLESS_OBSERVERS = (
+    torch.quantization.MinMaxObserver,
+    torch.quantization.MovingAverageMinMaxObserver,
+    torch.quantization.PerChannelMinMaxObserver,
+    torch.quantization.MovingAveragePerChannelMinMaxObserver,
+)
+_MOVING_AVERAGE_OBSERVERS = (
+    torch.quantization.MovingAverageMinMaxObserver,
+    torch.quantization.MovingAveragePerChannelMinMaxObserver,
+)
+
+_has_branchless_ops = LooseVersion(torch.__version__) >= '2.0.0' and _fake_quantize_per_tensor_cachemask is not None
+
+
+class FakeQuantize(torch.quantization.FakeQuantize):
+    """`torch.quantization.FakeQuantize` without data-dependent Python control flow in `forward`.
+
+    The observer and fake-quant flags are applied with tensor ops and the min/max observers are updated inline,
+    so that `torch.compile` can capture the whole training step in one graph. The results are identical to the ones
+    of `torch.quantization.FakeQuantize`. Other observers use the implementation in PyTorch.
+    """
+
+    def forward(self, X):
+        if not self._is_branchless() or X.numel() == 0:
+            return super().forward(X)
+
+        self._update_qparams(X)
+        return self._fake_quantize(X)
+
+    def calculate_qparams(self):
+        if not self._is_branchless():
+            return super().calculate_qparams()
+
+        observer = self.activation_post_process
+        return self._calculate_qparams(observer.min_val, observer.max_val)
+
+    def _is_branchless(self):
+        observer = self.activation_post_process
+        return (
+            _has_branchless_ops
+            and not torch.jit.is_tracing()
+            and type(observer) in _BRANCHLESS_OBSERVERS
+            and observer.qscheme != torch.per_channel_affine_float_qparams
+            and observer.min_val.numel() > 0
+            and (not self.is_per_channel or self.scale.shape == observer.min_val.shape)
+        )
+
+    def _calculate_qparams(self, min_val, max_val):
+        """Same as `UniformQuantizationObserverBase._calculate_qparams`, except that the default qparams for the
+        uninitialized observers are selected with `torch.where`"""
+
+        observer = self.activation_post_process
+        quant_min, quant_max = observer.quant_min, observer.quant_max
+        min_val_neg = torch.min(min_val, torch.zeros_like(min_val))
+        max_val_pos = torch.max(max_val, torch.zeros_like(max_val))
+
+        if observer.qscheme in (torch.per_tensor_symmetric, torch.per_channel_symmetric):
+            max_val_pos = torch.max(-min_val_neg, max_val_pos)
+            scale = max_val_pos / (float(quant_max - quant_min) / 2)
+            scale = torch.max(scale, observer.eps)
+            zero_point_value = 0
+            if observer.dtype == torch.quint8:
+                if observer.has_customized_qrange:
+                    zero_point_value = (quant_min + quant_max) // 2
+                else:
+                    zero_point_value = 128
+            zero_point = torch.full_like(scale, zero_point_value, dtype=torch.int64)
+        else:
+            scale = (max_val_pos - min_val_neg) / float(quant_max - quant_min)
+            scale = torch.max(scale, observer.eps)
+            zero_point = quant_min - torch.round(min_val_neg / scale).to(torch.int)
+            zero_point = torch.clamp(zero_point, quant_min, quant_max)
+
+        initialized = (min_val != float('inf')) | (max_val != float('-inf'))
+        scale = torch.where(initialized, scale, torch.ones_like(scale))
+        zero_point = torch.where(initialized, zero_point, torch.zeros_like(zero_point))
+
+        if min_val.dim() == 0:
+            scale = scale.reshape(1)
+            zero_point = zero_point.reshape(1)
+
+        return scale, zero_point
+
+    def _update_qparams(self, X):
+        observer = self.activation_post_process
+        x = X.detach().to(observer.min_val.dtype)
+
+        if self.is_per_channel:
+            new_axis_list = list(range(x.dim()))
+            new_axis_list[observer.ch_axis] = 0
+            new_axis_list[0] = observer.ch_axis
+            y = torch.flatten(x.permute(new_axis_list), start_dim=1)
+            min_val_cur, max_val_cur = torch.aminmax(y, dim=1)
+        else:
+            min_val_cur, max_val_cur = torch.aminmax(x)
+
+        min_val, max_val = observer.min_val, observer.max_val
+        if type(observer) in _MOVING_AVERAGE_OBSERVERS:
+            # The statistics of the uninitialized observers are replaced with the current ones before averaging, so
+            # that no NaNs are produced in `inf - inf`
+            averaging_constant = observer.averaging_constant
+            last_min_val = torch.where(min_val == float('inf'), min_val_cur, min_val)
+            last_max_val = torch.where(max_val == float('-inf'), max_val_cur, max_val)
+            new_min_val = last_min_val + averaging_constant * (min_val_cur - last_min_val)
+            new_max_val = last_max_val + averaging_constant * (max_val_cur - last_max_val)
+        else:
+            new_min_val = torch.min(min_val_cur, min_val)
+            new_max_val = torch.max(max_val_cur, max_val)
+
+        observer_enabled = self.observer_enabled[0] == 1
+        new_min_val = torch.where(observer_enabled, new_min_val, min_val)
+        new_max_val = torch.where(observer_enabled, new_max_val, max_val)
+        scale, zero_point = self._calculate_qparams(new_min_val, new_max_val)
+        scale = torch.where(observer_enabled, scale, self.scale)
+        zero_point = torch.where(observer_enabled, zero_point, self.zero_point)
+
+        min_val.copy_(new_min_val)
+        max_val.copy_(new_max_val)
+        self.scale.copy_(scale)
+        self.zero_point.copy_(zero_point)
+
+    def _fake_quantize(self, X):
+        quant_min = self.activation_post_process.quant_min
+        quant_max = self.activation_post_process.quant_max
+
+        if self.is_per_channel:
+            Y = torch.fake_quantize_per_channel_affine(
+                X, self.scale, self.zero_point, self.ch_axis, quant_min, quant_max
+            )
+            return torch.where(self.fake_quant_enabled[0] == 1, Y, X)
+
+        return _fake_quantize_per_tensor(X, self.scale, self.zero_point, self.fake_quant_enabled, quant_min, quant_max)
+
+
+if hasattr(torch.quantization, 'FixedQParamsFakeQuantize'):
+
+    class FixedQParamsFakeQuantize(torch.quantization.FixedQParamsFakeQuantize):
+        """`torch.quantization.FixedQParamsFakeQuantize` without data-dependent Python control flow in `forward`"""
+
+        def forward(self, X):
+            if not _has_branchless_ops or torch.jit.is_tracing():
+                return super().forward(X)
+
+            return _fake_quantize_per_tensor(
+                X,
+                self.scale,
+                self.zero_point,
+                self.fake_quant_enabled,
+                self.activation_post_process.quant_min,
+                self.activation_post_process.quant_max,
+            )
+
+else:
+    FixedQParamsFakeQuantize = None
+
+
+class FakeQuantizeTFLiteFunction(torch.autograd.Function):
+    """Fake quantization with the TFLite rounding mode in one pass, which computes the rounding nudge and the
+    straight-through mask in place instead of recording them in the autograd graph"""
+
+    @staticmethod
+    def forward(ctx, X, scale, zero_point, quant_min, quant_max, ch_axis, fake_quant_enabled):
+        X_nudged = _tflite_rounding_nudge(X, scale, ch_axis)
+        X_nudged.mul_(fake_quant_enabled)
+        X_nudged.add_(X)
+
+        if ch_axis is not None:
+            Y, mask = _fake_quantize_per_channel_cachemask(X_nudged, scale, zero_point, ch_axis, quant_min, quant_max)
+            disabled = fake_quant_enabled[0] != 1
+            Y = torch.where(disabled, X_nudged, Y)
+            mask.logical_or_(disabled)
+        else:
+            Y, mask = _fake_quantize_per_tensor_cachemask(
+                X_nudged, scale, zero_point, fake_quant_enabled, quant_min, quant_max
+            )
+
+        ctx.save_for_backward(mask)
+        return Y
+
+    @staticmethod
+    def backward(ctx, grad_Y):
+        (mask,) = ctx.saved_tensors
+        return grad_Y * mask, None, None, None, None, None, None
+
+
+class FakeQuantizeTFLite(FakeQuantize):
     def forward(self, X):
+        if (
+            _fake_quantize_per_tensor_cachemask is None
+            or _fake_quantize_per_channel_cachemask is None
+            or torch.jit.is_tracing()
+            or X.numel() == 0
+        ):
+            return self._forward_unfused(X)
+
+        if self._is_branchless():
+            self._update_qparams(X)
+        elif self.observer_enabled[0] == 1:
+            self.activation_post_process(X.detach())
+            _scale, _zero_point = self.calculate_qparams()
+            _scale, _zero_point = _scale.to(self.scale.device), _zero_point.to(self.zero_point.device)
+            if self.scale.shape != _scale.shape:
+                self.scale.resize_(_scale.shape)
+                self.zero_point.resize_(_zero_point.shape)
+            self.scale.copy_(_scale)
+            self.zero_point.copy_(_zero_point)
+
+        ch_axis = self.ch_axis if self.is_per_channel else None
+
+        # Dynamo cannot trace through custom autograd functions yet, so the nudge is applied with regular ops
+        if _is_compiling():
+            nudge = _tflite_rounding_nudge(X, self.scale, ch_axis) * self.fake_quant_enabled
+            return self._fake_quantize(X + nudge)
+
+        return FakeQuantizeTFLiteFunction.apply(
+            X,
+            self.scale,
+            self.zero_point,
+            self.activation_post_process.quant_min,
+            self.activation_post_process.quant_max,
+            ch_axis,
+            self.fake_quant_enabled,
+        )
+
+    def _forward_unfused(self, X):
         observer_enabled = self.observer_enabled[0] == 1
         fake_quant_enabled = self.fake_quant_enabled[0] == 1
 
@@ -37,7 +314,7 @@ class FakeQuantizeTFLite(torch.quantization.FakeQuantize):
             if fake_quant_enabled:
                 torch.quantization.disable_fake_quant(self)
 
-            X = super().forward(X)
+            X = torch.quantization.FakeQuantize.forward(self, X)
 
             if fake_quant_enabled:
                 torch.quantization.enable_fake_quant(self)
@@ -46,8 +323,9 @@ class FakeQuantizeTFLite(torch.quantization.FakeQuantize):
             if observer_enabled:
                 torch.quantization.disable_observer(self)
 
-            X = X + self.scale * 1e-6 * torch.sign(X.detach())
-            X = super().forward(X)
+            ch_axis = self.ch_axis if self.is_per_channel else None
+            X = X + _tflite_rounding_nudge(X, self.scale, ch_axis)
+            X = torch.quantization.FakeQuantize.forward(self, X)
 
             if observer_enabled:
                 torch.quantization.enable_observer(self)
@@ -55,6 +333,81 @@ class FakeQuantizeTFLite(torch.quantization.FakeQuantize):
         return X
 
 
+def _observer_forward_hook(self, input, output):
+    """The same as the forward hook of the observers in PyTorch, which is skipped by `torch.compile`"""
+
+    return self.activation_post_process(output)
+
+
+def _observer_forward_pre_hook(self, input):
+    """The same as the forward pre-hook of the observers in PyTorch, which is skipped by `torch.compile`"""
+
+    return self.activation_post_process(input[0])
+
+
+def _torch_observer_hooks():
+    quantize = sys.modules.get('torch.ao.quantization.quantize')
+    if quantize is None:
+        return {}
+
+    return {
+        quantize._observer_forward_hook: _observer_forward_hook,
+        quantize._observer_forward_pre_hook: _observer_forward_pre_hook,
+    }
+
+
+def _replace_hooks(model: Module, hook_mapping):
+    for m in model.modules():
+        for hooks in (m._forward_hooks, m._forward_pre_hooks):
+            for handle_id, hook in list(hooks.items()):
+                if hook in hook_mapping:
+                    hooks[handle_id] = hook_mapping[hook]
+
+
+def prepare_branchless_fake_quantize(model: Module):
+    """Prepares the fake-quantize modules of a QAT model for the branchless forward pass of `FakeQuantize`.
+
+    The per-channel observer statistics of the weight fake-quantize modules are allocated (as uninitialized) in
+    advance, so that their shapes stay the same during training. The fixed-qparams fake-quantize modules inserted
+    by PyTorch are switched to `FixedQParamsFakeQuantize`. The observer hooks of PyTorch are replaced with the ones
+    that can be traced by `torch.compile`. Use `restore_observer_hooks` to revert them before `convert`.
+
+    Args:
+        model (Module): The QAT model
+    """
+
+    if not _has_branchless_ops:
+        return
+
+    _replace_hooks(model, _torch_observer_hooks())
+
+    for m in model.modules():
+        if type(m) is torch.quantization.FixedQParamsFakeQuantize:
+            m.__class__ = FixedQParamsFakeQuantize
+
+        weight = getattr(m, 'weight', None)
+        fake_quant = getattr(m, 'weight_fake_quant', None)
+        if isinstance(fake_quant, FakeQuantize) and fake_quant.is_per_channel and isinstance(weight, torch.Tensor):
+            observer = fake_quant.activation_post_process
+            if type(observer) in _BRANCHLESS_OBSERVERS and observer.min_val.numel() == 0:
+                num_channels = weight.size(fake_quant.ch_axis)
+                observer.min_val.resize_(num_channels).fill_(float('inf'))
+                observer.max_val.resize_(num_channels).fill_(float('-inf'))
+                fake_quant.scale.resize_(num_channels).fill_(1.0)
+                fake_quant.zero_point.resize_(num_channels).fill_(0)
+
+
+def restore_observer_hooks(model: Module):
+    """Restores the observer hooks of PyTorch replaced in `prepare_branchless_fake_quantize`, which are removed by
+    `torch.quantization.convert`
+
+    Args:
+        model (Module): The QAT model
+    """
+
+    _replace_hooks(model, {v: k for k, v in _torch_observer_hooks().items()})
+
+
 def disable_fake_quant(mod):
     """
     Disable fake quantization for this module, if applicable. Example usage::
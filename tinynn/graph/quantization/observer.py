@@ -1,12 +1,18 @@
-import copy
-
+import os
+import typing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Tuple
 
 import numpy as np
 import torch
+import torch.nn as nn
 import torch.nn.functional as F
 import torch.quantization as torch_q
 
+from tinynn.util.util import get_logger
+
+log = get_logger(__name__)
+
 
 class MinMaxObserver(torch_q.MinMaxObserver):
     def __init__(self, *args, **kwargs) -> None:
@@ -36,6 +42,15 @@ class MovingAveragePerChannelMinMaxObserver(torch_q.MovingAveragePerChannelMinMa
         self.quant_max = 127
 
 
+def _xlogx(x: np.ndarray) -> np.ndarray:
+    """Calculates `x * log(x)` in the precision of `x` like `F.kl_div`, where `0 * log(0) = 0`"""
+    t = torch.from_numpy(np.ascontiguousarray(x))
+    if hasattr(torch, 'xlogy'):
+        return torch.xlogy(t, t).numpy()
+    else:
+        return torch.where(t > 0, t * t.log(), torch.zeros_like(t)).numpy()
+
+
 class HistogramObserverKL(torch_q.HistogramObserver):
     def _compute_threshold(self, distribution: np.ndarray, m_bin_number=2048) -> int:
         """Compute the quantization error using Kullback-Leibler divergence.
@@ -48,84 +63,105 @@ class HistogramObserverKL(torch_q.HistogramObserver):
         Returns:
             threshold: int, the best threshold with the minimum KL.
         """
-        m_bin_number = m_bin_number + 1
         target_bin_numbers = 128
-        threshold = target_bin_numbers
-        min_kl_divergence = float('inf')
+        thresholds = np.arange(target_bin_numbers, m_bin_number + 1)
+        if thresholds.size == 0:
+            return target_bin_numbers
 
-        after_threshold_sum = np.sum(distribution[target_bin_numbers:])
+        # All the candidate thresholds are evaluated at once. The values of the expanded distributions are the same as
+        # merging and expanding the bins for each threshold, while the KL divergences are calculated with prefix sums
+        # over the bins.
+        dist = np.append(distribution, np.zeros(1, dtype=distribution.dtype))
         cumsum_dist = np.zeros(distribution.size + 1, dtype=distribution.dtype)
         np.cumsum(distribution, out=cumsum_dist[1:])
         cumsum_nozeros = np.zeros(distribution.size + 1, dtype=distribution.dtype)
         np.cumsum(distribution != 0, out=cumsum_nozeros[1:])
-        is_nonzero_distribution = distribution != 0
-        is_nonzero_distribution = np.append(is_nonzero_distribution, False)
-
-        for i in range(target_bin_numbers, m_bin_number):
-            quantize_dis = np.zeros(target_bin_numbers)
-            expanded_dis = np.zeros(i)
-            candidate_dis = copy.deepcopy(distribution)[:i]
-            candidate_dis[i - 1] = candidate_dis[i - 1] + after_threshold_sum
-            if i != m_bin_number - 1:
-                after_threshold_sum -= distribution[i]
-            else:
-                after_threshold_sum = np.zeros(1)
-
-            bin_interval = i / target_bin_numbers
-
-            # merge i bins to target bins
-            j_ = np.arange(target_bin_numbers)
-            start_ = j_ * bin_interval
-            end_ = start_ + bin_interval
-
-            left_upper_ = np.ceil(start_).astype('int32')
-            right_lower_ = np.floor(end_).astype('int32')
-
-            left_flag = left_upper_ > start_
-            right_flag = right_lower_ < end_
-
-            left_scale_ = left_upper_ - start_
-            right_scale_ = end_ - right_lower_
-
-            quantize_dis[left_flag] += left_scale_[left_flag] * distribution[left_upper_[left_flag] - 1]
-            quantize_dis[right_flag] += right_scale_[right_flag] * distribution[right_lower_[right_flag]]
-            quantize_dis += cumsum_dist[right_lower_] - cumsum_dist[left_upper_]
-
-            # expand target bins to i bins
-            count_ = np.zeros(target_bin_numbers)
-            count_[left_flag] += left_scale_[left_flag] * is_nonzero_distribution[left_upper_[left_flag] - 1]
-            count_[right_flag] += right_scale_[right_flag] * is_nonzero_distribution[right_lower_[right_flag]]
-            count_ += cumsum_nozeros[right_lower_] - cumsum_nozeros[left_upper_]
-
-            to_expand_value_ = np.zeros(target_bin_numbers)
-            count_flag = count_ != 0
-            to_expand_value_[count_flag] = quantize_dis[count_flag] / count_[count_flag]
-            left_expand_flag = np.logical_and(count_flag, left_flag, is_nonzero_distribution[left_upper_ - 1])
-            expanded_dis[left_upper_[left_expand_flag] - 1] += (
-                to_expand_value_[left_expand_flag] * left_scale_[left_expand_flag]
-            )
-            right_expand_flag = np.logical_and(count_flag, right_flag, is_nonzero_distribution[right_lower_])
-            expanded_dis[right_lower_[right_expand_flag]] += (
-                to_expand_value_[right_expand_flag] * right_scale_[right_expand_flag]
-            )
+        is_nonzero_distribution = np.append(distribution != 0, False)
+
+        dist_64 = distribution.astype('float64')
+        cumsum_dist_64 = np.zeros(distribution.size + 1)
+        np.cumsum(dist_64, out=cumsum_dist_64[1:])
+        cumsum_zeros = np.zeros(distribution.size + 1, dtype='int64')
+        np.cumsum(distribution == 0, out=cumsum_zeros[1:])
+
+        cumsum_xlogx = np.zeros(distribution.size + 1)
+        np.cumsum(_xlogx(distribution), out=cumsum_xlogx[1:])
+
+        # The empty bins that are not expanded to lead to NaN in the newer versions of PyTorch, while the bins that are
+        # not positive are ignored in the older ones
+        empty_bin_is_nan = torch.isnan(
+            F.kl_div(torch.tensor([float('-inf')], dtype=torch.float64), torch.zeros(1), reduction='sum')
+        ).item()
 
-            k = np.floor(bin_interval).astype('int32')
-            last_flag = k - (right_lower_ - left_upper_) == 0
-            for m in range(right_lower_[0] - 1):
-                expanded_dis[left_upper_ + m] += to_expand_value_ * is_nonzero_distribution[left_upper_ + m]
-            expanded_dis[left_upper_ + right_lower_[0] - 1] += (
-                to_expand_value_ * last_flag * is_nonzero_distribution[left_upper_ + right_lower_[0] - 1]
+        # The sum of the distribution after the threshold, which is added to the last bin of the candidate
+        after_threshold_sums = np.subtract.accumulate(
+            np.concatenate(
+                [np.sum(distribution[target_bin_numbers:], keepdims=True), distribution[target_bin_numbers:]]
             )
+        )[: thresholds.size]
+
+        bin_interval = thresholds[:, None] / target_bin_numbers
+
+        # merge i bins to target bins
+        start_ = np.arange(target_bin_numbers) * bin_interval
+        end_ = start_ + bin_interval
+
+        left_upper_ = np.ceil(start_).astype('int64')
+        right_lower_ = np.floor(end_).astype('int64')
+
+        left_flag = left_upper_ > start_
+        right_flag = right_lower_ < end_
+
+        left_scale_ = left_upper_ - start_
+        right_scale_ = end_ - right_lower_
+
+        quantize_dis = np.where(left_flag, left_scale_ * dist[left_upper_ - 1], 0.0)
+        quantize_dis = quantize_dis + np.where(right_flag, right_scale_ * dist[right_lower_], 0.0)
+        quantize_dis += cumsum_dist[right_lower_] - cumsum_dist[left_upper_]
+
+        # expand target bins to i bins
+        count_ = np.where(left_flag, left_scale_ * is_nonzero_distribution[left_upper_ - 1], 0.0)
+        count_ = count_ + np.where(right_flag, right_scale_ * is_nonzero_distribution[right_lower_], 0.0)
+        count_ += cumsum_nozeros[right_lower_] - cumsum_nozeros[left_upper_]
+
+        count_flag = count_ != 0
+        to_expand_value_ = np.where(count_flag, quantize_dis / np.where(count_flag, count_, 1.0), 0.0)
+
+        # Calculate the KL divergence of the expanded distribution and the candidate distribution
+        last_candidate = distribution[thresholds - 1] + after_threshold_sums
+        if not empty_bin_is_nan:
+            last_candidate = np.maximum(last_candidate, 0)
+        kl = cumsum_xlogx[thresholds - 1] + _xlogx(last_candidate)
+        last_candidate = last_candidate.astype('float64')
+
+        # The bins that are fully covered by a target bin, where the expanded values are zero for the empty bins
+        full_sum = cumsum_dist_64[right_lower_] - cumsum_dist_64[left_upper_]
+        full_sum[:, -1] += last_candidate - dist_64[thresholds - 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            full_kl = full_sum * np.log(to_expand_value_)
+            kl -= np.sum(np.where(full_sum != 0, full_kl, 0.0), axis=1)
+        if empty_bin_is_nan:
+            invalid = np.any(cumsum_zeros[right_lower_] > cumsum_zeros[left_upper_], axis=1)
+        else:
+            invalid = (dist_64[thresholds - 1] == 0) & (last_candidate > 0)
 
-            # Calculate the Kl divergence of expanded_dis and candidate_dis
-            expanded_dis = torch.from_numpy(expanded_dis)
-            candidate_dis = torch.from_numpy(candidate_dis)
-            curKL = F.kl_div(expanded_dis.log(), candidate_dis, reduction='sum')
-            if curKL < min_kl_divergence and curKL != 1.0:
-                min_kl_divergence = curKL
-                threshold = i
+        # The bins that are shared by two adjacent target bins
+        left_expand_value = np.where(count_flag & left_flag, to_expand_value_ * left_scale_, 0.0)
+        right_expand_value = np.where(count_flag & right_flag, to_expand_value_ * right_scale_, 0.0)
+        partial_expand_value = left_expand_value[:, 1:] + right_expand_value[:, :-1]
+        partial_flag = right_flag[:, :-1] & (partial_expand_value != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            partial_kl = dist_64[right_lower_[:, :-1]] * np.log(partial_expand_value)
+            kl -= np.sum(np.where(partial_flag, partial_kl, 0.0), axis=1)
+        if empty_bin_is_nan:
+            invalid |= np.any(right_flag[:, :-1] & (partial_expand_value == 0), axis=1)
 
-        return threshold
+        kl[invalid | np.isnan(kl) | (kl == 1.0)] = np.inf
+        best = int(np.argmin(kl))
+        if kl[best] < np.inf:
+            return int(thresholds[best])
+        else:
+            return target_bin_numbers
 
     def _non_linear_param_search(self) -> Tuple[torch.Tensor, torch.Tensor]:
         """Search for optimal cutoff range for asymmetric quantization.
@@ -149,3 +185,80 @@ class HistogramObserverKL(torch_q.HistogramObserver):
         new_max = self.min_val + bin_width * right_threshold
 
         return new_min, new_max
+
+
+class _QParamsCache(object):
+    """Returns the qparams precomputed by `finalize_observers` in place of `observer.calculate_qparams`"""
+
+    def __init__(self, qparams: Tuple[torch.Tensor, torch.Tensor]) -> None:
+        self.qparams = qparams
+
+    def __call__(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.qparams
+
+
+def _invalidate_qparams_cache(mod: nn.Module, inputs) -> None:
+    mod.__dict__.pop('calculate_qparams', None)
+
+
+def _calculate_qparams(observer: nn.Module) -> typing.Optional[Tuple[torch.Tensor, torch.Tensor]]:
+    try:
+        return observer.calculate_qparams()
+    except Exception as e:
+        log.warning(f'Failed to calculate qparams for {type(observer).__name__}: {e}')
+        return None
+
+
+def finalize_observers(
+    model: nn.Module, max_workers: typing.Optional[int] = None, use_processes: bool = False
+) -> typing.List[nn.Module]:
+    """Computes the qparams of all the histogram observers in the model concurrently and caches the results on the
+    observers, so that the following `calculate_qparams` calls (e.g. in `torch.quantization.convert`) return
+    immediately. The cache of an observer is dropped once it observes new data.
+
+    Args:
+        model (nn.Module): The PTQ-prepared model
+        max_workers (typing.Optional[int], optional): The number of workers. Defaults to None, in which case \
+            `os.cpu_count()` is used. Pass 1 to compute the qparams sequentially.
+        use_processes (bool, optional): Whether to use a process pool instead of a thread pool. Defaults to False.
+
+    Returns:
+        typing.List[nn.Module]: The observers that are finalized
+    """
+
+    observers = []
+    visited = set()
+    for m in model.modules():
+        if isinstance(m, torch_q.HistogramObserver) and id(m) not in visited:
+            visited.add(id(m))
+            observers.append(m)
+
+    if len(observers) == 0:
+        return observers
+
+    # Drop the stale results, so that the qparams are computed from the latest statistics
+    for observer in observers:
+        _invalidate_qparams_cache(observer, None)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(observers))
+
+    if max_workers <= 1:
+        results = [_calculate_qparams(observer) for observer in observers]
+    else:
+        executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_cls(max_workers=max_workers) as executor:
+            results = list(executor.map(_calculate_qparams, observers))
+
+    finalized = []
+    for observer, qparams in zip(observers, results):
+        if qparams is None:
+            continue
+
+        observer.calculate_qparams = _QParamsCache(qparams)
+        if _invalidate_qparams_cache not in observer._forward_pre_hooks.values():
+            observer.register_forward_pre_hook(_invalidate_qparams_cache)
+        finalized.append(observer)
+
+    return finalized
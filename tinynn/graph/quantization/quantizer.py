@@ -19,15 +19,20 @@ import torch.quantization as torch_q
 from torch.nn.parallel.data_parallel import DataParallel
 from torch.nn.parallel.distributed import DistributedDataParallel
 
+from tinynn.graph.quantization.calibration import Calibrator
 from tinynn.graph.quantization.fake_quantize import (
+    FakeQuantize,
     FakeQuantizeBFloat16,
     FakeQuantizeTFLite,
+    prepare_branchless_fake_quantize,
+    restore_observer_hooks,
 )
 from tinynn.graph.quantization.modules import QGLU, QPReLU, QSiLU
 from tinynn.graph.quantization.observer import (
     HistogramObserverKL,
     MinMaxObserver,
     PerChannelMinMaxObserver,
+    finalize_observers,
 )
 from tinynn.graph.quantization.qat_modules import (
     Conv1d,
@@ -35,6 +40,7 @@ from tinynn.graph.quantization.qat_modules import (
     ConvTranspose2d,
     ConvTransposeBn2d,
 )
+
 if LooseVersion(torch.__version__) >= LooseVersion("1.13.0"):
     from tinynn.graph.quantization.quantizable.gru import GRU as QuantizableGRU
     from torch.ao.nn.quantizable.modules.rnn import LSTM as QuantizableLSTM
@@ -294,6 +300,7 @@ class QATQuantizer(object):
     ignore_layerwise_config: bool
     fused_layerwise_config: bool
     inplace: bool
+    observer_workers: typing.Optional[int]
     train_mode_dict: typing.Dict[nn.Module, bool]
 
     def __init__(self, model, dummy_input, work_dir: typing.Optional[str] = None, config: typing.Optional[dict] = None):
@@ -392,6 +399,7 @@ class QATQuantizer(object):
             'ignore_layerwise_config': False,
             'inplace': False,
             'override_qconfig_func': None,
+            'observer_workers': None,
         }
 
         if config is None:
@@ -492,11 +500,15 @@ class QATQuantizer(object):
             else:
                 # Import the new model
                 rewritten_model = import_from_path(model_ns, model_code_path, model_name_q)()
-                rewritten_model.load_state_dict(torch.load(model_weights_path))
 
                 device = get_module_device(self.model)
-                if device is not None:
+                if device is not None and device.type == 'meta':
+                    # There are no values to load for the models on the meta device
                     rewritten_model.to(device=device)
+                else:
+                    rewritten_model.load_state_dict(torch.load(model_weights_path))
+                    if device is not None:
+                        rewritten_model.to(device=device)
 
                 # Remove the weights file to save space
                 if self.remove_weights_after_load:
@@ -764,6 +776,11 @@ class QATQuantizer(object):
             q_a = FakeQuantizeTFLite.with_args(*qconfig.activation.p.args, **qconfig.activation.p.keywords)
             q_w = FakeQuantizeTFLite.with_args(*qconfig.weight.p.args, **qconfig.weight.p.keywords)
             qconfig = torch_q.QConfig(q_a, q_w)
+        elif self.legacy_fq:
+            # The fake-quantize modules without data-dependent control flow, which can be compiled by `torch.compile`
+            q_a = FakeQuantize.with_args(*qconfig.activation.p.args, **qconfig.activation.p.keywords)
+            q_w = FakeQuantize.with_args(*qconfig.weight.p.args, **qconfig.weight.p.keywords)
+            qconfig = torch_q.QConfig(q_a, q_w)
         if backend == 'qnnpack':
             if not self.asymmetric:
                 sym_fq = qconfig.activation.with_args(
@@ -1030,6 +1047,8 @@ class QATQuantizer(object):
         if self.quantized_op_stats is not None:
             self.prepare_quantized_ops_pass(graph)
 
+        prepare_branchless_fake_quantize(graph.module)
+
         if self.backend == 'tensorrt':
             q = queue.Queue()
             q.put(('', graph.module))
@@ -2546,8 +2565,12 @@ class QATQuantizer(object):
                     fuse_mapping[name] = names[0]
                     self.layerwise_config[name] = self.layerwise_config.get(names[0], True)
 
+        # Looking up the column of the comment scans the whole config, so it is only done once
+        column = None
         for n, t in type_dict.items():
-            self.layerwise_config.yaml_add_eol_comment(f'type: {t}', n)
+            self.layerwise_config.yaml_add_eol_comment(f'type: {t}', n, column=column)
+            if column is None:
+                column = self.layerwise_config.ca.items[n][2].start_mark.column
 
         skip_types = set(k[0] for k in REWRITE_QUANTIZABLE_RULE_LIST if len(k) == 1)
         if self.set_quantizable_op_stats:
@@ -2555,6 +2578,18 @@ class QATQuantizer(object):
         skip_types_prev = skip_types | set(k[-1] for k in REWRITE_QUANTIZABLE_RULE_LIST if len(k) > 1)
         skip_types_next = skip_types | set(k[0] for k in REWRITE_QUANTIZABLE_RULE_LIST if len(k) > 1)
 
+        torch_version = LooseVersion(torch.__version__)
+        unsupported_kinds = set(
+            k
+            for k, v in UNSUPPORTED_PYTORCH_QUANTIZATION_OP_LIST.items()
+            if type(k) == str and (v is None or torch_version < v)
+        )
+        unsupported_types = tuple(
+            k
+            for k, v in UNSUPPORTED_PYTORCH_QUANTIZATION_OP_LIST.items()
+            if type(k) != str and k not in Q_MODULES_MAPPING and (v is None or torch_version < v)
+        )
+
         # Add quant/dequant nodes for non-quantizable OPs
         def _is_not_quantizable(node, custom_data):
             cur_module = node.module
@@ -2571,20 +2606,12 @@ class QATQuantizer(object):
                     return False
                 if self.layerwise_config.get(node.unique_name, True) is False:
                     return True
-                supported_version = UNSUPPORTED_PYTORCH_QUANTIZATION_OP_LIST.get(cur_module.kind, torch.__version__)
-                return supported_version is None or LooseVersion(torch.__version__) < supported_version
+                return cur_module.kind in unsupported_kinds
             else:
                 if isinstance(cur_module, (torch_q.QuantStub, torch_q.DeQuantStub)):
                     return False
                 if self.layerwise_config.get(node.unique_name, True) is False:
                     return True
-                unsupported_types = tuple(
-                    k
-                    for k, v in UNSUPPORTED_PYTORCH_QUANTIZATION_OP_LIST.items()
-                    if type(k) != str
-                    and k not in Q_MODULES_MAPPING
-                    and (v is None or LooseVersion(torch.__version__) < v)
-                )
                 return isinstance(cur_module, unsupported_types)
 
         unsupported_nodes = graph.filter_forward_nodes(_is_not_quantizable)
@@ -3110,6 +3137,12 @@ class QATQuantizer(object):
                 in PyTorch only.
         """
 
+        # Compute the qparams of the histogram observers in parallel, which are then reused in the conversion
+        finalize_observers(q_model, self.observer_workers)
+
+        # `torch.quantization.convert` only removes the observer hooks of its own
+        restore_observer_hooks(q_model)
+
         for acp, post_acp, dq_name, q_name, activ_name, activ_type in self.extra_qparams_mappings:
             if backend != 'pytorch' and activ_type in ('relu', 'relu6', torch.nn.ReLU, torch.nn.ReLU6):
                 continue
@@ -3667,7 +3700,12 @@ class PostQuantizer(QATQuantizer):
                     "float_to_observed_custom_module_class", {}
                 )
 
-                torch_q.add_observer_(
+                if hasattr(torch_q, 'add_observer_'):
+                    add_observer_func = torch_q.add_observer_
+                else:
+                    add_observer_func = sys.modules['torch.ao.quantization.quantize']._add_observer_
+
+                add_observer_func(
                     graph.module,
                     qconfig_propagation_list=whitelist,
                     custom_module_class_mapping=custom_module_class_mapping,
@@ -3708,6 +3746,21 @@ class PostQuantizer(QATQuantizer):
 
         return graph.module
 
+    def calibrate(self, model: nn.Module, data: typing.Iterable, **kwargs) -> int:
+        """Calibrates the PTQ-prepared model with the batches in `data`, which are prefetched in the background
+
+        Args:
+            model (nn.Module): The PTQ-prepared model
+            data (typing.Iterable): An iterable of batches, e.g. a DataLoader
+            kwargs: The options of `Calibrator`, e.g. `max_batches`, `tolerance` (early stopping) and \
+                `checkpoint_path` (resumable calibration)
+
+        Returns:
+            int: The number of batches that the model is calibrated with
+        """
+
+        return Calibrator(**kwargs).calibrate(model, data)
+
 
 class DynamicQuantizer(QATQuantizer):
     rewrite_graph: bool
@@ -3805,11 +3858,15 @@ class DeQuantizer(object):
 
             # Import the new model
             rewritten_model = import_from_path(model_ns, model_code_path, model_name_float)()
-            rewritten_model.load_state_dict(torch.load(model_weights_path))
 
             device = get_module_device(self.model)
-            if device is not None:
+            if device is not None and device.type == 'meta':
+                # There are no values to load for the models on the meta device
                 rewritten_model.to(device=device)
+            else:
+                rewritten_model.load_state_dict(torch.load(model_weights_path))
+                if device is not None:
+                    rewritten_model.to(device=device)
 
             # Remove the weights file to save space
             if self.remove_weights_after_load:
@@ -1,29 +1,41 @@
 import contextlib
 import copy
 import ctypes
+import hashlib
 import importlib
 import inspect
 import io
+import itertools
+import logging
 import os
+import pickle
 import queue
 import re
 import sys
+import threading
 import traceback
 import typing
 import weakref
 import types
+import zlib
 
 import torch
 import torch.nn as nn
 import yaml
 import numpy as np
 
+try:
+    import contextvars
+except ImportError:
+    # Python 3.6
+    contextvars = None
+
 from torch.nn.parallel.data_parallel import DataParallel
 from torch.nn.parallel.distributed import DistributedDataParallel
 
 from tinynn.util.train_util import get_module_device
 from tinynn.util.util import get_logger, import_from_path, tensors2ndarray
-from ._utils import patch_getitem, revert_getitem, patch_new, revert_new
+from ._utils import get_new, patch_getitem, revert_getitem, patch_new, revert_new
 from . import interop  # noqa: F401
 
 # Basic types
@@ -47,11 +59,11 @@ class GlobalData(object):
 
     def __str__(self):
         """Returns the string representation of the inner object"""
-        return self.value.__str__()
+        return self.get_value().__str__()
 
     def __repr__(self):
         """Returns the string representation of the inner object"""
-        return self.value.__repr__()
+        return self.get_value().__repr__()
 
     def __call__(self, *args):
         """Simplifies the usage of the wrapper
@@ -69,7 +81,72 @@ class GlobalData(object):
 
     def __bool__(self):
         """Returns the actual boolean value of the inner object"""
-        return self.value.__bool__()
+        return self.get_value().__bool__()
+
+
+class ContextData(GlobalData):
+    """The data structure to store data that is local to the current context (e.g. the current thread),
+    so that the traces in different threads don't interfere with each other.
+    The inner value is created with `factory` when it is accessed for the first time in a context."""
+
+    def __init__(self, factory: typing.Callable):
+        self.factory = factory
+        if contextvars is None:
+            self.local = threading.local()
+        else:
+            self.var = contextvars.ContextVar(f'tinynn_tracer_{id(self)}')
+
+    def get_value(self):
+        """Returns the inner value of the wrapper in the current context"""
+        if contextvars is None:
+            if not hasattr(self.local, 'value'):
+                self.local.value = self.factory()
+            return self.local.value
+
+        try:
+            return self.var.get()
+        except LookupError:
+            value = self.factory()
+            self.var.set(value)
+            return value
+
+    def set_value(self, value):
+        """Sets the inner value of the wrapper in the current context"""
+        if contextvars is None:
+            self.local.value = value
+        else:
+            self.var.set(value)
+
+
+class ContextLocal(object):
+    """A proxy of a container (e.g. a dict or a set) that is local to the current context"""
+
+    def __init__(self, factory: typing.Callable):
+        self._data = ContextData(factory)
+
+    def __getattr__(self, name):
+        return getattr(self._data(), name)
+
+    def __contains__(self, key):
+        return key in self._data()
+
+    def __getitem__(self, key):
+        return self._data()[key]
+
+    def __setitem__(self, key, value):
+        self._data()[key] = value
+
+    def __delitem__(self, key):
+        del self._data()[key]
+
+    def __iter__(self):
+        return iter(self._data())
+
+    def __len__(self):
+        return len(self._data())
+
+    def __repr__(self):
+        return repr(self._data())
 
 
 # Constants
@@ -80,7 +157,7 @@ MODULE_TEMPLATE = """
 %(import_block)s
 
 
-class %(name_block)s(torch.nn.Module):
+%(class_block)sclass %(name_block)s(torch.nn.Module):
     def __init__(self):
         super().__init__()
 
@@ -131,24 +208,29 @@ overridable_creation_funcs_loaded = GlobalData(False)
 torch_overrides_funcs_loaded = GlobalData(False)
 tracking_modules_loaded = GlobalData(False)
 
-funcs_overrided = GlobalData(False)
-modules_overrided = GlobalData(False)
-creation_funcs_overrided = GlobalData(False)
-tracking_modules_overrided = GlobalData(False)
+# The patches of PyTorch are shared by all the traces in the process, so they are reference-counted.
+# The reference counts in the current context tell the wrappers whether to trace the calls in that context.
+patch_lock = threading.RLock()
+patch_ref_counts = {'modules': 0, 'funcs': 0, 'creation_funcs': 0, 'tracking_modules': 0}
+patch_managers = {}
+context_patch_ref_counts = ContextData(dict)
+
+# The following states are local to the current context (e.g. the current thread),
+# so that multiple traces can run concurrently in one process.
 
 # Lock for tracing
-lock = GlobalData(False)
-handle_func_lock = GlobalData(False)
+lock = ContextData(bool)
+handle_func_lock = ContextData(bool)
 
 # Whether the constructors get traced
-module_constructor_traced = set()
+module_constructor_traced = ContextLocal(set)
 
 # Current traced graph
-current_graph = GlobalData(None)
+current_graph = ContextData(lambda: None)
 
 # Generated module constructor lines
-module_constructor_lines = {}
-module_constructor_weakrefs = {}
+module_constructor_lines = ContextLocal(dict)
+module_constructor_weakrefs = ContextLocal(dict)
 
 # Directory of the current script
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -157,16 +239,22 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 module_constructor_signatures = {}
 
 # Original values of tracked objects
-original_values_for_tracked_objects = {}
+original_values_for_tracked_objects = ContextLocal(dict)
 
 # Original module class names
 importable_module_names = {}
 
 # Ignore warning for update module parameters
-mod_param_update_warning_ignore = GlobalData(False)
+mod_param_update_warning_ignore = ContextData(bool)
+
+# Version of the format of the cached override tables. Bump it when the layout of the resolved tables changes.
+OVERRIDE_CACHE_VERSION = 1
+
+# The version of the format of the cached traces
+TRACE_CACHE_VERSION = 4
 
 # Modules that are skipped while tracing
-skip_modules = set()
+skip_modules = ContextLocal(set)
 
 
 class TraceNode(object):
@@ -231,6 +319,12 @@ class TraceNode(object):
         # Whether the node is active in the computation graph
         self.active = True
 
+        # The original name of the innermost container module in which the node is called
+        if len(cur_graph.scope_stack) > 0:
+            self.scope_name = cur_graph.scope_stack[-1]
+        else:
+            self.scope_name = None
+
         # The index of the node in the graph
         self.forward_order = 0
 
@@ -322,13 +416,13 @@ class ConstantNode(object):
 
     def __init__(
         self,
-        data: typing.List,
+        data: torch.Tensor,
         dtype: torch.dtype,
         shape: torch.Size,
         unique_name: typing.Optional[str] = None,
         original_name: typing.Optional[str] = None,
     ):
-        # Raw data (list)
+        # Raw data (a detached copy of the original tensor)
         self.data = data
 
         # Data shape
@@ -384,7 +478,7 @@ class ConstantNode(object):
         self.is_persistent = persistent
         self.requires_grad = requires_grad
         if not persistent:
-            self.data_str = f'{_stringify_list(self.data)}'
+            self.data_str = f'{_stringify_list(self.data.tolist())}'
 
         return self
 
@@ -538,6 +632,10 @@ class TraceFunction(object):
         expr = self.extra_expr('args[0]')
         return eval(expr)
 
+    def compile(self) -> typing.Callable:
+        """Compiles the function into a callable that accepts a list of tensor inputs"""
+        return eval(f'lambda args: {self.extra_expr("args")}')
+
     def parse_args(self, *args, **kwargs):
         """Sets the string representation of the arguments"""
 
@@ -759,21 +857,22 @@ def new_setattr_gen(orig_setattr, key: str):
     """Wrapper function for the __setattr__ functions of the modules in PyTorch"""
     log.debug(f'registered module setattr wrapper: {key}')
 
+    class_name = '.'.join(key.split('.')[:-1])
+
     def new_setattr(obj, name, value):
-        log.debug(f'{key} in setattr function wrapper')
-        related = True
-        log.debug(f'{key} before with block, lock: {lock}')
-        with no_catch() as res:
-            if res:
-                if id(obj) not in module_constructor_traced:
-                    related = False
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug(f'{key} in setattr function wrapper')
+            log.debug(f'{key} before with block, lock: {lock}')
+
+        if lock() or not context_patch_ref_counts().get('modules'):
+            return orig_setattr(obj, name, value)
+
+        lock(True)
+        try:
+            if id(obj) in module_constructor_traced:
                 class_type = type(obj)
-                if related and not hasattr(class_type, '__constants__'):
-                    related = False
-                if related and name not in class_type.__constants__:
-                    related = False
-                if related:
-                    class_name = '.'.join(key.split('.')[:-1])
+                if hasattr(class_type, '__constants__') and name in class_type.__constants__:
                     log_func = log.warning
                     if mod_param_update_warning_ignore():
                         log_func = log.debug
@@ -784,7 +883,8 @@ def new_setattr_gen(orig_setattr, key: str):
                     module_constructor_traced.remove(id(obj))
                     del module_constructor_lines[id(obj)]
             return orig_setattr(obj, name, value)
-        log.debug(f'{key} after with block, lock: {lock}')
+        finally:
+            lock(False)
 
     return new_setattr
 
@@ -883,10 +983,18 @@ def constant_handler(
                 convert_to_parameter = True
             if tensor.numel() > 50:
                 persistent = True
-            raw_data = tensor.tolist()
+            if tensor.is_meta:
+                # The values of meta tensors are unknown, so they cannot be written inline
+                persistent = True
             unique_name = current_graph().parameter_unique_name_dict.get(id(tensor), None)
             original_name = current_graph().parameter_original_name_dict.get(id(tensor), None)
             with no_catch():
+                # The tensor may be modified inplace later, so a snapshot of its values is required.
+                # Only the small ones are converted to lists when they are written inline.
+                if tensor.is_meta:
+                    raw_data = tensor.detach()
+                else:
+                    raw_data = tensor.detach().to('cpu', copy=True)
                 constant_node = ConstantNode(raw_data, tensor.dtype, tensor.shape, unique_name, original_name).parse(
                     convert_to_parameter, persistent, requires_grad
                 )
@@ -901,68 +1009,73 @@ def new_getattr_gen(orig_getattr, key: str, is_class: bool):
     """Wrapper function for the __getattribute__ functions of the modules in PyTorch"""
     log.debug(f'registered module getattr wrapper: {key}')
 
+    key_prefix = key[: -len('__getattribute__')]
+
     def new_getattr(obj, name):
-        log.debug(f'{key} in getattr function wrapper')
-        related = False
-        log.debug(f'{key} before with block, lock: {lock}')
-        with no_catch() as res:
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug(f'{key} in getattr function wrapper')
+            log.debug(f'{key} before with block, lock: {lock}')
+
+        if lock() or not context_patch_ref_counts().get('funcs'):
+            return orig_getattr(obj, name)
+
+        lock(True)
+        try:
             result = orig_getattr(obj, name)
-            if current_graph() is None:
-                related = False
-            if name in ('device', 'shape', 'data', 'dtype'):
-                related = True
-            if res:
-                if related:
-                    # Also the property should be constant if the result object is unchanged.
-                    # Only create a new node when there isn't one.
-                    if (
-                        id(result) in current_graph().tensor_pre_node_dict
-                        and id(result) in original_values_for_tracked_objects
-                        and original_values_for_tracked_objects[id(result)] == result
-                    ):
-                        node_name = current_graph().tensor_pre_node_dict[id(result)]
-                        trace_node = current_graph().nodes_map[node_name]
-                        if trace_node.module.is_property and trace_node.module.func_type == 'shape':
-                            result = tuple(trace_node.next_tensors)
-                    else:
-                        # Handling dynamic shape
-
-                        # If the torch.Size object is generated by a tensor,
-                        # then we connect it to the graph.
-                        # Otherwise, don't track it.
-                        old_result = None
-                        if type(result) == torch.Size and isinstance(obj, torch.Tensor):
-                            # Create a list of new tensors for the sake of tracking
-                            # The reason to use that instead of a tensor is stated below.
-                            # e.g. Users may use the following clause to deal with sizes
-                            #      x, y = tensor.size()
-                            # Currently, there is no way to trace it.
-                            # However, by doing this, if user calls `numel` on the `torch.Size`
-                            # object, it will now throw an exception.
-                            # TODO: Fix the case if user calls `numel` on `torch.Size`
-                            constant_handler(obj, type_name=key)
-                            original_values_for_tracked_objects[id(result)] = copy.deepcopy(result)
-                            new_result = []
-                            for elem in result:
-                                new_result.append(torch.tensor(elem))
-                                current_graph().tensor_pre_node_dict[
-                                    id(new_result[-1])
-                                ] = current_graph().tensor_pre_node_dict[id(obj)]
-                            old_result = result
-                            result = tuple(new_result)
+            graph = current_graph()
+            if graph is not None and name in ('device', 'shape', 'data', 'dtype'):
+                # Also the property should be constant if the result object is unchanged.
+                # Only create a new node when there isn't one.
+                if (
+                    id(result) in graph.tensor_pre_node_dict
+                    and id(result) in original_values_for_tracked_objects
+                    and original_values_for_tracked_objects[id(result)] == result
+                ):
+                    node_name = graph.tensor_pre_node_dict[id(result)]
+                    trace_node = graph.nodes_map[node_name]
+                    if trace_node.module.is_property and trace_node.module.func_type == 'shape':
+                        result = tuple(trace_node.next_tensors)
+                else:
+                    # Handling dynamic shape
+
+                    # If the torch.Size object is generated by a tensor,
+                    # then we connect it to the graph.
+                    # Otherwise, don't track it.
+                    old_result = None
+                    if type(result) == torch.Size and isinstance(obj, torch.Tensor):
+                        # Create a list of new tensors for the sake of tracking
+                        # The reason to use that instead of a tensor is stated below.
+                        # e.g. Users may use the following clause to deal with sizes
+                        #      x, y = tensor.size()
+                        # Currently, there is no way to trace it.
+                        # However, by doing this, if user calls `numel` on the `torch.Size`
+                        # object, it will now throw an exception.
+                        # TODO: Fix the case if user calls `numel` on `torch.Size`
+                        constant_handler(obj, type_name=key)
+                        original_values_for_tracked_objects[id(result)] = copy.deepcopy(result)
+                        new_result = []
+                        for elem in result:
+                            new_result.append(torch.tensor(elem))
+                            graph.tensor_pre_node_dict[id(new_result[-1])] = graph.tensor_pre_node_dict[id(obj)]
+                        old_result = result
+                        result = tuple(new_result)
 
+                    if debug:
                         log.debug(f'{key} is called with {name}')
-                        new_key = key.replace('__getattribute__', name)
-                        trace_func = TraceFunction(new_key, True, True).parse_args(obj)
-                        trace_node = TraceNode(trace_func)
+                    trace_func = TraceFunction(key_prefix + name, True, True).parse_args(obj)
+                    trace_node = TraceNode(trace_func)
 
-                        if old_result is not None:
-                            current_graph().tensor_pre_node_dict[id(old_result)] = trace_node.unique_name
+                    if old_result is not None:
+                        graph.tensor_pre_node_dict[id(old_result)] = trace_node.unique_name
 
-                        add_forward_node(trace_node, trace_func.prev_tensors, result)
+                    add_forward_node(trace_node, trace_func.prev_tensors, result)
+        finally:
+            lock(False)
 
+        if debug:
             log.debug(f'{key} after with block, lock: {lock}')
-            return result
+        return result
 
     return new_getattr
 
@@ -971,9 +1084,15 @@ def new_init_tracking_gen(orig_init, key: str):
     """Wrapper function for the init functions of the modules in PyTorch"""
     log.debug(f'registered module init tracking wrapper: {key}')
 
+    # The original constructor is patched in place, so we need to keep the underlying function
+    orig_new = get_new(orig_init.__self__)
+
     def new_init_tracking(obj, args, kwargs):
         log.debug(f'{key} in init tracking function wrapper')
 
+        if not context_patch_ref_counts().get('tracking_modules'):
+            return orig_new(obj, args, kwargs)
+
         with no_catch():
             is_tensor = torch.is_tensor(args[0])
 
@@ -990,21 +1109,30 @@ def new_init_gen(orig_init, key: str):
     """Wrapper function for the init functions of the modules in PyTorch"""
     log.debug(f'registered module init wrapper: {key}')
 
+    class_fullname = '.'.join(key.split('.')[:-1])
+
     def new_init(obj, *args, **kwargs):
-        log.debug(f'{key} in init function wrapper')
+        if not context_patch_ref_counts().get('modules'):
+            return orig_init(obj, *args, **kwargs)
+
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug(f'{key} in init function wrapper')
         module_constructor_traced.add(id(obj))
-        init_fullname = key
-        class_fullname = '.'.join(init_fullname.split('.')[:-1])
-        log.debug(f'{key} before with block, lock: {lock}')
-        with no_catch() as res:
+        if debug:
+            log.debug(f'{key} before with block, lock: {lock}')
+
+        res = not lock()
+        if res:
+            lock(True)
+        try:
             if id(obj) not in module_constructor_lines or (
                 id(obj) in module_constructor_weakrefs and module_constructor_weakrefs[id(obj)]() is None
             ):
                 if not res:
-                    log.warning(
-                        f'Failed to acquire the tracing lock while tracing {init_fullname}, which is unexpected.'
-                    )
-                log.debug(f'{key} in with block, lock: {lock}')
+                    log.warning(f'Failed to acquire the tracing lock while tracing {key}, which is unexpected.')
+                if debug:
+                    log.debug(f'{key} in with block, lock: {lock}')
 
                 actual_class_name = qualified_name(type(obj))
                 if actual_class_name == class_fullname:
@@ -1028,7 +1156,12 @@ def new_init_gen(orig_init, key: str):
                     if not actual_class_name.startswith('torch.'):
                         log.warning(f'Constructor of class {actual_class_name} is not captured')
             orig_init(obj, *args, **kwargs)
-        log.debug(f'{key} after with block, lock: {lock}')
+        finally:
+            if res:
+                lock(False)
+
+        if debug:
+            log.debug(f'{key} after with block, lock: {lock}')
 
     return new_init
 
@@ -1037,15 +1170,26 @@ def new_func_gen(orig_func, key: str, is_class: bool):
     """Wrapper function for functions in PyTorch"""
     log.debug(f'registered function wrapper: {key}')
 
+    is_size_func = key == 'torch.Tensor.size'
+
     def new_func(*args, **kwargs):
-        log.debug(f'{key} in function wrapper')
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug(f'{key} in function wrapper')
+            log.debug(f'{key} before with block, lock: {lock}')
+
+        if lock() or not context_patch_ref_counts().get('funcs'):
+            return orig_func(*args, **kwargs)
+
         related = False
-        log.debug(f'{key} before with block, lock: {lock}')
-        with no_catch() as res:
+        lock(True)
+        try:
             result = orig_func(*args, **kwargs)
-            if res and current_graph() is not None:
-                log.debug(f'{key} in with block, lock: {lock}')
-                if key == 'torch.Tensor.size' and len(args) > 1:
+            graph = current_graph()
+            if graph is not None:
+                if debug:
+                    log.debug(f'{key} in with block, lock: {lock}')
+                if is_size_func and len(args) > 1:
                     # Tracking torch.Tensor.size with optional int argument
                     result = torch.tensor(result)
                 if type(result) == torch.Size:
@@ -1066,28 +1210,29 @@ def new_func_gen(orig_func, key: str, is_class: bool):
                         new_result = []
                         for elem in result:
                             new_result.append(torch.tensor(elem))
-                            current_graph().tensor_pre_node_dict[
-                                id(new_result[-1])
-                            ] = current_graph().tensor_pre_node_dict[id(args[0])]
+                            graph.tensor_pre_node_dict[id(new_result[-1])] = graph.tensor_pre_node_dict[id(args[0])]
                         result = tuple(new_result)
                         related = True
                 elif type(result) in (torch.dtype, torch.device):
                     related = True
                 else:
                     related = check_tensor_type(result)
-            log.debug(f'{key} after with block, lock: {lock}')
-        if related:
-            log.debug(f'tracing {key} in function wrapper')
-            with no_catch() as res:
-                if res:
-                    trace_func = TraceFunction(key, is_class).parse_args(*args, **kwargs)
-                    trace_node = TraceNode(trace_func)
 
-                    modified_result = noop_handler(trace_node, trace_func.prev_tensors, result)
-                    if modified_result is not None:
-                        result = modified_result
-                    add_forward_node(trace_node, trace_func.prev_tensors, result)
-            log.debug(f'tracing {key} function wrapper complete')
+            if related:
+                if debug:
+                    log.debug(f'tracing {key} in function wrapper')
+                trace_func = TraceFunction(key, is_class).parse_args(*args, **kwargs)
+                trace_node = TraceNode(trace_func)
+
+                modified_result = noop_handler(trace_node, trace_func.prev_tensors, result)
+                if modified_result is not None:
+                    result = modified_result
+                add_forward_node(trace_node, trace_func.prev_tensors, result)
+                if debug:
+                    log.debug(f'tracing {key} function wrapper complete')
+        finally:
+            lock(False)
+
         return result
 
     return new_func
@@ -1098,6 +1243,9 @@ def new_has_torch_func_gen(orig_func, key: str, is_class: bool):
     log.debug(f'registered has torch func wrapper: {key}')
 
     def new_func(*args, **kwargs):
+        if not context_patch_ref_counts().get('funcs'):
+            return orig_func(*args, **kwargs)
+
         with no_catch_handle_func() as res:
             return (res and not lock()) or orig_func(*args, **kwargs)
 
@@ -1109,7 +1257,7 @@ def new_handle_func_gen(orig_func, key: str, is_class: bool):
     log.debug(f'registered has torch func wrapper: {key}')
 
     def new_func(func, tracked_args, *args, **kwargs):
-        if lock():
+        if lock() or not context_patch_ref_counts().get('funcs'):
             return orig_func(func, tracked_args, *args, **kwargs)
         else:
             with no_catch_handle_func():
@@ -1123,41 +1271,152 @@ def new_creation_func_gen(orig_func, key: str, is_class: bool):
     log.debug(f'registered creation function wrapper: {key}')
 
     def new_func(*args, **kwargs):
-        log.debug(f'{key} in creation function wrapper')
-        with no_catch() as res:
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug(f'{key} in creation function wrapper')
+
+        if lock() or not context_patch_ref_counts().get('creation_funcs'):
+            return orig_func(*args, **kwargs)
+
+        lock(True)
+        try:
             result = orig_func(*args, **kwargs)
-        log.debug(f'tracing {key} in creation function wrapper')
-        with no_catch() as res:
-            if res:
-                trace_func = TraceFunction(key, is_class).parse_args(*args, **kwargs)
-                trace_node = TraceNode(trace_func)
+            if debug:
+                log.debug(f'tracing {key} in creation function wrapper')
+            trace_func = TraceFunction(key, is_class).parse_args(*args, **kwargs)
+            trace_node = TraceNode(trace_func)
+
+            add_forward_node(trace_node, trace_func.prev_tensors, result)
+        finally:
+            lock(False)
 
-                add_forward_node(trace_node, trace_func.prev_tensors, result)
         return result
 
     return new_func
 
 
+def get_cache_dir() -> typing.Optional[str]:
+    """Returns the cache directory of the tracer, or None if the cache is disabled.
+    The cache directory is `~/.cache/tinynn` and can be changed with the `TINYNN_CACHE_DIR` environment variable.
+    Setting it to an empty string disables the cache."""
+    return os.environ.get('TINYNN_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'tinynn')) or None
+
+
+def override_cache_path(config: str) -> typing.Optional[str]:
+    """Returns the path of the cached override table for a config file, or None if the cache is disabled"""
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return None
+    config_name = os.path.splitext(os.path.basename(config))[0]
+    path_key = '%08x' % (zlib.crc32(os.path.abspath(config).encode()) & 0xFFFFFFFF)
+    return os.path.join(cache_dir, f'{config_name}_{path_key}.pkl')
+
+
+def load_override_table(config: str, resolver: typing.Callable[[typing.Dict], typing.List]) -> typing.List:
+    """Loads the resolved override table of a config file. The table is cached on disk, keyed on the versions of
+    the cache format and PyTorch and the modification time of the config file, so that the YAML parsing and the
+    lookups of the namespaces can be skipped in the later runs.
+
+    Args:
+        config (str): The path of the config file
+        resolver (typing.Callable[[typing.Dict], typing.List]): The function that resolves the parsed config into a
+            table, which should only contain builtin types
+
+    Returns:
+        typing.List: The resolved table
+    """
+
+    stat = os.stat(config)
+    key = (OVERRIDE_CACHE_VERSION, torch.__version__, stat.st_mtime_ns, stat.st_size)
+
+    cache_path = override_cache_path(config)
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached_key, table = pickle.load(f)
+            if cached_key == key:
+                return table
+        except Exception as e:
+            log.debug(f'Failed to load the cached override table {cache_path}: {e}')
+
+    with open(config, 'r') as f:
+        module_dict = yaml.load(f, getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    table = resolver(module_dict)
+
+    if cache_path is not None:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((key, table), f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            log.debug(f'Failed to write the cached override table {cache_path}: {e}')
+
+    return table
+
+
+def resolve_modules(
+    module_dict: typing.Dict[str, typing.List[str]]
+) -> typing.List[typing.Tuple[str, typing.List[str]]]:
+    """Resolves the module config into a list of (namespace, available module names)"""
+    table = []
+    for ns, module_names in module_dict.items():
+        try:
+            scope = importlib.import_module(ns)
+        except ImportError:
+            continue
+        table.append((ns, [n for n in module_names if hasattr(scope, n)]))
+    return table
+
+
+def resolve_funcs(
+    module_dict: typing.Dict[str, typing.List[str]]
+) -> typing.List[typing.Tuple[str, typing.Optional[str], typing.List[str]]]:
+    """Resolves the function config into a list of (module name, optional type name, available function names)"""
+    table = []
+    for ns, func_names in module_dict.items():
+        log.debug(f'Attempting to load {ns}')
+        try:
+            spec = importlib.util.find_spec(ns)
+        except ImportError:
+            continue
+        typename = None
+        if spec is None:
+            parts = ns.split('.')
+            ns = '.'.join(parts[:-1])
+            typename = parts[-1]
+            spec = importlib.util.find_spec(ns)
+            if spec is None:
+                log.warning(f"Error importing {ns}, which may not be a module")
+                continue
+            scope = importlib.import_module(ns)
+            if hasattr(scope, typename):
+                scope = getattr(scope, typename)
+            else:
+                log.warning(f"Error importing {ns}.{typename}")
+                continue
+        else:
+            scope = importlib.import_module(ns)
+        table.append((ns, typename, [n for n in func_names if hasattr(scope, n)]))
+    return table
+
+
 def fetch_modules(config: typing.Optional[str] = None):
     """Fetches the functions from the config."""
     if config is None:
         config = os.path.join(current_dir, 'configs/torch_module_override.yml')
     modules = []
-    with open(config, 'r') as f:
-        module_dict = yaml.load(f, yaml.SafeLoader)
-        for ns, module_names in module_dict.items():
-            try:
-                scope = importlib.import_module(ns)
-            except ImportError:
-                pass
-            for module_name in module_names:
-                if hasattr(scope, module_name):
-                    module = getattr(scope, module_name)
-                    modules.append(module)
-                    importable_module_names[module] = f'{ns}.{module_name}'
-                    if hasattr(module, '__init__'):
-                        constructor = module.__init__
-                        module_constructor_signatures[module] = inspect.signature(constructor).parameters.values()
+    for ns, module_names in load_override_table(config, resolve_modules):
+        scope = importlib.import_module(ns)
+        for module_name in module_names:
+            if hasattr(scope, module_name):
+                module = getattr(scope, module_name)
+                modules.append(module)
+                importable_module_names[module] = f'{ns}.{module_name}'
+                if hasattr(module, '__init__'):
+                    constructor = module.__init__
+                    module_constructor_signatures[module] = inspect.signature(constructor).parameters.values()
     return modules
 
 
@@ -1178,38 +1437,17 @@ def fetch_funcs(config: typing.Optional[str] = None):
             version_parts = ['1', '6']
         version_str = '_'.join(version_parts[:2])
         config = os.path.join(current_dir, f'configs/torch_func_override_{version_str}.yml')
-    modules = []
-    with open(config, 'r') as f:
-        module_dict = yaml.load(f, yaml.SafeLoader)
-        new_dict = {}
-        for ns, module_names in module_dict.items():
-            log.debug(f'Attempting to load {ns}')
-            try:
-                spec = importlib.util.find_spec(ns)
-            except ImportError:
-                continue
-            if spec is None:
-                modules = ns.split('.')
-                ns = '.'.join(modules[:-1])
-                typename = modules[-1]
-                spec = importlib.util.find_spec(ns)
-                if spec is None:
-                    log.warning(f"Error importing {ns}, which may not be a module")
-                    continue
-                scope = importlib.import_module(ns)
-                if hasattr(scope, typename):
-                    scope = getattr(scope, typename)
-                else:
-                    log.warning(f"Error importing {ns}.{typename}")
-                    continue
-            else:
-                scope = importlib.import_module(ns)
-            modules = []
-            for module_name in module_names:
-                if hasattr(scope, module_name):
-                    modules.append(module_name)
-                    importable_module_names[getattr(scope, module_name)] = f'{ns}.{module_name}'
-            new_dict[scope] = modules
+    new_dict = {}
+    for ns, typename, func_names in load_override_table(config, resolve_funcs):
+        scope = importlib.import_module(ns)
+        if typename is not None:
+            scope = getattr(scope, typename)
+        modules = []
+        for func_name in func_names:
+            if hasattr(scope, func_name):
+                modules.append(func_name)
+                importable_module_names[getattr(scope, func_name)] = f'{ns}.{func_name}'
+        new_dict[scope] = modules
     return new_dict
 
 
@@ -1509,6 +1747,9 @@ def add_input_node(node: TraceNode, output_tensors):
     current_graph().input_nodes.append(node)
     current_graph().nodes_map[node.unique_name] = node
 
+    if current_graph().metadata_only:
+        current_graph().strip_node_tensors(node)
+
 
 def add_constant_node(node: TraceNode, output_tensor):
     """Adds a constant node to the current computation graph"""
@@ -1547,6 +1788,9 @@ def add_output_node(node: TraceNode, input_tensors):
     current_graph().output_nodes.append(node)
     current_graph().nodes_map[node.unique_name] = node
 
+    if current_graph().metadata_only:
+        current_graph().strip_node_tensors(node)
+
 
 def add_forward_node(node: TraceNode, input_tensors, output_tensors):
     """Adds a forward node to the current computation graph"""
@@ -1629,12 +1873,21 @@ def add_forward_node(node: TraceNode, input_tensors, output_tensors):
     current_graph().forward_nodes.append(node)
     current_graph().nodes_map[node.unique_name] = node
 
+    if current_graph().metadata_only:
+        current_graph().strip_node_tensors(node)
+
 
 @contextlib.contextmanager
 def hook_modules(module):
     """Temporarily adds the hooks to a `nn.Module` for tracing"""
     hooks = []
 
+    def _scope_pre_tracer(module, inputs):
+        current_graph().scope_stack.append(current_graph().module_original_name_dict.get(id(module), None))
+
+    def _scope_tracer(module, inputs, outputs):
+        current_graph().scope_stack.pop()
+
     def register_submodule_tracer(module):
         def _submodule_pre_tracer(module, input):
             log.debug(f'pre tracer in _submodule_pre_tracer in {type(module).__name__}')
@@ -1684,6 +1937,9 @@ def hook_modules(module):
             hooks.append(module.register_forward_pre_hook(_submodule_pre_tracer))
             hooks.append(module.register_forward_hook(_submodule_tracer))
             current_graph().related_modules.append(module_unique_name)
+        else:
+            hooks.append(module.register_forward_pre_hook(_scope_pre_tracer))
+            hooks.append(module.register_forward_hook(_scope_tracer))
 
         current_graph().traced_modules.append(module_unique_name)
         return None
@@ -1781,10 +2037,10 @@ def model_tracer():
 
 @contextlib.contextmanager
 def construct_trace_graph(
-    module, dummy_input: torch.Tensor, eliminate_dead_graph: bool, patch_torch_size: bool
+    module, dummy_input: torch.Tensor, eliminate_dead_graph: bool, patch_torch_size: bool, metadata_only: bool = False
 ) -> 'TraceGraph':
     """Simple context manager for creating a new TraceGraph"""
-    current_graph(TraceGraph(module, dummy_input, eliminate_dead_graph, patch_torch_size))
+    current_graph(TraceGraph(module, dummy_input, eliminate_dead_graph, patch_torch_size, metadata_only))
     yield current_graph.get_value()
     current_graph(None)
 
@@ -1806,6 +2062,103 @@ def import_patcher():
                 yield True
 
 
+class TraceGraphPickler(pickle.Pickler):
+    """Pickler for `TraceGraph`, which stores the references to the nodes, the submodules, the parameters and the
+    activations as persistent ids"""
+
+    def __init__(self, file, node_indices, module_names, tensor_names, data_names, activations, device_dict):
+        super().__init__(file)
+        self.node_indices = node_indices
+        self.module_names = module_names
+        self.tensor_names = tensor_names
+        self.data_names = data_names
+        self.activations = activations
+        self.device_dict = device_dict
+
+    def persistent_id(self, obj):
+        if type(obj) == TraceNode:
+            return ('node', self.node_indices[id(obj)])
+        elif isinstance(obj, nn.Module):
+            name = self.module_names.get(id(obj), None)
+            if name is not None:
+                return ('module', name)
+        elif isinstance(obj, torch.Tensor):
+            key = id(obj)
+            if key in self.tensor_names:
+                return ('tensor', self.tensor_names[key])
+            elif key in self.data_names:
+                return ('data', self.data_names[key])
+            elif key in self.activations:
+                device = self.device_dict.get(key, obj.device)
+                return ('activation', key, tuple(obj.shape), str(obj.dtype), str(device))
+        return None
+
+
+class TraceGraphUnpickler(pickle.Unpickler):
+    """Unpickler for `TraceGraph`, which resolves the persistent ids with the given module. The activations are
+    restored as meta tensors."""
+
+    def __init__(self, file, module):
+        super().__init__(file)
+        self.nodes = {}
+        self.modules = dict(module.named_modules())
+        self.tensors = dict(module.named_parameters())
+        self.tensors.update(module.named_buffers())
+        self.data = {}
+        self.activations = {}
+        self.device_dict = {}
+
+    def node(self, index):
+        if index not in self.nodes:
+            self.nodes[index] = TraceNode.__new__(TraceNode)
+        return self.nodes[index]
+
+    def persistent_load(self, pid):
+        kind = pid[0]
+        if kind == 'node':
+            return self.node(pid[1])
+        elif kind == 'module':
+            return self.modules[pid[1]]
+        elif kind == 'tensor':
+            return self.tensors[pid[1]]
+        elif kind == 'data':
+            if pid[1] not in self.data:
+                self.data[pid[1]] = self.tensors[pid[1]].data
+            return self.data[pid[1]]
+        elif kind == 'activation':
+            key, shape, dtype, device = pid[1:]
+            if key not in self.activations:
+                tensor = torch.empty(shape, dtype=getattr(torch, dtype.split('.')[-1]), device='meta')
+                self.activations[key] = tensor
+                self.device_dict[id(tensor)] = torch.device(device)
+            return self.activations[key]
+        else:
+            raise pickle.UnpicklingError(f'Unknown persistent id: {pid}')
+
+
+class RepeatedBlock(object):
+    """A group of isomorphic subgraphs, which are the calls to the container modules of the same structure"""
+
+    def __init__(
+        self,
+        scopes: typing.List[str],
+        nodes: typing.List[typing.List[TraceNode]],
+        inputs: typing.List[typing.List[TraceNode]],
+        outputs: typing.List[int],
+    ):
+        # The original names of the container modules
+        self.scopes = scopes
+
+        # The nodes of the instances, which are aligned with the ones of the first instance (the template)
+        self.nodes = nodes
+
+        # The nodes outside the instances whose outputs are used in the instances
+        self.inputs = inputs
+
+        # The positions of the nodes whose outputs are used outside the instances
+        self.outputs = outputs
+
+
 class TraceGraph(object):
     """A data structure for storing a computation graph"""
 
@@ -1822,19 +2175,49 @@ class TraceGraph(object):
     nodes_map: typing.Dict[str, TraceNode]
     tensor_pre_node_dict: typing.Dict[int, str]
     tensor_pre_index_dict: typing.Dict[int, int]
+    meta_tensor_dict: typing.Dict[int, torch.Tensor]
+    tensor_device_dict: typing.Dict[int, torch.device]
     module: torch.nn.Module
     dummy_input: torch.Tensor
     eliminate_dead_graph: bool
+    metadata_only: bool
     inited: bool
     quantized: bool
     code: str
 
+    # The dicts that are keyed by the ids of the objects, which need to be remapped when the graph is serialized
+    ID_KEYED_ATTRS = (
+        'module_unique_name_dict',
+        'module_original_name_dict',
+        'parameter_original_name_dict',
+        'parameter_unique_name_dict',
+        'tensor_pre_node_dict',
+        'tensor_pre_index_dict',
+    )
+
+    # The attributes that are not serialized as is
+    UNSERIALIZABLE_ATTRS = ID_KEYED_ATTRS + (
+        'module',
+        'dummy_input',
+        'parameter_module_dict',
+        'tensor_parameter_dict',
+        'meta_tensor_dict',
+        'tensor_device_dict',
+        'compiled_program',
+        'forward_node_ids',
+        'pending_nodes_before',
+        'pending_nodes_after',
+        'pending_removed_nodes',
+        'pending_new_nodes',
+    )
+
     def __init__(
         self,
         module: torch.nn.Module,
         dummy_input: torch.Tensor,
         eliminate_dead_graph: bool = False,
         patch_torch_size: bool = False,
+        metadata_only: bool = False,
     ):
         # Used for function / node numbering
         self.global_functions = {}
@@ -1874,6 +2257,12 @@ class TraceGraph(object):
         # Recording the tensor object of the parameters
         self.tensor_parameter_dict = {}
 
+        # Mapping between the activation tensors and their meta counterparts (only for `metadata_only`)
+        self.meta_tensor_dict = {}
+
+        # Recording the original device of the meta tensors (only for `metadata_only`)
+        self.tensor_device_dict = {}
+
         # Input module
         if isinstance(module, DataParallel) or isinstance(module, DistributedDataParallel):
             log.error(
@@ -1907,6 +2296,92 @@ class TraceGraph(object):
         # Tracer options
         self.patch_torch_size = patch_torch_size
 
+        # Whether to drop the values of the activation tensors after each node is traced
+        self.metadata_only = metadata_only
+
+        # The compiled program for `__call__`
+        self.compiled_program = None
+
+        # The names of the container modules that are being called during tracing
+        self.scope_stack = []
+
+    @property
+    def forward_nodes(self) -> typing.List[TraceNode]:
+        """The nodes in the forward function, in the order of execution"""
+        if self.pending_nodes_before or self.pending_nodes_after or self.pending_removed_nodes:
+            self.__apply_pending_edits()
+
+        # The list may be modified by the caller, so the ids are collected again on the next edit
+        self.forward_node_ids = None
+        return self._forward_nodes
+
+    @forward_nodes.setter
+    def forward_nodes(self, nodes: typing.List[TraceNode]):
+        self._forward_nodes = nodes
+
+        # The ids of the nodes in `self._forward_nodes`, which is built lazily
+        self.forward_node_ids = None
+
+        # The edits to the forward nodes are recorded as links to the existing nodes, which are applied in one pass
+        # when `self.forward_nodes` is accessed. The insertions are keyed by the ids of the anchor nodes. The nodes
+        # with the key `None` in `self.pending_nodes_after` are inserted at the beginning and the ones in
+        # `self.pending_nodes_before` are appended at the end.
+        self.pending_nodes_before = {}
+        self.pending_nodes_after = {}
+        self.pending_removed_nodes = {}
+        self.pending_new_nodes = {}
+
+    def __apply_pending_edits(self) -> None:
+        """Applies the pending insertions and removals to the list of the forward nodes"""
+        nodes = []
+
+        # The nodes inserted before an anchor keep the order of insertion, while the ones inserted after it are
+        # reversed, which is the same as inserting them into the list one by one
+        stack = [(n, False) for n in reversed(self.pending_nodes_before.pop(None, []))]
+        stack.extend((n, False) for n in reversed(self._forward_nodes))
+        stack.extend((n, False) for n in self.pending_nodes_after.pop(None, []))
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                if id(node) not in self.pending_removed_nodes:
+                    nodes.append(node)
+            else:
+                stack.extend((n, False) for n in self.pending_nodes_after.pop(id(node), []))
+                stack.append((node, True))
+                stack.extend((n, False) for n in reversed(self.pending_nodes_before.pop(id(node), [])))
+
+        assert (
+            not self.pending_nodes_before and not self.pending_nodes_after
+        ), 'Nodes are inserted next to unknown nodes'
+
+        self.forward_nodes = nodes
+
+    def __is_forward_node(self, node: TraceNode) -> bool:
+        """Checks whether a node is a forward node with the pending edits taken into account"""
+        if id(node) in self.pending_removed_nodes:
+            return False
+        if id(node) in self.pending_new_nodes:
+            return True
+        if self.forward_node_ids is None:
+            self.forward_node_ids = set(id(n) for n in self._forward_nodes)
+        return id(node) in self.forward_node_ids
+
+    def __insert_forward_node(self, new_node: TraceNode, anchor: typing.Optional[TraceNode], after: bool) -> None:
+        """Inserts a new node next to a forward node. If `anchor` is None, the new node is inserted at the beginning
+        (`after=True`) or at the end (`after=False`)"""
+        if anchor is not None:
+            assert self.__is_forward_node(anchor), f'{anchor.unique_name} is not a forward node in TraceGraph'
+
+        pending_nodes = self.pending_nodes_after if after else self.pending_nodes_before
+        pending_nodes.setdefault(None if anchor is None else id(anchor), []).append(new_node)
+        self.pending_new_nodes[id(new_node)] = new_node
+
+    def __remove_forward_node(self, node: TraceNode) -> None:
+        """Removes a forward node"""
+        assert self.__is_forward_node(node), f'{node.unique_name} is not a forward node in TraceGraph'
+
+        self.pending_removed_nodes[id(node)] = node
+
     def all_nodes(self) -> typing.List[TraceNode]:
         """Returns all the nodes in a computation graph during forward process"""
         return self.input_nodes + self.forward_nodes + self.output_nodes + self.constant_nodes
@@ -1919,6 +2394,267 @@ class TraceGraph(object):
                     tensors[id(t)] = t
         return list(tensors.values())
 
+    def strip_tensor(self, tensor):
+        """Replaces an activation tensor with a meta tensor that only keeps its shape, dtype and device
+
+        Args:
+            tensor: The tensor (or a list / tuple of tensors) to be replaced
+
+        Returns:
+            The meta tensor (or a list / tuple of them). Other objects are returned as is.
+        """
+
+        if type(tensor) in (list, tuple):
+            return type(tensor)(self.strip_tensor(t) for t in tensor)
+
+        # Scalars are cheap and may be consumed by the user code (e.g. the sizes when `patch_torch_size=True`)
+        if type(tensor) != torch.Tensor or tensor.dim() == 0 or tensor.is_meta or tensor.is_quantized:
+            return tensor
+
+        # Constants and parameters are not activations, so they are kept as is
+        key = id(tensor)
+        pre_node_name = self.tensor_pre_node_dict.get(key, None)
+        if pre_node_name is None or isinstance(self.nodes_map[pre_node_name].module, ConstantNode):
+            return tensor
+
+        meta_tensor = self.meta_tensor_dict.get(key, None)
+        if meta_tensor is None:
+            meta_tensor = torch.empty_like(tensor, device='meta')
+            self.meta_tensor_dict[key] = meta_tensor
+            self.tensor_device_dict[id(meta_tensor)] = tensor.device
+
+            # The id of the tensor may be reused after it is freed, so the related records need to be dropped then
+            weakref.finalize(tensor, TraceGraph.__forget_tensor, weakref.ref(self), key)
+
+        # The records of the tensor may be updated by inplace ops, so we always sync them to the meta tensor
+        self.tensor_pre_node_dict[id(meta_tensor)] = pre_node_name
+        if key in self.tensor_pre_index_dict:
+            self.tensor_pre_index_dict[id(meta_tensor)] = self.tensor_pre_index_dict[key]
+        else:
+            self.tensor_pre_index_dict.pop(id(meta_tensor), None)
+
+        return meta_tensor
+
+    def strip_node_tensors(self, node: TraceNode) -> None:
+        """Replaces the activation tensors referenced by a node with meta tensors"""
+        with no_catch():
+            node.prev_tensors = self.strip_tensor(list(node.prev_tensors))
+            node.next_tensors = self.strip_tensor(list(node.next_tensors))
+            if isinstance(node.module, TraceFunction):
+                node.module.prev_tensors = self.strip_tensor(node.module.prev_tensors)
+
+    @staticmethod
+    def __forget_tensor(graph_ref, key: int) -> None:
+        """Drops the records of an activation tensor that is freed"""
+        graph = graph_ref()
+        if graph is not None:
+            graph.meta_tensor_dict.pop(key, None)
+            graph.tensor_pre_node_dict.pop(key, None)
+            graph.tensor_pre_index_dict.pop(key, None)
+
+    def materialize_tensors(self) -> None:
+        """Allocates real tensors for the meta tensors in a graph traced with `metadata_only=True` or on the meta device
+
+        The original values are not restored, as they are dropped during tracing. The new tensors are filled with
+        zeros on the original device (or the device of the module), which is enough for the consumers that overwrite
+        them before use (e.g. the channel modifier).
+        """
+
+        with no_catch():
+            default_device = get_module_device(self.module)
+
+        new_tensors = {}
+
+        def _materialize(tensor):
+            if type(tensor) in (list, tuple):
+                return type(tensor)(_materialize(t) for t in tensor)
+
+            if type(tensor) != torch.Tensor or not tensor.is_meta:
+                return tensor
+
+            key = id(tensor)
+            new_tensor = new_tensors.get(key, None)
+            if new_tensor is None:
+                device = self.tensor_device_dict.get(key, default_device)
+                new_tensor = torch.zeros(tensor.shape, dtype=tensor.dtype, device=device)
+                new_tensors[key] = new_tensor
+
+                if key in self.tensor_pre_node_dict:
+                    self.tensor_pre_node_dict[id(new_tensor)] = self.tensor_pre_node_dict.pop(key)
+                if key in self.tensor_pre_index_dict:
+                    self.tensor_pre_index_dict[id(new_tensor)] = self.tensor_pre_index_dict.pop(key)
+
+            return new_tensor
+
+        for node in self.all_nodes() + self.other_init_nodes:
+            node.prev_tensors = _materialize(list(node.prev_tensors))
+            node.next_tensors = _materialize(list(node.next_tensors))
+            if isinstance(node.module, TraceFunction):
+                node.module.prev_tensors = _materialize(node.module.prev_tensors)
+
+        self.meta_tensor_dict.clear()
+        self.tensor_device_dict.clear()
+        self.metadata_only = False
+
+    def save(self, path: str) -> None:
+        """Serializes the traced graph to a file
+
+        The submodules, the parameters and the buffers of the model are stored by their qualified names and the
+        activations are stored with only their shapes, dtypes and devices, so the file is small and can be restored
+        for the same model with `TraceGraph.load`.
+
+        Args:
+            path (str): The path of the file
+        """
+
+        assert self.inited, 'Only the traced graphs can be saved'
+
+        # Collect all the nodes, including the ones that are only reachable via the edges
+        nodes = {}
+        q = queue.Queue()
+        for node in list(self.nodes_map.values()) + self.all_nodes() + self.other_init_nodes:
+            q.put(node)
+        while not q.empty():
+            node = q.get()
+            if id(node) not in nodes:
+                nodes[id(node)] = node
+                for n in node.prev_nodes + node.next_nodes:
+                    if type(n) == TraceNode:
+                        q.put(n)
+        node_indices = {k: i for i, k in enumerate(nodes)}
+
+        module_names = {id(m): n for n, m in self.module.named_modules()}
+        tensor_names = {id(t): n for n, t in self.module.named_parameters()}
+        tensor_names.update({id(t): n for n, t in self.module.named_buffers()})
+
+        # Objects that may be referenced by the dicts keyed by ids
+        objects = {}
+
+        def _collect(obj):
+            if type(obj) in (list, tuple):
+                for o in obj:
+                    _collect(o)
+            else:
+                objects[id(obj)] = obj
+
+        for m in self.module.modules():
+            objects[id(m)] = m
+        for t in itertools.chain(self.module.parameters(), self.module.buffers()):
+            objects[id(t)] = t
+
+        data_names = {}
+        for key, ref in self.tensor_parameter_dict.items():
+            data = ref()
+            if data is not None and key in tensor_names:
+                data_names[id(data)] = tensor_names[key]
+                objects[id(data)] = data
+
+        constants = set()
+        for node in self.constant_nodes:
+            constants.update(id(t) for t in node.next_tensors)
+
+        activations = set()
+        for node in nodes.values():
+            objects[id(node.module)] = node.module
+            tensors = [node.prev_tensors, node.next_tensors]
+            if isinstance(node.module, TraceFunction):
+                tensors.append(node.module.prev_tensors)
+            _collect(tensors)
+        for key, obj in objects.items():
+            if (
+                isinstance(obj, torch.Tensor)
+                and not isinstance(obj, nn.Parameter)
+                and obj.dim() > 0
+                and key not in tensor_names
+                and key not in data_names
+                and key not in constants
+            ):
+                activations.add(key)
+
+        id_dicts = {}
+        for attr in self.ID_KEYED_ATTRS:
+            id_dicts[attr] = [(objects[k], v) for k, v in getattr(self, attr).items() if k in objects]
+
+        state = {
+            'version': TRACE_CACHE_VERSION,
+            'attrs': {k: v for k, v in self.__dict__.items() if k not in self.UNSERIALIZABLE_ATTRS},
+            'nodes': [node.__dict__ for node in nodes.values()],
+            'id_dicts': id_dicts,
+            'parameter_module_dict': [
+                (objects[k], objects[v]) for k, v in self.parameter_module_dict.items() if k in objects and v in objects
+            ],
+            'tensor_parameter_dict': [
+                (objects[k], ref())
+                for k, ref in self.tensor_parameter_dict.items()
+                if k in objects and ref() is not None
+            ],
+            'constructor_lines': [
+                (obj, module_constructor_lines[k])
+                for k, obj in objects.items()
+                if isinstance(obj, nn.Module) and k in module_constructor_lines
+            ],
+        }
+
+        with no_catch():
+            buffer = io.BytesIO()
+            TraceGraphPickler(
+                buffer, node_indices, module_names, tensor_names, data_names, activations, self.tensor_device_dict
+            ).dump(state)
+
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, module: torch.nn.Module, dummy_input: torch.Tensor) -> 'TraceGraph':
+        """Restores a graph saved with `TraceGraph.save` for the given model
+
+        The activations are restored as meta tensors (see `TraceGraph.materialize_tensors`).
+
+        Args:
+            path (str): The path of the file
+            module (torch.nn.Module): The model that is traced, which should have the same structure as the one that
+                generates the file
+            dummy_input (torch.Tensor): The dummy input for the model
+
+        Returns:
+            TraceGraph: The restored graph
+        """
+
+        with no_catch():
+            with open(path, 'rb') as f:
+                unpickler = TraceGraphUnpickler(f, module)
+                state = unpickler.load()
+
+        assert state['version'] == TRACE_CACHE_VERSION, f'Unsupported version of the trace file: {state["version"]}'
+
+        graph = cls.__new__(cls)
+        graph.__dict__.update(state['attrs'])
+        graph.module = module
+        graph.dummy_input = dummy_input
+
+        for attr, items in state['id_dicts'].items():
+            setattr(graph, attr, {id(k): v for k, v in items})
+        graph.parameter_module_dict = {id(k): id(v) for k, v in state['parameter_module_dict']}
+        graph.tensor_parameter_dict = {id(k): weakref.ref(v) for k, v in state['tensor_parameter_dict']}
+        graph.meta_tensor_dict = {}
+        graph.tensor_device_dict = unpickler.device_dict
+        graph.compiled_program = None
+        graph.forward_nodes = graph._forward_nodes
+
+        for i, node_dict in enumerate(state['nodes']):
+            unpickler.node(i).__dict__.update(node_dict)
+
+        for obj, line in state['constructor_lines']:
+            module_constructor_lines[id(obj)] = line
+            module_constructor_weakrefs[id(obj)] = weakref.ref(obj)
+
+        return graph
+
     def __tag_nodes(self) -> None:
         """Gives the modules and the submodules a unique name"""
         # Tag submodules
@@ -2229,6 +2965,139 @@ class TraceGraph(object):
         missing_inputs = set(actual_starts) - set(start_nodes)
         assert len(missing_inputs) == 0, f"Not a subgraph, missing inputs: {missing_inputs}"
 
+    def find_repeated_blocks(self) -> typing.List[RepeatedBlock]:
+        """Finds the calls to the container modules that share the same structure, i.e. the module nodes have the
+        same constructors and weight shapes, the function nodes have the same expressions and the nodes are connected
+        in the same way. Only the outermost ones are kept.
+
+        Returns:
+            typing.List[RepeatedBlock]: The groups of the repeated blocks, ordered by the first appearance
+        """
+
+        positions = {n.unique_name: i for i, n in enumerate(self.forward_nodes)}
+        module_counts = {}
+        for n in self.forward_nodes:
+            if isinstance(n.module, nn.Module):
+                module_counts[id(n.module)] = module_counts.get(id(n.module), 0) + 1
+
+        # The nodes of each scope (including the nested ones)
+        scope_nodes = {}
+        for n in self.forward_nodes:
+            if not n.scope_name:
+                continue
+            for i in range(1, len(n.scope_name) + 1):
+                if i == len(n.scope_name) or n.scope_name[i] in '.[':
+                    scope_nodes.setdefault(n.scope_name[:i], []).append(n)
+
+        def _index_key(index):
+            if isinstance(index, list):
+                return tuple(index)
+            return index
+
+        def _signature(nodes):
+            """Returns the structural signature, the external inputs and the outputs of the scope"""
+            start = positions[nodes[0].unique_name]
+            if positions[nodes[-1].unique_name] - start + 1 != len(nodes):
+                return None
+
+            node_pos = {n.unique_name: i for i, n in enumerate(nodes)}
+            module_pos = {}
+            input_pos = {}
+            inputs = []
+            items = []
+            for i, n in enumerate(nodes):
+                if isinstance(n.module, nn.Module):
+                    # The modules may be called multiple times, but only in the block
+                    if id(n.module) in module_pos:
+                        label = module_pos[id(n.module)]
+                    else:
+                        module_pos[id(n.module)] = i
+                        line = module_constructor_lines.get(id(n.module), None)
+                        if line is None:
+                            line = repr(n.module)
+                        shapes = tuple((k, tuple(v.shape), str(v.dtype)) for k, v in n.module.state_dict().items())
+                        label = (qualified_name(type(n.module)), line, shapes)
+                elif type(n.module) == TraceFunction:
+                    if n.module.full_name.startswith('self.'):
+                        return None
+                    label = (n.module.full_name, n.module.extra_expr('args'))
+                else:
+                    return None
+
+                refs = []
+                for i, pn in enumerate(n.prev_nodes):
+                    index = _index_key(n.prev_indices[i])
+                    if pn.unique_name in node_pos:
+                        refs.append((node_pos[pn.unique_name], index))
+                        continue
+
+                    # The constants and the modules outside the block are referenced by name, so they cannot be
+                    # passed in. Also, the inplace operations on the inputs are not supported.
+                    if pn.unique_name not in positions and pn not in self.input_nodes:
+                        return None
+                    if type(pn.module) == torch.nn.quantized.FloatFunctional:
+                        return None
+                    if type(n.module) == TraceFunction:
+                        if isinstance(pn.module, nn.Module) and n.module.is_property:
+                            return None
+                        if i == 0 and n.module.func_type.startswith('__i'):
+                            return None
+
+                    if pn.unique_name not in input_pos:
+                        input_pos[pn.unique_name] = len(inputs)
+                        inputs.append(pn)
+                    refs.append((-1 - input_pos[pn.unique_name], index))
+
+                items.append((label, tuple(refs)))
+
+            for mod_id in module_pos:
+                if module_counts[mod_id] != sum((1 for n in nodes if id(n.module) == mod_id)):
+                    return None
+
+            outputs = []
+            for i, n in enumerate(nodes):
+                if any((nn_.unique_name not in node_pos for nn_ in n.next_nodes)):
+                    outputs.append(i)
+
+            if len(outputs) == 0:
+                return None
+
+            return (tuple(items), tuple(outputs), len(inputs)), inputs, outputs
+
+        groups = {}
+        for scope, nodes in scope_nodes.items():
+            res = _signature(nodes)
+            if res is not None:
+                key, inputs, outputs = res
+                groups.setdefault(key, []).append((scope, nodes, inputs, outputs))
+
+        # Keep the outermost blocks, and the ones with more nodes first
+        candidates = sorted(
+            (v for v in groups.values() if len(v) > 1), key=lambda x: (min(s.count('.') for s, *_ in x), -len(x[0][1]))
+        )
+
+        visited = set()
+        blocks = []
+        for group in candidates:
+            instances = []
+            for scope, nodes, inputs, outputs in group:
+                names = set(n.unique_name for n in nodes)
+                if len(names & visited) == 0:
+                    instances.append((scope, nodes, inputs, outputs))
+                    visited.update(names)
+
+            if len(instances) > 1:
+                block = RepeatedBlock(
+                    [i[0] for i in instances], [i[1] for i in instances], [i[2] for i in instances], instances[0][3]
+                )
+                blocks.append(block)
+            else:
+                for _, nodes, _, _ in instances:
+                    visited.difference_update(n.unique_name for n in nodes)
+
+        blocks.sort(key=lambda b: positions[b.nodes[0][0].unique_name])
+        return blocks
+
     @contextlib.contextmanager
     def __numbering_context(self):
         """A simple context manager for numbering nodes"""
@@ -2237,119 +3106,181 @@ class TraceGraph(object):
         self.global_functions.clear()
         self.global_nodes.clear()
 
-    def __gen_init_code(self) -> str:
-        """Generates the code for the init function for a `nn.Module`"""
+    def __gen_init_line(self, node: TraceNode, mod_cache_dict: typing.Dict) -> typing.Optional[str]:
+        """Generates the line in the init function for a node"""
+        if id(node.module) in module_constructor_lines:
+            root_ns = qualified_name(node.type()).split('.')[0]
+            if isinstance(node.module, TraceFunction) and (
+                node.module.full_name.startswith('torch.')
+                or node.module.full_name.startswith('self.')
+                or '.' not in node.module.full_name
+            ):
+                return None
+            self.used_namespaces.add(root_ns)
+            orig_constructor_line = module_constructor_lines[id(node.module)]
+            line = f'        self.{node.unique_name} = {orig_constructor_line}'
+        elif type(node.module) == ConstantNode:
+            # Parameter generation
+            self.used_namespaces.add('torch')
+
+            requires_grad_prop = ''
+            if node.module.is_parameter != node.module.requires_grad:
+                requires_grad_prop = f', requires_grad={node.module.requires_grad}'
+
+            if node.module.is_parameter:
+                line = (
+                    f'        self.register_parameter("{node.unique_name}",'
+                    f' torch.nn.Parameter(torch.empty({node.module.shape}, dtype={node.module.dtype})'
+                    f'{requires_grad_prop}))'
+                )
+            elif node.module.is_persistent:
+                line = (
+                    f'        self.register_buffer("{node.unique_name}", torch.empty({node.module.shape},'
+                    f' dtype={node.module.dtype}{requires_grad_prop}))'
+                )
+            else:
+                line = (
+                    f'        self.register_buffer("{node.unique_name}", torch.tensor({node.module.data_str},'
+                    f' dtype={node.module.dtype}{requires_grad_prop}), persistent=False)'
+                )
+        elif type(node.module) != TraceFunction:
+            # Generate the module even if the constructor is not caught
+            log.info(
+                f'the constructor of the module {node.unique_name} of type {type(node.module).__name__} is not'
+                ' traced, trying the experimental way'
+            )
+            root_ns = qualified_name(node.type()).split('.')[0]
+            self.used_namespaces.add(root_ns)
+            orig_constructor_line, mod_cache = gen_module_constrctor_line(node.module, mod_cache_dict)
+            line = f'        self.{node.unique_name} = {orig_constructor_line}'
+            mod_cache_dict.update(mod_cache)
+        else:
+            return None
+
+        return line
+
+    def __gen_init_code(
+        self, nodes: typing.Optional[typing.List[TraceNode]] = None, blocks: typing.Optional[typing.Dict] = None
+    ) -> str:
+        """Generates the code for the init function for a `nn.Module`
+
+        Args:
+            nodes (typing.Optional[typing.List[TraceNode]], optional): The nodes to generate the code for. Defaults to
+                all the nodes in the graph
+            blocks (typing.Optional[typing.Dict], optional): The mapping from the first node of the repeated blocks
+                to the name and the class name of the instance. Defaults to None
+        """
+        if nodes is None:
+            nodes = self.constant_nodes + self.forward_nodes + self.other_init_nodes
+
         generated_node = []
         lines = []
         mod_ids = []
         mod_cache_dict = dict()
-        for node in self.constant_nodes + self.forward_nodes + self.other_init_nodes:
+        block_nodes = set()
+        if blocks is not None:
+            for instance in blocks.values():
+                block_nodes.update(n.unique_name for n in instance[2])
+
+        for node in nodes:
             if node.unique_name in generated_node or id(node.module) in mod_ids:
                 log.info(f"skip dumplicate node code gen {node.unique_name}")
                 continue
 
             generated_node.append(node.unique_name)
             mod_ids.append(id(node.module))
-            if id(node.module) in module_constructor_lines:
-                root_ns = qualified_name(node.type()).split('.')[0]
-                if isinstance(node.module, TraceFunction) and (
-                    node.module.full_name.startswith('torch.')
-                    or node.module.full_name.startswith('self.')
-                    or '.' not in node.module.full_name
-                ):
-                    continue
-                self.used_namespaces.add(root_ns)
-                orig_constructor_line = module_constructor_lines[id(node.module)]
-                line = f'        self.{node.unique_name} = {orig_constructor_line}'
-                lines.append(line)
-            elif type(node.module) == ConstantNode:
-                # Parameter generation
-                self.used_namespaces.add('torch')
 
-                requires_grad_prop = ''
-                if node.module.is_parameter != node.module.requires_grad:
-                    requires_grad_prop = f', requires_grad={node.module.requires_grad}'
+            if node.unique_name in block_nodes:
+                if node.unique_name in blocks:
+                    name, class_name = blocks[node.unique_name][:2]
+                    lines.append(f'        self.{name} = {class_name}()')
+                continue
 
-                if node.module.is_parameter:
-                    line = (
-                        f'        self.register_parameter("{node.unique_name}",'
-                        f' torch.nn.Parameter(torch.empty({node.module.shape}, dtype={node.module.dtype})'
-                        f'{requires_grad_prop}))'
-                    )
-                elif node.module.is_persistent:
-                    line = (
-                        f'        self.register_buffer("{node.unique_name}", torch.empty({node.module.shape},'
-                        f' dtype={node.module.dtype}{requires_grad_prop}))'
-                    )
-                else:
-                    line = (
-                        f'        self.register_buffer("{node.unique_name}", torch.tensor({node.module.data_str},'
-                        f' dtype={node.module.dtype}{requires_grad_prop}), persistent=False)'
-                    )
+            line = self.__gen_init_line(node, mod_cache_dict)
+            if line is not None:
                 lines.append(line)
-            elif type(node.module) != TraceFunction:
-                # Generate the module even if the constructor is not caught
-                log.info(
-                    f'the constructor of the module {node.unique_name} of type {type(node.module).__name__} is not'
-                    ' traced, trying the experimental way'
-                )
-                root_ns = qualified_name(node.type()).split('.')[0]
-                self.used_namespaces.add(root_ns)
-                orig_constructor_line, mod_cache = gen_module_constrctor_line(node.module, mod_cache_dict)
-                line = f'        self.{node.unique_name} = {orig_constructor_line}'
-                lines.append(line)
-                mod_cache_dict.update(mod_cache)
 
         block = "\n".join(lines)
         return block
 
-    def __gen_forward_code(self, inplace=False) -> str:
-        """Generates the code for the forward function for a `nn.Module`"""
+    def __gen_forward_line(self, node: TraceNode, inplace: bool, mod_name_dict: typing.Dict) -> typing.Optional[str]:
+        """Generates the line in the forward function for a node"""
+        output = ", ".join([node.unique_name])
+        param = ", ".join([node.prev_node_unique_name(i, inplace) for i in range(len(node.prev_nodes))])
+
+        if type(node.module) == TraceFunction:
+            full_name = node.full_name()
+            if not full_name.startswith('torch.') and not full_name.startswith('self.') and '.' in full_name:
+                ns = '.'.join(full_name.split('.')[:-1])
+                self.used_namespaces.add(ns)
+            first_arg = None
+            if node.is_class():
+                first_arg = node.prev_node_unique_name(0, inplace)
+            if node.type().startswith('__i') and node.type().endswith('__'):
+                inner_op = node.module.func_type[3:-2]
+                if inner_op in SPECIAL_OPERATORS:
+                    node.module.func_type = f'__{inner_op}__'
+                    parts = node.module.full_name.split('.')[:-1] + [node.module.func_type]
+                    node.module.full_name = '.'.join(parts)
+                    if first_arg is not None:
+                        alias = first_arg
+                    else:
+                        alias = node.module.get_tensor_name(0, inplace)
+                    node.module.add_alias(alias)
+            aliases = node.module.get_aliases()
+            prefix = ''
+            if aliases is not None:
+                prefix = ''.join([f'{x} = ' for x in aliases])
+            line = f"        {prefix}{output} = {node.module.extra_expr(first=first_arg, original=inplace)}"
+        else:
+            if inplace:
+                mod_name = node.original_name
+            else:
+                mod_name_dict.setdefault(node.module, node.unique_name)
+                mod_name = mod_name_dict[node.module]
+            if len(node.prev_tensors) == 0 and len(node.next_tensors) == 0:
+                return None
+            if node.type() == nn.LSTM and len(node.prev_nodes) == 3 and len(node.prev_tensors) == 3:
+                first_arg = node.prev_node_unique_name(0)
+                param = ", ".join([node.prev_node_unique_name(i) for i in range(1, len(node.prev_nodes))])
+                line = f"        {output} = self.{mod_name}({first_arg}, ({param}))"
+            else:
+                line = f"        {output} = self.{mod_name}({param})"
+
+        return line
+
+    def __gen_forward_code(self, inplace=False, blocks: typing.Optional[typing.Dict] = None) -> str:
+        """Generates the code for the forward function for a `nn.Module`
+
+        Args:
+            inplace (bool, optional): Whether to use the original names of the modules. Defaults to False
+            blocks (typing.Optional[typing.Dict], optional): The mapping from the first node of the repeated blocks
+                to the name and the class name of the instance. Defaults to None
+        """
         lines = [f"    def forward(self, {','.join([i.unique_name for i in self.input_nodes])}):"]
 
+        block_nodes = set()
+        if blocks is not None:
+            for instance in blocks.values():
+                block_nodes.update(n.unique_name for n in instance[2])
+
         mod_name_dict = {}
         for node in self.forward_nodes:
-            output = ", ".join([node.unique_name])
-            param = ", ".join([node.prev_node_unique_name(i, inplace) for i in range(len(node.prev_nodes))])
-
-            if type(node.module) == TraceFunction:
-                full_name = node.full_name()
-                if not full_name.startswith('torch.') and not full_name.startswith('self.') and '.' in full_name:
-                    ns = '.'.join(full_name.split('.')[:-1])
-                    self.used_namespaces.add(ns)
-                first_arg = None
-                if node.is_class():
-                    first_arg = node.prev_node_unique_name(0, inplace)
-                if node.type().startswith('__i') and node.type().endswith('__'):
-                    inner_op = node.module.func_type[3:-2]
-                    if inner_op in SPECIAL_OPERATORS:
-                        node.module.func_type = f'__{inner_op}__'
-                        parts = node.module.full_name.split('.')[:-1] + [node.module.func_type]
-                        node.module.full_name = '.'.join(parts)
-                        if first_arg is not None:
-                            alias = first_arg
-                        else:
-                            alias = node.module.get_tensor_name(0, inplace)
-                        node.module.add_alias(alias)
-                aliases = node.module.get_aliases()
-                prefix = ''
-                if aliases is not None:
-                    prefix = ''.join([f'{x} = ' for x in aliases])
-                line = f"        {prefix}{output} = {node.module.extra_expr(first=first_arg, original=inplace)}"
-            else:
-                if inplace:
-                    mod_name = node.original_name
-                else:
-                    mod_name_dict.setdefault(node.module, node.unique_name)
-                    mod_name = mod_name_dict[node.module]
-                if len(node.prev_tensors) == 0 and len(node.next_tensors) == 0:
-                    continue
-                if node.type() == nn.LSTM and len(node.prev_nodes) == 3 and len(node.prev_tensors) == 3:
-                    first_arg = node.prev_node_unique_name(0)
-                    param = ", ".join([node.prev_node_unique_name(i) for i in range(1, len(node.prev_nodes))])
-                    line = f"        {output} = self.{mod_name}({first_arg}, ({param}))"
-                else:
-                    line = f"        {output} = self.{mod_name}({param})"
+            if node.unique_name in block_nodes:
+                if node.unique_name in blocks:
+                    name, _, nodes, outputs, inputs = blocks[node.unique_name]
+                    output = ", ".join([nodes[i].unique_name for i in outputs])
+                    param = ", ".join([n.unique_name for n in inputs])
+                    lines.append(f"        {output} = self.{name}({param})")
+
+                    for pn in inputs:
+                        if nodes[-1].forward_order >= max([n.forward_order for n in pn.next_nodes]):
+                            lines.append(f"        {pn.unique_name} = None")
+                continue
+
+            line = self.__gen_forward_line(node, inplace, mod_name_dict)
+            if line is None:
+                continue
 
             lines.append(line)
 
@@ -2370,6 +3301,39 @@ class TraceGraph(object):
 
         return block
 
+    def __gen_block_code(self, class_name: str, block: RepeatedBlock) -> str:
+        """Generates the code of the class for a repeated block, which is written with the names in the first
+        instance"""
+        nodes = block.nodes[0]
+        node_names = set(n.unique_name for n in nodes)
+
+        init_block = self.__gen_init_code(nodes)
+
+        lines = [f"    def forward(self, {', '.join([n.unique_name for n in block.inputs[0]])}):"]
+        mod_name_dict = {}
+        for node in nodes:
+            line = self.__gen_forward_line(node, False, mod_name_dict)
+            if line is None:
+                continue
+
+            lines.append(line)
+
+            for pn in {pn.unique_name: pn for pn in node.prev_nodes}.values():
+                if pn.unique_name not in node_names:
+                    continue
+                if not all((n.unique_name in node_names for n in pn.next_nodes)):
+                    continue
+                if node.forward_order == max([n.forward_order for n in pn.next_nodes]):
+                    lines.append(f"        {pn.unique_name} = None")
+
+        lines.append(f"        return {', '.join([nodes[i].unique_name for i in block.outputs])}")
+        forward_block = "\n".join(lines)
+
+        return (
+            f"class {class_name}(torch.nn.Module):\n    def __init__(self):\n        super().__init__()\n\n"
+            f"{init_block}\n\n{forward_block}\n\n\n"
+        )
+
     def __gen_import_code(self) -> str:
         """Generates the code for the import section for a `nn.Module`"""
         # TODO: Selective module importing
@@ -2395,6 +3359,7 @@ class TraceGraph(object):
         return input_block
 
     def recompute_forward_order(self):
+        self.compiled_program = None
         forward_order = 0
         for n in self.input_nodes + self.forward_nodes + self.output_nodes:
             n.forward_order = forward_order
@@ -2409,8 +3374,21 @@ class TraceGraph(object):
         output_weight_path: typing.Optional[str],
         model_name: str = 'DefaultModel',
         check: bool = False,
+        dedup_blocks: bool = False,
     ) -> bool:
-        """The main function for code generation"""
+        """The main function for code generation
+
+        Args:
+            output_script_path (typing.Optional[str]): The path to the generated script
+            output_weight_path (typing.Optional[str]): The path to the generated weights
+            model_name (str, optional): The name of the generated model. Defaults to 'DefaultModel'
+            check (bool, optional): Whether to check the outputs of the generated model. Defaults to False
+            dedup_blocks (bool, optional): Whether to generate a class for each group of the repeated blocks (e.g.
+                the residual blocks in ResNet) and reuse it for all the instances. Defaults to False
+
+        Returns:
+            bool: Whether the outputs of the generated model match the original one
+        """
 
         output_paths = (output_script_path, output_weight_path)
         for output_path in output_paths:
@@ -2420,18 +3398,49 @@ class TraceGraph(object):
             if output_dir != '' and not os.path.exists(output_dir):
                 os.makedirs(output_dir)
 
+        blocks = {}
+        class_lines = []
+        template_dict = {}
+        if dedup_blocks:
+            original_unique_name_dict = {
+                v: self.module_unique_name_dict[k]
+                for k, v in self.module_original_name_dict.items()
+                if k in self.module_unique_name_dict
+            }
+            used_names = set(self.nodes_map)
+            for i, block in enumerate(self.find_repeated_blocks()):
+                names = [original_unique_name_dict.get(scope, None) for scope in block.scopes]
+                if any((name is None or name in used_names for name in names)) or len(set(names)) != len(names):
+                    log.debug(f'Skip the repeated blocks {block.scopes} because of the name conflicts')
+                    continue
+                used_names.update(names)
+
+                class_name = f'{model_name}Block{i}'
+                class_lines.append(self.__gen_block_code(class_name, block))
+                for name, nodes, inputs in zip(names, block.nodes, block.inputs):
+                    blocks[nodes[0].unique_name] = (name, class_name, nodes, block.outputs, inputs)
+                    for node, template_node in zip(nodes, block.nodes[0]):
+                        template_dict[node.unique_name] = (name, template_node.unique_name)
+
         DummyModel = type('DummyModel', (torch.nn.Module,), {})
         dummy_model = DummyModel()
         mod_ids = set()
         for node in self.forward_nodes:
             if id(node.module) not in mod_ids:
-                setattr(dummy_model, node.unique_name, node.module)
+                if node.unique_name in template_dict:
+                    # The modules in the repeated blocks are stored under the container of the instance
+                    name, template_name = template_dict[node.unique_name]
+                    if not hasattr(dummy_model, name):
+                        setattr(dummy_model, name, nn.Module())
+                    if isinstance(node.module, nn.Module):
+                        setattr(getattr(dummy_model, name), template_name, node.module)
+                else:
+                    setattr(dummy_model, node.unique_name, node.module)
                 mod_ids.add(id(node.module))
 
         for node in self.constant_nodes:
             if node.module.is_parameter or node.module.is_persistent:
-                dtype = getattr(torch, node.module.dtype.split('.')[-1])
-                new_tensor = torch.tensor(node.module.data, dtype=dtype)
+                new_tensor = node.module.data
                 if node.module.is_parameter:
                     weight = torch.nn.Parameter(new_tensor)
                     dummy_model.register_parameter(node.unique_name, weight)
@@ -2442,12 +3451,13 @@ class TraceGraph(object):
             torch.save(dummy_model.state_dict(), output_weight_path)
             output_weight_path_str = output_weight_path.replace('\\', '\\\\')
 
-        init_block = self.__gen_init_code()
-        forward_block = self.__gen_forward_code()
+        init_block = self.__gen_init_code(blocks=blocks)
+        forward_block = self.__gen_forward_code(blocks=blocks)
         import_block = self.__gen_import_code()
         input_block = self.__gen_input_code()
 
         context = {
+            "class_block": "".join(class_lines),
             "import_block": import_block,
             "init_block": init_block,
             "forward_block": forward_block,
@@ -2558,6 +3568,7 @@ class TraceGraph(object):
 
     def update_submodule_in_node(self, node: TraceNode, module: nn.Module, inplace: bool = False):
         """update a submodule from the nodes using the module given"""
+        self.compiled_program = None
         module_name = self.module_original_name_dict[id(node.module)]
         if inplace:
             module_name = re.sub('get_submodule\\("(.*?)"\\)', '\\1', module_name)
@@ -2595,17 +3606,18 @@ class TraceGraph(object):
 
     def insert_after(self, node: TraceNode, module, next_tensors: typing.Optional[typing.List[torch.Tensor]] = None):
         """Insert a module or an existing node after a node in the computation graph"""
+        self.compiled_program = None
+
         # Create a new node and connects it to the next node/tensors
         if type(module) != TraceNode:
             new_node = TraceNode(module, cur_graph=self)
             if node in self.input_nodes or node in self.constant_nodes:
-                self.forward_nodes.insert(0, new_node)
+                self.__insert_forward_node(new_node, None, True)
             elif node in self.output_nodes:
                 log.error('You cannot insert a node after output nodes')
                 assert False
             else:
-                idx = self.forward_nodes.index(node)
-                self.forward_nodes.insert(idx + 1, new_node)
+                self.__insert_forward_node(new_node, node, True)
             self.nodes_map[new_node.unique_name] = new_node
         else:
             new_node = module
@@ -2666,6 +3678,8 @@ class TraceGraph(object):
         tensor_ptrs: typing.Optional[typing.Set[int]] = None,
     ):
         """Insert a module or an existing node between two nodes in the computation graph"""
+        self.compiled_program = None
+
         # Create a new node and connects it to the previous node/tensors
         old_unique_name = prev_node.unique_name
         is_constant_node = type(prev_node.module) in (ConstantNode, torch.nn.quantized.FloatFunctional)
@@ -2677,8 +3691,7 @@ class TraceGraph(object):
                 log.error('You cannot insert a node between two nodes that is not connected')
                 assert False
 
-            idx = self.forward_nodes.index(next_node)
-            self.forward_nodes.insert(idx, new_node)
+            self.__insert_forward_node(new_node, next_node, False)
 
             self.nodes_map[new_node.unique_name] = new_node
             new_node.prev_nodes.append(prev_node)
@@ -2784,6 +3797,8 @@ class TraceGraph(object):
         move_idx: bool = False,
     ):
         """Insert a module or an existing node before a node in the computation graph"""
+        self.compiled_program = None
+
         # Create a new node and connects it to the previous node/tensors
         if type(module) != TraceNode:
             if not isinstance(module, (tuple, list)):
@@ -2813,11 +3828,10 @@ class TraceGraph(object):
             assert False
         elif node in self.output_nodes:
             for new_node in new_nodes:
-                self.forward_nodes.append(new_node)
+                self.__insert_forward_node(new_node, None, False)
         else:
             for new_node in new_nodes:
-                idx = self.forward_nodes.index(node)
-                self.forward_nodes.insert(idx, new_node)
+                self.__insert_forward_node(new_node, node, False)
 
         for idx, new_node in enumerate(new_nodes):
             self.nodes_map[new_node.unique_name] = new_node
@@ -2888,81 +3902,150 @@ class TraceGraph(object):
             n.module.replace_tensor_name(prev_unique_name, next_unique_name)
             n.module.update_args_string()
 
+    def compile(self) -> None:
+        """Compiles the graph into a flat list of instructions for `__call__`
+
+        The intermediate tensors are stored in a list of slots, which are released right after their last use.
+        The program is dropped by the graph editing functions of `TraceGraph`. If you modify the nodes directly,
+        please call this function again.
+        """
+
+        slots = {}
+
+        def _slot(name, index):
+            key = (name, tuple(index) if isinstance(index, list) else index)
+            if key not in slots:
+                slots[key] = len(slots)
+            return slots[key]
+
+        input_slots = [_slot(n.unique_name, None) for n in self.input_nodes]
+        produced_nodes = set(n.unique_name for n in self.input_nodes + self.forward_nodes)
+
+        def _arg_spec(node):
+            arg_spec = []
+            for i, pn in enumerate(node.prev_nodes):
+                if pn.unique_name in produced_nodes:
+                    arg_spec.append((_slot(pn.unique_name, node.prev_indices[i]), None))
+                else:
+                    # Constants and the objects created in the init function, e.g. FloatFunctional
+                    arg_spec.append((-1, node.prev_tensors[i]))
+            return arg_spec
+
+        instructions = []
+        for node in sorted(self.forward_nodes, key=lambda x: x.forward_order):
+            assert len(node.prev_nodes) == len(node.prev_tensors), f'{node.unique_name}: not supported'
+
+            if isinstance(node.module, nn.Module):
+                func = node.module
+                is_module = True
+            else:
+                func = node.module.compile()
+                is_module = False
+
+            is_shape = node.type() in ('shape', 'size')
+            instructions.append([node.unique_name, func, is_module, is_shape, _arg_spec(node)])
+
+        output_specs = []
+        for node in self.output_nodes:
+            output_specs.append((_arg_spec(node), node.rev_index))
+
+        # The slots of the outputs of each node
+        outputs = {}
+        for (name, index), slot in slots.items():
+            outputs.setdefault(name, []).append((index, slot))
+
+        # Release the slots after their last use
+        last_use = {}
+        for i, (_, _, _, _, arg_spec) in enumerate(instructions):
+            for slot, _ in arg_spec:
+                if slot >= 0:
+                    last_use[slot] = i
+        for arg_spec, _ in output_specs:
+            for slot, _ in arg_spec:
+                last_use.pop(slot, None)
+        free_slots = [[] for _ in instructions]
+        for slot, i in last_use.items():
+            free_slots[i].append(slot)
+
+        program = []
+        for i, (name, func, is_module, is_shape, arg_spec) in enumerate(instructions):
+            program.append((func, is_module, is_shape, arg_spec, outputs.get(name, []), free_slots[i]))
+
+        self.compiled_program = (len(slots), input_slots, program, output_specs)
+
     def __call__(self, *args, **kwargs):
-        """Calls the function with a list of tensor inputs"""
+        """Calls the function with a list of tensor inputs
+
+        Returns:
+            The outputs of the graph. If there are multiple output nodes, a tuple is returned.
+        """
+
+        if self.compiled_program is None:
+            self.compile()
+
+        num_slots, input_slots, program, output_specs = self.compiled_program
 
         # Prepare inputs
-        tensors_map = {}
-        i = 0
+        inputs = []
         for t in args:
             if isinstance(t, (tuple, list)):
-                for rt in t:
-                    tensors_map[(f'input_{i}_f', None)] = rt
-                    i += 1
+                inputs.extend(t)
             else:
-                tensors_map[(f'input_{i}_f', None)] = t
-                i += 1
+                inputs.append(t)
 
-        # Sort nodes
-        sorted_nodes = sorted(self.forward_nodes, key=lambda x: x.forward_order)
+        assert len(inputs) == len(input_slots), f'Expected {len(input_slots)} inputs, but got {len(inputs)}'
 
-        for node in sorted_nodes:
-            # Basic info
-            op_kind = node.kind()
-            op_kind = op_kind.__name__ if isinstance(op_kind, type) else op_kind
+        values = [None] * num_slots
+        for slot, t in zip(input_slots, inputs):
+            values[slot] = t
 
-            log.debug(f'{node.unique_name}({op_kind}):')
-            log.debug('  Inputs:')
-
-            # TODO: Support the following case
-            assert len(node.prev_nodes) == len(node.prev_tensors), "not supported"
-
-            # Collect input tensors
-            prev_tensors = []
-            for i, pn in enumerate(node.prev_nodes):
-                pn_name = pn.unique_name
-                pn_idx = node.prev_indices[i]
-                log.debug(f'    {pn_name} {pn_idx}')
-                if isinstance(pn.module, ConstantNode):
-                    prev_tensors.append(node.prev_tensors[i])
-                elif (pn_name, pn_idx) in tensors_map:
-                    prev_tensors.append(tensors_map[(pn_name, pn_idx)])
-                else:
-                    assert False, f"({pn_name}, {pn_idx}) is not found in tensor dict"
-
-            node.prev_tensors = prev_tensors
+        for func, is_module, is_shape, arg_spec, output_slots, free_slots in program:
+            args = [values[slot] if slot >= 0 else value for slot, value in arg_spec]
 
             # Calculate output
-            if isinstance(node.module, nn.Module):
-                output = node.module(*prev_tensors)
+            if is_module:
+                output = func(*args)
             else:
-                output = node.module(prev_tensors)
+                output = func(args)
 
             # Shape handling
-            if node.type() in ('shape', 'size'):
-                if len(prev_tensors) == 1:
+            if is_shape:
+                if len(args) == 1:
                     output = torch.tensor(output).unbind(0)
                 else:
                     output = torch.tensor(output)
 
-            log.debug('')
-            log.debug('  Outputs:')
+            for index, slot in output_slots:
+                if index is None:
+                    values[slot] = output
+                elif isinstance(index, tuple):
+                    item = output
+                    for i in index:
+                        item = item[i]
+                    values[slot] = item
+                else:
+                    values[slot] = output[index]
 
-            # Updating output tensors
-            if isinstance(output, (list, tuple)):
-                for j, t in enumerate(output):
-                    tensors_map[(node.unique_name, j)] = t
-                    node.next_tensors[j] = t
+            for slot in free_slots:
+                values[slot] = None
+
+        outputs = []
+        for arg_spec, rev_index in output_specs:
+            tensors = [values[slot] if slot >= 0 else value for slot, value in arg_spec]
+            if rev_index:
+                outputs.append(tensors)
             else:
-                tensors_map[(node.unique_name, None)] = output
-                node.next_tensors[0] = output
+                outputs.append(tensors[0])
 
-            for i in range(len(node.next_tensors)):
-                log.debug(f'    {i}')
-            log.debug('')
+        if len(outputs) == 1:
+            return outputs[0]
+        else:
+            return tuple(outputs)
 
     def replace_node_module(self, node: TraceNode, module: torch.nn.Module) -> None:
         """Replaces a module in a node with another"""
+        self.compiled_program = None
+
         # Update unique name for node
         old_unique_name = node.unique_name
         is_constant_node = type(node.module) in (ConstantNode, torch.nn.quantized.FloatFunctional)
@@ -3006,6 +4089,7 @@ class TraceGraph(object):
         self, nodes: typing.List[TraceNode], full_name: str, kind: str, func_type: str, is_class: bool
     ) -> None:
         """Fuses several nodes into one function"""
+        self.compiled_program = None
         if len(nodes) > 1:
             # Set the full name if the first node is already a TraceFunction
             # Otherwise, we need to construct one.
@@ -3021,7 +4105,7 @@ class TraceGraph(object):
                 for node in nodes[1:]:
                     name = node.unique_name
                     del self.nodes_map[name]
-                    self.forward_nodes.remove(node)
+                    self.__remove_forward_node(node)
 
                     if id(node.module) in module_constructor_lines:
                         if id(node.module) in module_constructor_traced:
@@ -3073,7 +4157,8 @@ class TraceGraph(object):
 
     def remove_node(self, node: TraceNode) -> None:
         """Remove a node from the computation graph"""
-        if node not in self.forward_nodes:
+        self.compiled_program = None
+        if not self.__is_forward_node(node):
             log.error('Only forward nodes can be removed')
             assert False
 
@@ -3133,7 +4218,7 @@ class TraceGraph(object):
                             n.module.update_args_string()
 
         # Remove this node
-        self.forward_nodes.remove(node)
+        self.__remove_forward_node(node)
         del self.nodes_map[node.unique_name]
 
         if id(node.module) in module_constructor_lines:
@@ -3202,61 +4287,56 @@ def patch_helper(
     wrap_creation_funcs: bool = True,
     wrap_tracking_modules: bool = False,
 ):
-    """Temporarily monkeypatches the functions and the modules in PyTorch."""
-    if wrap_modules:
-        if not modules_overrided():
-            modules = load_overridable_modules()
-            modules_overrided(True)
-        else:
-            wrap_modules = False
-    if wrap_funcs:
-        if not funcs_overrided():
-            funcs = load_overridable_funcs()
-            o_funcs, o_wrappers = load_torch_overrides_funcs(funcs)
-            funcs_overrided(True)
-        else:
-            wrap_funcs = False
-    if wrap_creation_funcs:
-        if not creation_funcs_overrided():
-            creation_funcs = load_creation_funcs()
-            creation_funcs_overrided(True)
-        else:
-            wrap_creation_funcs = False
-    if wrap_tracking_modules:
-        if not tracking_modules_overrided():
-            tracking_modules = load_tracking_modules()
-            tracking_modules_overrided(True)
-        else:
-            wrap_tracking_modules = False
-    if wrap_modules:
-        module_manager = patch_modules(modules, ('__init__', '__setattr__'), (new_init_gen, new_setattr_gen))
-        module_manager.__enter__()
-    if wrap_funcs:
-        tracked_funcs = [funcs, {torch.Tensor: ['__getattribute__']}]
-        wrappers = [new_func_gen, new_getattr_gen]
-        tracked_funcs.extend(o_funcs)
-        wrappers.extend(o_wrappers)
-        func_manager = patch_funcs(tracked_funcs, wrappers)
-        func_manager.__enter__()
-    if wrap_creation_funcs:
-        creation_func_manager = patch_funcs(creation_funcs, new_creation_func_gen)
-        creation_func_manager.__enter__()
-    if wrap_tracking_modules:
-        tracking_module_manager = patch_modules(tracking_modules, '__new__', new_init_tracking_gen)
-        tracking_module_manager.__enter__()
-    yield True
-    if wrap_modules:
-        module_manager.__exit__(None, None, None)
-        modules_overrided(False)
-    if wrap_funcs:
-        func_manager.__exit__(None, None, None)
-        funcs_overrided(False)
-    if wrap_creation_funcs:
-        creation_func_manager.__exit__(None, None, None)
-        creation_funcs_overrided(False)
-    if wrap_tracking_modules:
-        tracking_module_manager.__exit__(None, None, None)
-        tracking_modules_overrided(False)
+    """Temporarily monkeypatches the functions and the modules in PyTorch.
+
+    The patches are shared by all the traces in the process. They are applied when the first trace requests them
+    and reverted when the last one exits. The wrappers only trace the calls in the contexts that request them.
+    """
+    kinds = []
+    for kind, wrap in (
+        ('modules', wrap_modules),
+        ('funcs', wrap_funcs),
+        ('creation_funcs', wrap_creation_funcs),
+        ('tracking_modules', wrap_tracking_modules),
+    ):
+        if wrap:
+            kinds.append(kind)
+
+    context_ref_counts = context_patch_ref_counts()
+    with patch_lock:
+        for kind in kinds:
+            if patch_ref_counts[kind] == 0:
+                if kind == 'modules':
+                    modules = load_overridable_modules()
+                    manager = patch_modules(modules, ('__init__', '__setattr__'), (new_init_gen, new_setattr_gen))
+                elif kind == 'funcs':
+                    funcs = load_overridable_funcs()
+                    o_funcs, o_wrappers = load_torch_overrides_funcs(funcs)
+                    tracked_funcs = [funcs, {torch.Tensor: ['__getattribute__']}]
+                    wrappers = [new_func_gen, new_getattr_gen]
+                    tracked_funcs.extend(o_funcs)
+                    wrappers.extend(o_wrappers)
+                    manager = patch_funcs(tracked_funcs, wrappers)
+                elif kind == 'creation_funcs':
+                    creation_funcs = load_creation_funcs()
+                    manager = patch_funcs(creation_funcs, new_creation_func_gen)
+                else:
+                    tracking_modules = load_tracking_modules()
+                    manager = patch_modules(tracking_modules, '__new__', new_init_tracking_gen)
+                manager.__enter__()
+                patch_managers[kind] = manager
+            patch_ref_counts[kind] += 1
+            context_ref_counts[kind] = context_ref_counts.get(kind, 0) + 1
+
+    try:
+        yield True
+    finally:
+        with patch_lock:
+            for kind in reversed(kinds):
+                context_ref_counts[kind] -= 1
+                patch_ref_counts[kind] -= 1
+                if patch_ref_counts[kind] == 0:
+                    patch_managers.pop(kind).__exit__(None, None, None)
 
 
 def check_types(values: typing.Iterable) -> bool:
@@ -3311,17 +4391,100 @@ def tensor_name_from_parts(node_name, node_idx=None, is_constant_node=False):
             return f'{ns}{node_name}[{node_idx}]'
 
 
+def trace_cache_path(
+    module: torch.nn.Module,
+    dummy_input: torch.Tensor,
+    eliminate_dead_graph: bool = False,
+    patch_torch_size: bool = False,
+    metadata_only: bool = False,
+) -> typing.Optional[str]:
+    """Returns the path of the cached trace for a model, or None if the cache is disabled
+
+    The path is content-addressed, keyed on the source files of the classes of the model and the tracer, the structure
+    of the model and its state dict, the specs of the inputs and the tracer options.
+    Please note that the attributes of the modules that affect the forward function and are not shown in their
+    representations (e.g. a plain flag in a custom module) are not included in the key.
+
+    Args:
+        module (torch.nn.Module): The model to be traced
+        dummy_input (torch.Tensor): The dummy input for the model
+        eliminate_dead_graph (bool, optional): The tracer option. Defaults to False.
+        patch_torch_size (bool, optional): The tracer option. Defaults to False.
+        metadata_only (bool, optional): The tracer option. Defaults to False.
+
+    Returns:
+        typing.Optional[str]: The path of the cached trace
+    """
+
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return None
+
+    h = hashlib.sha256()
+    options = (eliminate_dead_graph, patch_torch_size, metadata_only)
+    h.update(repr((TRACE_CACHE_VERSION, torch.__version__, options)).encode())
+
+    source_files = {os.path.abspath(__file__)}
+    for m in module.modules():
+        try:
+            source_files.add(os.path.abspath(inspect.getsourcefile(type(m))))
+        except TypeError:
+            h.update(qualified_name(type(m)).encode())
+    for source_file in sorted(source_files):
+        with open(source_file, 'rb') as f:
+            h.update(f.read())
+
+    h.update(repr(module).encode())
+    for k, v in module.state_dict().items():
+        h.update(f'{k}:{tuple(v.shape)}:{v.dtype}:{v.device.type}'.encode())
+
+    def _input_spec(obj):
+        if isinstance(obj, (list, tuple)):
+            return [_input_spec(o) for o in obj]
+        elif isinstance(obj, torch.Tensor):
+            return (tuple(obj.shape), str(obj.dtype), obj.requires_grad)
+        else:
+            return repr(obj)
+
+    h.update(repr(_input_spec(dummy_input)).encode())
+
+    return os.path.join(cache_dir, 'traces', f'{h.hexdigest()}.pkl')
+
+
 def trace(
     module: torch.nn.Module,
     dummy_input: torch.Tensor,
     eliminate_dead_graph: bool = False,
     patch_torch_size: bool = False,
+    metadata_only: bool = False,
+    use_cache: typing.Optional[bool] = None,
 ) -> TraceGraph:
-    """main function for tracing"""
+    """main function for tracing
+
+    When `use_cache` is True (defaults to the environment variable `TINYNN_TRACE_CACHE`), the traced graph is saved
+    to the cache directory and restored in the later runs if the model and the inputs are unchanged.
+    The restored graph only keeps the metadata of the activations, like the one traced with `metadata_only=True`.
+    """
+
+    if use_cache is None:
+        use_cache = os.environ.get('TINYNN_TRACE_CACHE', '0').lower() in ('1', 'true')
+
+    cache_path = None
+    if use_cache:
+        cache_path = trace_cache_path(module, dummy_input, eliminate_dead_graph, patch_torch_size, metadata_only)
+        if cache_path is not None and os.path.exists(cache_path):
+            try:
+                graph = TraceGraph.load(cache_path, module, dummy_input)
+                log.info(f'Trace graph loaded from the cache {cache_path}')
+                return graph
+            except Exception as e:
+                log.warning(f'Failed to load the cached trace graph {cache_path}: {e}')
+
     try:
-        with construct_trace_graph(module, dummy_input, eliminate_dead_graph, patch_torch_size) as new_graph:
+        with construct_trace_graph(
+            module, dummy_input, eliminate_dead_graph, patch_torch_size, metadata_only
+        ) as new_graph:
             new_graph.init()
-            return new_graph
     except Exception:
         traceback.print_exc()
         if current_graph() is not None:
@@ -3330,3 +4493,11 @@ def trace(
             log.error(f'outputs: {[n.unique_name for n in current_graph().output_nodes]}')
             log.error(f'constants: {[n.unique_name for n in current_graph().constant_nodes]}')
         quit()
+
+    if cache_path is not None:
+        try:
+            new_graph.save(cache_path)
+        except Exception as e:
+            log.warning(f'Failed to save the trace graph to the cache {cache_path}: {e}')
+
+    return new_graph